@@ -0,0 +1,93 @@
+"""Wall time of checking a batch of uploads in the request thread and on the pool.
+
+    python benchmarks/batch_ingest.py                     # 50 synthetic photos
+    python benchmarks/batch_ingest.py images/temp/        # your own photos
+    python benchmarks/batch_ingest.py --workers 2 4 8
+
+Every run checks fresh copies of the photos, so no run reuses another's
+thumbnails. Run from the repository root so config.ini is found.
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from pysrc.file_management.ingest import ingest  # noqa: E402
+from pysrc.file_management.photo_index import IMAGE_EXTENSIONS  # noqa: E402
+
+
+def make_photos(directory, count, size):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"photo-{i}.jpg")
+        Image.effect_noise(size, 64 + i % 32).convert("RGB").save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def timed(photos, workers, directory):
+    """Copies the photos into a fresh upload directory and ingests them."""
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    stored = []
+    for photo in photos:
+        path = os.path.join(directory, os.path.basename(photo))
+        shutil.copyfile(photo, path)
+        stored.append((os.path.basename(photo), path))
+    started = time.perf_counter()
+    results = ingest(stored, workers=workers)
+    elapsed = time.perf_counter() - started
+    assert all(result.ok for result in results)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", help="benchmark the photos in here")
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--size", type=int, nargs=2, default=(4000, 3000))
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.directory:
+            # absolute, since the working directory changes below; only photos,
+            # not the thumbnails and other files an upload tray collects
+            directory = os.path.abspath(args.directory)
+            photos = sorted(
+                path
+                for path in glob.glob(os.path.join(directory, "*"))
+                if path.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not photos:
+                parser.error(f"no photos in {args.directory}")
+        else:
+            photos = make_photos(tmp, args.count, tuple(args.size))
+        # thumbnails land in the configured cache, relative to the working
+        # directory, so keep them out of the repository
+        os.chdir(tmp)
+        uploads = os.path.join(tmp, "uploads")
+
+        baseline = timed(photos, 0, uploads)
+        print(
+            f"{'serial':>10}: {baseline:7.2f} s, "
+            f"{baseline / len(photos) * 1000:7.1f} ms/photo"
+        )
+        for workers in args.workers:
+            elapsed = timed(photos, workers, uploads)
+            print(
+                f"{workers:>2} threads: {elapsed:7.2f} s, "
+                f"{elapsed / len(photos) * 1000:7.1f} ms/photo, "
+                f"{baseline / elapsed:4.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
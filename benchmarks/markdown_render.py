@@ -0,0 +1,74 @@
+"""Compares building a Markdown instance per post with the per-thread renderer.
+
+    python benchmarks/markdown_render.py            # built-in sample posts
+    python benchmarks/markdown_render.py data/      # every post under data/
+
+Run from the repository root so config.ini is found.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown  # noqa: E402
+from pysrc.rendering import markdown_extensions, render_markdown  # noqa: E402
+
+# the kinds of post the test suite writes: notes, tagged notes, albums, code
+SAMPLE_POSTS = [
+    "Content of a short note",
+    "This #post has #multiple hashtags and some *emphasis*",
+    "An album from the weekend\n\n@@@\n[](/images/a.jpg)-[](/images/b.jpg)\n@@@",
+    "Some code:\n\n```\ndef f(x):\n    return x * 2\n```\n\nand $x^2$ inline.",
+    "# A heading\n\n" + "A longer paragraph of prose with a [link](https://example.com). " * 20,
+]
+
+
+def load_posts(directory):
+    posts = []
+    for path in glob.glob(os.path.join(directory, "**", "*.json"), recursive=True):
+        with open(path) as f:
+            try:
+                content = json.load(f).get("content")
+            except (ValueError, AttributeError):
+                continue
+        if content:
+            posts.append(content)
+    return posts
+
+
+def per_call(posts):
+    for text in posts:
+        markdown.markdown(text, extensions=markdown_extensions())
+
+
+def per_thread(posts):
+    for text in posts:
+        render_markdown(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", help="render the posts under here")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    posts = load_posts(args.directory) if args.directory else SAMPLE_POSTS
+    if not posts:
+        parser.error(f"no posts with content under {args.directory}")
+
+    for name, func in (("per call", per_call), ("per thread", per_thread)):
+        best = min(
+            timeit.repeat(lambda: func(posts), repeat=args.repeat, number=args.number)
+        )
+        rate = len(posts) * args.number / best
+        print(f"{name:>10}: {rate:10.0f} posts/s")
+
+
+if __name__ == "__main__":
+    main()
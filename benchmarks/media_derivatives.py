@@ -0,0 +1,109 @@
+"""Per-photo wall time and peak RSS of the photo derivative pipeline.
+
+    python benchmarks/media_derivatives.py                 # synthetic photos
+    python benchmarks/media_derivatives.py images/temp/    # your own photos
+
+Each pipeline runs in a fresh interpreter so the peak RSS of one doesn't
+hide the other's. Run from the repository root so config.ini is found.
+"""
+
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+from pysrc.file_management.derivatives import Derivative, write_derivatives  # noqa: E402
+
+
+def legacy(source, web, high_res):
+    """The old move_and_resize: two opens and two full decodes."""
+    img = Image.open(source)
+    if img.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        img = background
+    img.thumbnail((800, 800))
+    img.save(web, "JPEG", quality=85)
+
+    img_high = Image.open(source)
+    if img_high.mode in ("RGBA", "LA"):
+        background = Image.new("RGB", img_high.size, (255, 255, 255))
+        background.paste(img_high, mask=img_high.split()[3])
+        img_high = background
+    img_high.save(high_res, "JPEG", quality=95)
+
+
+def engine(source, web, high_res):
+    write_derivatives(
+        source, [Derivative(high_res, None, quality=95), Derivative(web, 800)]
+    )
+
+
+def make_photos(directory, count, size):
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"photo-{i}.jpg")
+        Image.effect_noise(size, 64 + i).convert("RGB").save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def run(pipeline, photos, output):
+    func = {"legacy": legacy, "engine": engine}[pipeline]
+    started = time.perf_counter()
+    for i, photo in enumerate(photos):
+        func(
+            photo,
+            os.path.join(output, f"web-{i}.jpg"),
+            os.path.join(output, f"high-{i}.jpg"),
+        )
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"per_photo": elapsed / len(photos), "peak_kb": peak_kb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?", help="benchmark the photos in here")
+    parser.add_argument("--count", type=int, default=5)
+    parser.add_argument("--size", type=int, nargs=2, default=(4000, 3000))
+    parser.add_argument("--run", choices=("legacy", "engine"), help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, sorted(glob.glob(os.path.join(args.directory, "*"))), args.output)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = args.directory
+        if source is None:
+            source = os.path.join(tmp, "photos")
+            os.makedirs(source)
+            make_photos(source, args.count, tuple(args.size))
+        for pipeline in ("legacy", "engine"):
+            output = os.path.join(tmp, pipeline)
+            os.makedirs(output)
+            result = subprocess.run(
+                [sys.executable, __file__, source, "--run", pipeline, "--output", output],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(
+                f"{pipeline:>7}: {stats['per_photo'] * 1000:8.1f} ms/photo, "
+                f"peak RSS {stats['peak_kb'] / 1024:7.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,19 @@
 #!/usr/bin/python
 # coding: utf-8
+import click
 import configparser
 from functools import wraps
 import json
-from typing import List, Optional, Union, Tuple
-import markdown
+from typing import Callable, List, Optional, Union, Tuple
 import os
 from pysrc.file_management.file_parser import run
 from pydantic import ValidationError
 import requests
 import sqlite3
-from PIL import Image, ExifTags
 from contextlib import closing
 from datetime import datetime
 from dateutil.parser import parse
+from dateutil.relativedelta import relativedelta
 from flask import (
     Flask,
     Request,
@@ -27,14 +27,21 @@ from flask import (
     flash,
     make_response,
     jsonify,
-    Blueprint,
     Response,
+    send_file,
 )
 from werkzeug.datastructures import FileStorage
 from jinja2 import Environment
-from pysrc.markdown_hashtags.markdown_hashtag_extension import HashtagExtension
-from pysrc.markdown_albums.markdown_album_extension import AlbumExtension
-from pysrc.post import BlogPost, Event, PlaceInfo, Travel, Trip, DraftPost, GeoLocation
+from pysrc.post import (
+    BlogPost,
+    Event,
+    PlaceInfo,
+    Travel,
+    Trip,
+    DraftPost,
+    GeoLocation,
+    EntrySummary,
+)
 from pysrc.python_webmention.mentioner import get_mentions
 from slugify import slugify
 from pysrc.file_management.file_parser import (
@@ -42,12 +49,44 @@ from pysrc.file_management.file_parser import (
     create_post_from_data,
     update_json_entry,
     file_parser_json,
+    invalidate_entry,
+    entry_cache,
+    backfill_geo_points,
+    add_summary_column,
+    backfill_entry_summaries,
+    backfill_photo_variants,
+    migrate_media,
+    resolve_replies,
+    upload_thumbnail,
+    THUMBNAIL_CACHE,
 )
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
 import uuid
 from werkzeug.utils import secure_filename
 import yaml
-from pysrc.database.queries import EntryQueries, CategoryQueries
+from pysrc.database.queries import (
+    EntryQueries,
+    CategoryQueries,
+    GeoQueries,
+    TagCountQueries,
+    MediaQueries,
+    PhotoQueries,
+)
+from pysrc.cache import LRUCache
+from pysrc.database import connections
+from pysrc import job_queue
+from pysrc.rendering import media_url, picture, render_markdown, video_player
+from pysrc.export import export_site
+from pysrc.file_management import media_store, photo_index
+from pysrc.file_management.media_store import MEDIA_STORE
+from pysrc.file_management.serving import SENDFILE, MediaBlueprint, send_media
+from pysrc.file_management.resizing import RESIZE_SIZES, resize_source, resized
+from pysrc.file_management.ingest import ingest
+from pysrc.video_converter import (
+    conversion_method,
+    conversion_progress,
+    conversion_status,
+)
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 from pydantic import HttpUrl, AnyHttpUrl
 
@@ -74,12 +113,19 @@ BULK_UPLOAD_DIR = config.get("PhotoLocations", "BulkUploadLocation")
 PERMANENT_PHOTOS_DIR = config.get("PhotoLocations", "PermStorage")
 DRAFT_STORAGE = config.get("PhotoLocations", "DraftsStorage")
 TEMP_LOCATION = config.get("PhotoLocations", "TempLocation")
+# who runs queued photos and videos: a thread of the site, or `flask media-worker`
+MEDIA_WORKER = config.get("Global", "MediaWorker", fallback="thread").lower()
+FEED_LENGTH = 10  # number of entries in the rss, atom and json feeds
+PAGE_SIZE = 10  # number of entries on the index and each /page/
 
 # create our little application :)
 app = Flask(__name__)
 app.config.from_object(__name__)
 app.config["STATIC_FOLDER"] = os.getcwd()
-app.jinja_env.globals.update(now=datetime.now)
+app.config["USE_X_SENDFILE"] = SENDFILE == "x-sendfile"
+app.jinja_env.globals.update(
+    now=datetime.now, picture=picture, media_url=media_url, video_player=video_player
+)
 
 # Initialize CSRF protection - move this here, right after app creation
 csrf = CSRFProtect(app)
@@ -92,33 +138,77 @@ def inject_csrf_token():
 
 
 # Add a second static folder specifically for serving photos
-photos = Blueprint(
+photos = MediaBlueprint(
     "blog_data_storage",
     __name__,
     static_url_path=f"/{BLOG_STORAGE}",
     static_folder=os.path.join(os.getcwd(), BLOG_STORAGE),
 )
 
-temp_photos = Blueprint(
+temp_photos = MediaBlueprint(
     "temp_photos_data_storage",
     __name__,
     static_url_path=f"/{TEMP_LOCATION}",
     static_folder=BULK_UPLOAD_DIR,
 )
 
-high_res_storage = Blueprint(
+upload_thumbnails = MediaBlueprint(
+    "upload_thumbnails",
+    __name__,
+    static_url_path="/upload_thumbnails",
+    static_folder=os.path.join(os.getcwd(), THUMBNAIL_CACHE),
+)
+
+high_res_storage = MediaBlueprint(
     "perm_photos_data_storage",
     __name__,
     static_url_path="/images",
     static_folder=PERMANENT_PHOTOS_DIR,
 )
 
+media = MediaBlueprint(
+    "media_store",
+    __name__,
+    static_url_path=f"/{MEDIA_STORE}",
+    static_folder=os.path.join(os.getcwd(), MEDIA_STORE),
+    immutable=True,  # paths are content hashes
+)
+
+
+@photos.errorhandler(404)
+@media.errorhandler(404)
+def photo_not_processed(error):
+    """Serves the upload itself while a queued photo or video is being made.
+
+    Photos that `flask migrate-media` moved into the media store redirect there.
+    """
+    path = request.path.lstrip("/")
+    job = job_queue.pending_job(g.db, path)
+    if job and os.path.exists(job[0]["source"]):
+        response = send_file(os.path.abspath(job[0]["source"]))
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    digest = media_store.alias(g.db, path)
+    if digest:
+        return redirect("/" + media_store.web_path(digest), 301)
+    return not_found(error), 404
+
+
 app.register_blueprint(photos)
+app.register_blueprint(media)
 app.register_blueprint(temp_photos)
 app.register_blueprint(high_res_storage)
+app.register_blueprint(upload_thumbnails)
 
 cfg = None
 
+# the upload tray shows this many photos per request
+UPLOADS_PAGE_SIZE = 30
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tiff"}
+
+# rendered feed bodies, keyed by the feed's entries and their mtimes
+feed_cache = LRUCache(maxsize=16)
+
 
 def init_db():
     with closing(connect_db()) as db:
@@ -128,7 +218,114 @@ def init_db():
 
 
 def connect_db() -> sqlite3.Connection:
-    return sqlite3.connect(app.config["DATABASE"])
+    return connections.connect(app.config["DATABASE"])
+
+
+# each web worker thread keeps one connection across requests; connect_db is
+# looked up when one is opened, so tests can swap it
+db_pool = connections.ConnectionPool(lambda: connect_db())
+
+
+class _Globals(app.app_ctx_globals_class):
+    """``g``, whose ``db`` is this thread's pooled connection, taken on first use.
+
+    Requests that never touch the database, for photos, videos and static
+    files, never take one.
+    """
+
+    def __getattr__(self, name):
+        if name == "db":
+            self.db = db_pool.connection()
+            return self.db
+        return super().__getattr__(name)
+
+
+app.app_ctx_globals_class = _Globals
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Add the indexes and tables newer code expects to an existing database."""
+    with closing(connect_db()) as db:
+        db.executescript(EntryQueries.CREATE_INDEXES)
+        add_summary_column(db)
+        db.executescript(TagCountQueries.CREATE_TABLE)
+        db.executescript(TagCountQueries.REBUILD)
+        job_queue.upgrade(db)
+        db.executescript(MediaQueries.CREATE_TABLE)
+        db.executescript(PhotoQueries.CREATE_TABLE)
+        db.commit()
+    click.echo("Database upgraded")
+
+
+@app.cli.command("export")
+@click.argument("output_dir")
+@click.option("--full", is_flag=True, help="Render every page, ignoring the manifest.")
+@click.option("--workers", type=int, default=None, help="Size of the render pool.")
+def export_command(output_dir, full, workers):
+    """Render the public site to static files under OUTPUT_DIR."""
+    result = export_site(output_dir, full=full, workers=workers)
+    click.echo(
+        f"Rendered {len(result.rendered)} pages, removed {len(result.removed)}, "
+        f"{len(result.failed)} failed"
+    )
+
+
+@app.cli.command("media-worker")
+@click.option("--workers", type=int, default=None, help="Size of the process pool.")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+def media_worker_command(workers, once):
+    """Process queued photos and videos until stopped."""
+    count = job_queue.run_worker(
+        connect_db, workers=workers, once=once, initializer=_media_worker_init
+    )
+    click.echo(f"Finished {count} jobs")
+
+
+def _media_worker_init():
+    # media handlers log through current_app
+    app.app_context().push()
+
+
+@app.cli.command("backfill-geo")
+def backfill_geo_command():
+    """Rebuild the geo_points table from the posts on disk."""
+    with closing(connect_db()) as db:
+        count = backfill_geo_points(db)
+    click.echo(f"Indexed geo points for {count} posts")
+
+
+@app.cli.command("backfill-summaries")
+def backfill_summaries_command():
+    """Add and fill entries.summary_json for every post on disk."""
+    with closing(connect_db()) as db:
+        count = backfill_entry_summaries(db)
+    click.echo(f"Stored summaries for {count} posts")
+
+
+@app.cli.command("backfill-variants")
+def backfill_variants_command():
+    """Write responsive variants for every published photo missing them."""
+    with closing(connect_db()) as db:
+        count = backfill_photo_variants(db)
+    click.echo(f"Wrote photo variants for {count} posts")
+
+
+@app.cli.command("migrate-media")
+def migrate_media_command():
+    """Move every post's photos into the content-addressed media store."""
+    with closing(connect_db()) as db:
+        count = migrate_media(db)
+    click.echo(f"Moved the photos of {count} posts into the media store")
+
+
+@app.cli.command("backfill-photos")
+@click.option("--workers", type=int, default=None, help="Size of the read pool.")
+def backfill_photos_command(workers):
+    """Index the size, capture time and position of every photo on disk."""
+    with closing(connect_db()) as db:
+        count = photo_index.backfill_photo_index(db, workers=workers)
+    click.echo(f"Indexed {count} photos")
 
 
 @app.errorhandler(500)
@@ -141,16 +338,6 @@ def not_found(error) -> str:
     return render_template("page_not_found.html")
 
 
-@app.before_request
-def before_request():
-    """Establish a database connection before each request.
-
-    This function runs before every request and sets up a database
-    connection, storing it in Flask's 'g' object for use during
-    the request lifecycle."""
-    g.db = connect_db()
-
-
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -162,12 +349,19 @@ def require_auth(f):
     return decorated
 
 
+@app.after_request
+def run_queued_media(response: Response) -> Response:
+    """Without a separate media worker, run what a post queued in a thread."""
+    if MEDIA_WORKER == "thread" and request.method == "POST" and "db" in g:
+        job_queue.run_in_thread(connect_db, initializer=_media_worker_init)
+    return response
+
+
 @app.teardown_request
 def teardown_request(exception):
-    """Close the database connection after each request."""
-    db = getattr(g, "db", None)
-    if db is not None:
-        db.close()
+    """Roll back whatever the request left uncommitted on its pooled connection."""
+    if "db" in g:
+        db_pool.reset(g.db)
 
 
 def get_entries_by_date() -> List[BlogPost]:
@@ -188,13 +382,159 @@ def get_entries_by_date() -> List[BlogPost]:
     return entries
 
 
-def get_most_popular_tags() -> List[str]:
+def entries_from_rows(
+    rows: List[Tuple[str, Optional[str]]]
+) -> List[Union[BlogPost, EntrySummary]]:
+    """Build the entries for a list view from (location, summary_json) rows.
+
+    Rows without a summary, written before summaries were stored or before
+    `flask backfill-summaries`, fall back to parsing the JSON.
+    """
+    entries: List[Union[BlogPost, EntrySummary]] = []
+    for location, summary_json in rows:
+        if summary_json:
+            entry = EntrySummary.model_validate_json(summary_json)
+            if entry.in_reply_to:
+                entry.in_reply_to = resolve_replies(entry.in_reply_to)
+            entries.append(entry)
+        elif os.path.exists(location + ".json"):
+            entries.append(file_parser_json(location + ".json"))
+    return entries
+
+
+def date_range(
+    year: Union[str, int],
+    month: Optional[Union[str, int]] = None,
+    day: Optional[Union[str, int]] = None,
+) -> Tuple[str, str]:
+    """The half-open [start, end) range of dates covering a year, month or day.
+
+    Returns ISO date strings, which compare correctly against the stored
+    published timestamps whichever separator they were written with.
+
+    Raises:
+        ValueError: if the date doesn't exist.
+    """
+    start = datetime(int(year), int(month or 1), int(day or 1))
+    if day:
+        end = start + relativedelta(days=1)
+    elif month:
+        end = start + relativedelta(months=1)
+    else:
+        end = start + relativedelta(years=1)
+    return start.date().isoformat(), end.date().isoformat()
+
+
+def entries_json(entries: List[Union[BlogPost, EntrySummary]]) -> Response:
+    return jsonify([entry.model_dump(mode="json") for entry in entries])
+
+
+def search_by_date(
+    year: str, month: Optional[str] = None, day: Optional[str] = None
+) -> List[Union[BlogPost, EntrySummary]]:
+    try:
+        start, end = date_range(year, month, day)
+    except ValueError:
+        abort(404)
+    cur = g.db.execute(EntryQueries.SELECT_BY_DATE, (start, end))
+    return entries_from_rows(cur.fetchall())
+
+
+@dataclass
+class Page:
+    entries: List[Union[BlogPost, EntrySummary]]
+    has_next: bool
+    # (published, id) of the last row on the page, used as the next page's cursor
+    cursor: Optional[Tuple[str, int]] = None
+
+
+def get_page(number: int, cursor: Optional[Tuple[str, int]] = None) -> Page:
+    """Get one page of entries, newest first, reading only that page's rows.
+
+    Args:
+        number: the page number, used as an OFFSET when there's no cursor.
+        cursor: the (published, id) of the last entry on the previous page.
+            When given, the page is read with a keyset predicate instead.
+    """
+    if cursor:
+        published, entry_id = cursor
+        rows = g.db.execute(
+            EntryQueries.SELECT_PAGE_BEFORE,
+            (published, entry_id, PAGE_SIZE + 1),
+        ).fetchall()
+    else:
+        rows = g.db.execute(
+            EntryQueries.SELECT_PAGE, (PAGE_SIZE + 1, number * PAGE_SIZE)
+        ).fetchall()
+
+    # we read one row past the page to know whether there's another page
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+    entries = entries_from_rows([(location, summary) for _, location, _, summary in rows])
+    last = (rows[-1][2], rows[-1][0]) if rows else None
+    return Page(entries=entries, has_next=has_next, cursor=last)
+
+
+def next_page_url(number: int, page: Page) -> Optional[str]:
+    """The link to the page after ``page``, carrying its keyset cursor."""
+    if not page.has_next or not page.cursor:
+        return None
+    published, entry_id = page.cursor
+    return url_for(
+        "pagination", number=number + 1, before=published, before_id=entry_id
+    )
+
+
+def get_latest_locations(limit: int) -> List[str]:
+    """Get the locations of the newest entries whose JSON file exists.
+
+    Rows are read from the database in pages of ``limit`` so a missing file
+    doesn't shorten the result, but the archive is never read in full.
+    """
+    locations: List[str] = []
+    offset = 0
+    while len(locations) < limit:
+        rows = g.db.execute(EntryQueries.SELECT_LATEST, (limit, offset)).fetchall()
+        if not rows:
+            break
+        offset += len(rows)
+        locations += [row for (row,) in rows if os.path.exists(row + ".json")]
+    return locations[:limit]
+
+
+def cached_feed(name: str, render: Callable[[List[BlogPost]], str]) -> str:
+    """Return the body of a feed, rendering it only when its entries changed.
+
+    The cache key is the list of the newest entries along with their mtimes,
+    so creating, updating or deleting one of them produces a new key in every
+    worker without any cross-process invalidation.
+    """
+    locations = get_latest_locations(FEED_LENGTH)
+    fingerprint = []
+    for location in locations:
+        try:
+            fingerprint.append((location, os.stat(location + ".json").st_mtime_ns))
+        except OSError:
+            fingerprint.append((location, None))
+    key = (name, tuple(fingerprint))
+
+    body = feed_cache.get(key)
+    if body is None:
+        entries = [file_parser_json(location + ".json") for location in locations]
+        body = render(entries)
+        feed_cache.put(key, body, tag=name)
+    return body
+
+
+def get_most_popular_tags(limit: int = 10) -> List[str]:
     """Get tags in descending order of usage, excluding post type declarations.
 
+    Args:
+        limit: the number of tags to return.
     Returns:
         List of tags in descending order by usage.
     """
-    cur = g.db.execute(CategoryQueries.SELECT_POPULAR)
+    cur = g.db.execute(TagCountQueries.SELECT_TOP, (limit,))
     return [row[0] for row in cur.fetchall()]
 
 
@@ -367,16 +707,10 @@ def handle_uploaded_files(request: Request) -> Tuple[List[str], List[str]]:
                         app.logger.error(f"Error saving video {filename}: {str(e)}")
                         app.logger.exception(e)
                 else:
-                    # Handle image with rotation
-                    try:
-                        image = Image.open(file.stream)
-                        rotated_image = rotate_image_by_exif(image)
-                        rotated_image.save(path)
-                        photo_paths.append(os.path.join(BULK_UPLOAD_DIR, filename))
-                    except Exception as e:
-                        app.logger.error(f"Error processing image {filename}: {str(e)}")
-                        file.save(path)
-                        photo_paths.append(os.path.join(BULK_UPLOAD_DIR, filename))
+                    # stored untouched; EXIF orientation is applied at publish
+                    file.save(path)
+                    upload_thumbnail(path)
+                    photo_paths.append(os.path.join(BULK_UPLOAD_DIR, filename))
 
         return photo_paths, video_paths
 
@@ -659,7 +993,9 @@ def update_entry(
                 updated_post.geo.location_id = location_info.geoname_id
 
         # Process markdown content
-        updated_post.content = run(updated_post.content, f"{year}/{month}/{day}/")
+        updated_post.content = run(
+            updated_post.content, f"{year}/{month}/{day}/", db=g.db
+        )
 
         # Update the entry
         update_json_entry(updated_post, existing_entry, g=g.db, draft=draft)
@@ -727,26 +1063,9 @@ def action_stream_parser(filename):
     return NotImplementedError("this doesn't exist yet")
 
 
-def search_by_tag(category):
-    entries = []
-    cur = g.db.execute(
-        """
-         SELECT entries.location FROM categories
-         INNER JOIN entries ON
-         entries.slug = categories.slug AND
-         entries.published = categories.published
-         WHERE categories.category='{category}'
-         ORDER BY entries.published DESC
-        """.format(
-            category=category
-        )
-    )
-
-    for (row,) in cur.fetchall():
-
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
-    return entries
+def search_by_tag(category: str) -> List[Union[BlogPost, EntrySummary]]:
+    cur = g.db.execute(CategoryQueries.SELECT_BY_CATEGORY, (category,))
+    return entries_from_rows(cur.fetchall())
 
 
 def load_activitypub_config():
@@ -778,38 +1097,17 @@ def show_entries():
     elif request.headers.get("Accept") == "application/as+json":
         return jsonify(activitypub_profile)
 
-    # getting the entries we want to display.
-    entries = []  # store the entries which will be presented
-    cur = g.db.execute(  # grab in order of newest
-        """
-        SELECT location
-        FROM entries
-        ORDER BY published DESC
-        """
-    )
-
-    for (row,) in cur.fetchall():  # iterate over the results
-        if os.path.exists(row + ".json"):  # if the file fetched exists...
-            # parse the json and add it to the list of entries.
-            entries.append(file_parser_json(row + ".json"))
-            if len(entries) == 10:
-                break
-
-    try:
-        entries = entries[:10]  # get the 10 newest
-    except IndexError:
-        if len(entries) == 0:  # if there's an index error and the len is low..
-            entries = None  # there are no entries
-    # otherwise there are < 10 entries and we'll just display what we have ...
+    page = get_page(0)
     before = 1  # holder which tells us which page we're on
-    tags = get_most_popular_tags()[:10]
+    tags = get_most_popular_tags(10)
 
     display_articles = search_by_tag("article")[:3]
 
     return render_template(
         "blog_entries.html",
-        entries=entries,
+        entries=page.entries,
         before=before,
+        next_page=next_page_url(0, page),
         popular_tags=tags[:10],
         display_articles=display_articles,
     )
@@ -819,28 +1117,10 @@ def show_entries():
 def show_rss():
     """The rss view: presents entries in rss form."""
 
-    entries = []  # store the entries which will be presented
-    cur = g.db.execute(  # grab in order of newest
-        """
-        SELECT location
-        FROM entries
-        ORDER BY published DESC
-        """
-    )
-    updated = None
-    for (row,) in cur.fetchall():  # iterate over the results
-        # if the file fetched exists, append the parsed details
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
-
-    try:
-        entries = entries[:10]  # get the 10 newest
-
-    except IndexError:
-        entries = None  # there are no entries
+    def render(entries: List[BlogPost]) -> str:
+        return render_template("rss.xml", entries=entries, updated=None)
 
-    template = render_template("rss.xml", entries=entries, updated=updated)
-    response = make_response(template)
+    response = make_response(cached_feed("rss", render))
     response.headers["Content-Type"] = "application/xml"
     return response
 
@@ -848,139 +1128,74 @@ def show_rss():
 @app.route("/atom.xml")
 def show_atom():
     """The atom view: presents entries in atom form."""
-    entries = []
-    cur = g.db.execute(
-        """
-        SELECT location
-        FROM entries
-        ORDER BY published DESC
-        """
-    )
-    updated = None
-    for (row,) in cur.fetchall():
-        if os.path.exists(row + ".json"):
-            entry = file_parser_json(row + ".json")
-            entries.append(entry)
 
-    try:
-        entries = entries[:10]
-        # Access the published attribute directly from BlogPost object
-        updated = entries[0].published if entries else None
-        return Response(
-            render_template("atom.xml", entries=entries, updated=updated),
-            mimetype="application/atom+xml",
-        )
-    except (IndexError, AttributeError):
-        return Response(
-            render_template("atom.xml", entries=[], updated=None),
-            mimetype="application/atom+xml",
-        )
+    def render(entries: List[BlogPost]) -> str:
+        try:
+            # Access the published attribute directly from BlogPost object
+            updated = entries[0].published if entries else None
+            return render_template("atom.xml", entries=entries, updated=updated)
+        except (IndexError, AttributeError):
+            return render_template("atom.xml", entries=[], updated=None)
+
+    return Response(cached_feed("atom", render), mimetype="application/atom+xml")
 
 
 @app.route("/json.feed")
 def show_json():
     """The rss view: presents entries in json feed form."""
 
-    entries = []  # store the entries which will be presented
-    cur = g.db.execute(  # grab in order of newest
-        """
-        SELECT location
-        FROM entries
-        ORDER BY published DESC
-        """
-    )
-
-    for (row,) in cur.fetchall():  # iterate over the results
-        # if the file fetched exists, append the parsed details
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
+    def render(entries: List[BlogPost]) -> str:
+        feed_items = [
+            {
+                "id": entry.url,
+                "url": entry.url,
+                "content_text": entry.summary if entry.summary else entry.content,
+                "date_published": entry.published.isoformat(),
+                "author": {"name": "Alex Kearney"},
+            }
+            for entry in entries
+        ]
+        feed_json = {
+            "version": "https://jsonfeed.org/version/1",
+            "home_page_url": "https://kongaloosh.com/",
+            "feed_url": "https://kongaloosh.com/json.feed",
+            "title": "kongaloosh",
+            "items": feed_items,
+        }
+        return json.dumps(feed_json)
 
-    if len(entries) == 0:
+    if not get_latest_locations(1):
         return jsonify({"message": "No entries found"}), 404
 
-    entries = entries[:10]  # get the 10 newest
-    feed_items = []
-
-    for entry in entries:
-        feed_item = {
-            "id": entry["url"],
-            "url": entry["url"],
-            "content_text": entry["summary"] if entry["summary"] else entry["content"],
-            "date_published": entry["published"],
-            "author": {"name": "Alex Kearney"},
-        }
-        feed_items.append(feed_item)
-
-    feed_json = {
-        "version": "https://jsonfeed.org/version/1",
-        "home_page_url": "https://kongaloosh.com/",
-        "feed_url": "https://kongaloosh.com/json.feed",
-        "title": "kongaloosh",
-        "items": feed_items,
-    }
-
-    return jsonify(feed_json)
+    return Response(cached_feed("json", render), mimetype="application/json")
 
 
 @app.route("/map")
 def map():
-    """"""
-    geo_coords = []
-    cur = g.db.execute(  # grab in order of newest
-        """
-        SELECT location
-        FROM entries
-        ORDER BY published DESC
-        """
-    )
-
-    def coords_to_str(coords: tuple[float, float]) -> str:
-        x, y = coords
-        return f"{x},{y}"
-
-    for (row,) in cur.fetchall():  # iterate over the results
-        # if the file fetched exists, append the parsed details
-        if os.path.exists(row + ".json"):
-            entry = file_parser_json(row + ".json")
-            if entry.geo and entry.geo.coordinates:
-                geo_coords.append(coords_to_str(entry.geo.coordinates))
-
-            if entry.travel:
-                trips = entry.travel.trips
-                geo_coords += [
-                    coords_to_str(destination.location.coordinates)
-                    for destination in trips
-                    if destination.location.coordinates
-                ]
-
+    """Every post location and travel stop, newest first."""
+    cur = g.db.execute(GeoQueries.SELECT_COORDINATES)
+    geo_coords = [f"{lat},{lon}" for lat, lon in cur.fetchall()]
     return render_template("map.html", geo_coords=geo_coords, key=GOOGLE_MAPS_KEY)
 
 
-@app.route("/page/<number>")
+@app.route("/page/<int:number>")
 def pagination(number):
     """Gets the posts for a page number. Posts are grouped in 10s.
     Args:
         number: the page number we're currently on.
     """
-    entries = get_entries_by_date()
+    cursor = None
+    if request.args.get("before") and request.args.get("before_id", type=int):
+        cursor = (request.args["before"], request.args.get("before_id", type=int))
 
-    start = int(number) * 10  # beginning of page group is the page number * 10
-    before = int(number) + 1  # increment the page group
-    try:
-        # get the next 10 entries starting at the page grouping
-        entries = entries[start : start + 10]
-    except IndexError:
-        #  if there is an index error, it might be that there are
-        #  fewer than 10 posts left...
-        try:
-            # try to get the remaining entries
-            entries = entries[start : len(entries)]
-        except IndexError:
-            # if this still produces an index error,
-            #  we are at the end and return no entries.
-            entries = None
-            before = 0  # set before so that we know we're at the end
-    return render_template("blog_entries.html", entries=entries, before=before)
+    page = get_page(number, cursor)
+    before = number + 1  # increment the page group
+    return render_template(
+        "blog_entries.html",
+        entries=page.entries,
+        before=before,
+        next_page=next_page_url(number, page),
+    )
 
 
 @app.errorhandler(404)
@@ -998,7 +1213,7 @@ def five_oh_oh(e):
 def add():
     """The form for user-submission"""
     if request.method == "GET":
-        tags = get_most_popular_tags()[:10]
+        tags = get_most_popular_tags(10)
         return render_template(
             "edit_entry.html", entry=None, popular_tags=tags, type="add"
         )
@@ -1031,6 +1246,9 @@ def delete_drafts(name):
         # if there's an associated file...
         if os.path.isfile(totalpath + extension):
             os.remove(totalpath + extension)  # ... delete it
+    invalidate_entry(totalpath + ".json")
+    media_store.set_refs(g.db, totalpath + ".json", [])
+    g.db.commit()
 
     # note: because this is a draft, the images associated with the post will still be in the temp folder
     return redirect("/")
@@ -1061,6 +1279,8 @@ def delete_entry(year, month, day, name):
 
         if isinstance(entry.photo, list):
             for photo in entry.photo:
+                if media_store.stored_hash(photo):
+                    continue  # dropped with the post's references below
                 try:
                     os.remove(photo)
                 except FileNotFoundError:
@@ -1071,6 +1291,8 @@ def delete_entry(year, month, day, name):
         for extension in [".md", ".json", ".jpg"]:
             if os.path.isfile(totalpath + extension):
                 os.remove(totalpath + extension)
+        invalidate_entry(totalpath + ".json")
+        media_store.set_refs(g.db, totalpath + ".json", [])
 
         g.db.execute(
             """
@@ -1079,38 +1301,16 @@ def delete_entry(year, month, day, name):
             """,
             (totalpath,),
         )
+        if isinstance(entry, BlogPost):
+            g.db.execute(GeoQueries.DELETE, (entry.slug, entry.published))
+            g.db.execute(
+                CategoryQueries.DELETE_FOR_ENTRY, (entry.slug, entry.published)
+            )
         g.db.commit()
         return redirect("/")
     return redirect("/", 500)
 
 
-def rotate_image_by_exif(image: Image.Image) -> Image.Image:
-    """Rotate image according to EXIF orientation tag"""
-    try:
-        # Find orientation tag
-        orientation = next(
-            (tag for tag, name in ExifTags.TAGS.items() if name == "Orientation"), None
-        )
-
-        if not orientation:
-            return image
-
-        exif = image.getexif()
-        if not exif or orientation not in exif:
-            return image
-
-        # Rotate based on orientation value
-        rotation_map = {3: 180, 6: 270, 8: 90}
-
-        if rotation := rotation_map.get(exif[orientation]):
-            return image.rotate(rotation, expand=True)
-
-    except Exception as e:
-        app.logger.error(f"Error processing EXIF orientation: {e}")
-
-    return image
-
-
 @app.route("/bulk_upload", methods=["GET", "POST"])
 @require_auth
 def bulk_upload():
@@ -1122,6 +1322,7 @@ def bulk_upload():
 
         temporary_file_name = datetime.now().strftime("%Y-%m-%d--%H-%M-%S")
 
+        stored = []
         for uploaded_file in request.files.getlist("file"):
             i = 0
             assert uploaded_file.filename
@@ -1138,10 +1339,11 @@ def bulk_upload():
                 )
                 i += 1
 
-            image = Image.open(uploaded_file.stream)
-            rotated_image = rotate_image_by_exif(image)
-            rotated_image.save(file_loc)
-        return redirect("/")
+            # stored untouched; EXIF orientation is applied at publish
+            uploaded_file.save(file_loc)
+            stored.append((uploaded_file.filename, file_loc))
+        results = ingest(stored, db=g.db)
+        return jsonify([asdict(result) for result in results])
     else:
         return redirect("/404")
 
@@ -1155,49 +1357,42 @@ def mobile_upload():
             abort(401)
 
         file_path = BULK_UPLOAD_DIR
+        stored = []
         for uploaded_file in request.files.getlist("files[]"):
             assert uploaded_file.filename
             app.logger.info("file " + uploaded_file.filename)
             file_loc = file_path + "{0}".format(uploaded_file.filename)
 
-            # Check if it's a video file
-            if uploaded_file.filename.lower().endswith(
-                (".mp4", ".mov", ".qt", ".m4v", ".avi", ".wmv", ".flv", ".mkv")
-            ):
-                # Save the video file directly
-                uploaded_file.save(file_loc)
-            else:
-                # Handle image with EXIF rotation as before
-                try:
-                    image = Image.open(uploaded_file.stream)
-
-                    for orientation in ExifTags.TAGS.keys():
-                        if ExifTags.TAGS[orientation] == "Orientation":
-                            break
-
-                    exif = dict(image.getexif().items())
-
-                    if orientation in exif:
-                        if exif[orientation] == 3:
-                            image = image.rotate(180, expand=True)
-                        elif exif[orientation] == 6:
-                            image = image.rotate(270, expand=True)
-                        elif exif[orientation] == 8:
-                            image = image.rotate(90, expand=True)
-
-                    image.save(file_loc)
-                except Exception as e:
-                    app.logger.error(
-                        f"Error processing image {uploaded_file.filename}: {str(e)}"
-                    )
-                    # Save the original file if image processing fails
-                    uploaded_file.save(file_loc)
+            # photos are stored untouched too; EXIF orientation is applied at publish
+            uploaded_file.save(file_loc)
+            stored.append((uploaded_file.filename, file_loc))
 
+        results = ingest(stored, db=g.db)
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify([asdict(result) for result in results])
         return redirect("/")
     else:
         return redirect("/404")
 
 
+@app.route("/img/<int:size>/<path:path>")
+def resized_image(size: int, path: str):
+    """A photo at most ``size`` pixels on its longest side, made on first request."""
+    source = resize_source(path) if size in RESIZE_SIZES else None
+    if source is None:
+        abort(404)
+    try:
+        cached = resized(source, size)
+    except (OSError, ValueError) as e:
+        app.logger.error(f"Couldn't resize {source}: {e}")
+        abort(404)
+    return send_media(
+        os.path.dirname(os.path.abspath(cached)),
+        os.path.basename(cached),
+        immutable=media_store.stored_hash(path) is not None,
+    )
+
+
 @app.route("/md_to_html", methods=["POST"])
 def md_to_html():
     try:
@@ -1218,11 +1413,8 @@ def md_to_html():
             app.logger.error("Missing text in request data")
             return jsonify({"error": "No text provided in request"}), 400
 
-        # Your existing markdown conversion logic
-        md = markdown.Markdown(
-            extensions=["extra", HashtagExtension(), AlbumExtension()]
-        )
-        html = md.convert(data["text"])
+        # render exactly as file_parser_json will once the post is saved
+        html = render_markdown(data["text"])
 
         response = jsonify({"html": html})
         # Set CSRF token in response
@@ -1234,6 +1426,28 @@ def md_to_html():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+@app.route("/video_status/<path:path>")
+@require_auth
+def video_status(path: str):
+    """Where a published video's transcode is up to, for the editor to poll.
+
+    ``url`` carries the finished file's fingerprint, so players can load it
+    without caching a stale copy.
+    """
+    status = conversion_status(g.db, path)
+    if status is None:
+        abort(404)
+    return jsonify(
+        {
+            "path": path,
+            "url": media_url(path),
+            "status": status,
+            "method": conversion_method(g.db, path),
+            "progress": conversion_progress(g.db, path),
+        }
+    )
+
+
 @app.route("/geonames/<query>", methods=["GET"])
 def geonames_wrapper(query):
     if request.method == "GET":
@@ -1266,22 +1480,58 @@ def geonames_wrapper(query):
     return redirect("/404"), 404
 
 
+def recent_upload_files(
+    db, directory: str
+) -> List[Tuple[str, Optional[photo_index.PhotoMetadata]]]:
+    """The photos waiting in ``directory`` and their metadata, newest first.
+
+    Photos are ordered by when they were taken, or by when they last changed
+    if they don't say; any not in the photo index yet are added to it.
+    """
+    with os.scandir(directory) as entries:
+        changed = {
+            os.path.join(directory, entry.name): entry.stat().st_mtime
+            for entry in entries
+            if entry.is_file()
+            and os.path.splitext(entry.name.lower())[1] in IMAGE_EXTENSIONS
+        }
+    if photo_index.index_photos(db, changed):
+        db.commit()
+    indexed = photo_index.under(db, directory)
+
+    def newest(path: str) -> str:
+        metadata = indexed.get(path)
+        if metadata and metadata.taken:
+            return metadata.taken
+        return datetime.fromtimestamp(changed[path]).isoformat()
+
+    return [
+        (os.path.basename(path), indexed.get(path))
+        for path in sorted(changed, key=newest, reverse=True)
+    ]
+
+
 @app.route("/recent_uploads", methods=["GET", "POST"])
 def recent_uploads():
-    """Return a formatted list of all images in the current day's directory."""
+    """Return a page of the photos waiting in the upload directory, as thumbnails."""
     if request.method == "GET":
-        directory = BULK_UPLOAD_DIR
         insert_pattern = "%s" if request.args.get("stream") else "[](%s)"
-
-        # Define allowed image extensions
-        IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tiff"}
-
-        # Use config values to construct web paths
-        file_list = [
-            f"/{TEMP_LOCATION}/{file}"  # Use configured path instead of hardcoded
-            for file in os.listdir(directory)
-            if os.path.splitext(file.lower())[1] in IMAGE_EXTENSIONS
-        ]
+        page = request.args.get("page", 0, type=int)
+
+        names = recent_upload_files(g.db, BULK_UPLOAD_DIR)
+        start = page * UPLOADS_PAGE_SIZE
+        file_list = []
+        for name, metadata in names[start : start + UPLOADS_PAGE_SIZE]:
+            thumbnail = upload_thumbnail(os.path.join(BULK_UPLOAD_DIR, name))
+            image = f"/{TEMP_LOCATION}/{name}"  # Use configured path instead of hardcoded
+            preview = (
+                f"/upload_thumbnails/{os.path.basename(thumbnail)}" if thumbnail else image
+            )
+            # lets the editor suggest the post's location from its photos
+            geo = ""
+            if metadata and metadata.lat is not None and metadata.lon is not None:
+                geo = f' data-geo="{metadata.lat},{metadata.lon}"'
+            file_list.append((image, preview, geo))
 
         rows = []
         for i in range(0, len(file_list), 3):
@@ -1289,15 +1539,26 @@ def recent_uploads():
             row = "".join(
                 [
                     f"""
-                    <a class="p-2 text-center" onclick="insertAtCaret('text_input','{insert_pattern % image}', 'img_{j}');return false;">
-                        <img src="{image}" id="img_{j}" class="img-fluid" style="max-height:200px; width:auto;">
+                    <a class="p-2 text-center"{geo} onclick="insertAtCaret('text_input','{insert_pattern % image}', 'img_{j}');return false;">
+                        <img src="{preview}" id="img_{j}" class="img-fluid" style="max-height:200px; width:auto;" loading="lazy">
                     </a>
                     """
-                    for j, image in enumerate(row_images, start=i)
+                    for j, (image, preview, geo) in enumerate(
+                        row_images, start=start + i
+                    )
                 ]
             )
             rows.append(f'<div class="d-flex flex-row">{row}</div>')
 
+        if start + UPLOADS_PAGE_SIZE < len(names):
+            more = url_for(
+                "recent_uploads", page=page + 1, stream=request.args.get("stream")
+            )
+            # replaces itself with the next page when clicked
+            rows.append(
+                f"""<a class="btn btn-default" href="{more}" onclick="fetch(this.href).then(r => r.text()).then(html => {{ this.insertAdjacentHTML('afterend', html); this.remove(); }}); return false;">More uploads</a>"""
+            )
+
         return "\n".join(rows)
 
     elif request.method == "POST":
@@ -1366,29 +1627,20 @@ def profile(year, month, day, name):
 def tag_search(category):
     """Get all entries with a specific tag"""
     if request.headers.get("Accept") == "application/json":
-        entries = []
-        query = """SELECT entries.location
-         FROM categories
-         INNER JOIN entries ON
-         entries.slug = categories.slug AND
-         entries.published = categories.published
-         WHERE categories.category='{category}'""".format(
-            category=category
-        )
-        args = request.args
-        for key in args.keys():
-            strf = key[0] if key[0] != "y" else "Y"
-            query += (
-                "\nand CAST(strftime('%{0}', entries.published)AS INT) = {1}".format(
-                    strf, args.get(key)
-                )  # noqa: E501
+        # ?y=2024&m=3&d=1 (or year/month/day) narrows the results to a date
+        dates = {key[0]: value for key, value in request.args.items() if key}
+        if dates.get("y"):
+            try:
+                start, end = date_range(dates["y"], dates.get("m"), dates.get("d"))
+            except ValueError:
+                abort(400)
+            cur = g.db.execute(
+                CategoryQueries.SELECT_BY_CATEGORY_AND_DATE, (category, start, end)
             )
-        query += "\nORDER BY entries.published DESC"
-        cur = g.db.execute(query)
-        for (row,) in cur.fetchall():
-            if os.path.exists(row + ".json"):
-                entries.append(file_parser_json(row + ".json"))
-        return jsonify(entries)
+            entries = entries_from_rows(cur.fetchall())
+        else:
+            entries = search_by_tag(category)
+        return entries_json(entries)
     entries = search_by_tag(category)
     return render_template("blog_entries.html", entries=entries)
 
@@ -1396,14 +1648,7 @@ def tag_search(category):
 @app.route("/t/")
 def all_tags():
     "Get all tags and order them in descending quantity."
-    cur = g.db.execute(
-        """
-        select category, count(category) as count
-        from categories
-        group by category
-        order by count(category) desc
-        """
-    )
+    cur = g.db.execute(TagCountQueries.SELECT_ALL)
     tags = cur.fetchall()
 
     if request.headers.get("Accept") == "application/json":
@@ -1415,23 +1660,10 @@ def all_tags():
 @app.route("/e/<year>/")
 def time_search_year(year):
     """Gets all entries posted during a specific year"""
-    entries = []
-    cur = g.db.execute(
-        """
-        SELECT entries.location FROM entries
-        WHERE CAST(strftime('%Y',entries.published)AS INT) = {year}
-        ORDER BY entries.published DESC
-        """.format(
-            year=int(year)
-        )
-    )
-
-    for (row,) in cur.fetchall():
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
+    entries = search_by_date(year)
 
     if request.headers.get("Accept") == "application/json":
-        return jsonify(entries)
+        return entries_json(entries)
 
     return render_template("blog_entries.html", entries=entries)
 
@@ -1439,24 +1671,10 @@ def time_search_year(year):
 @app.route("/e/<year>/<month>/")
 def time_search_month(year, month):
     """Gets all entries posted during a specific month"""
-    entries = []
-    cur = g.db.execute(
-        """
-        SELECT entries.location FROM entries
-        WHERE CAST(strftime('%Y',entries.published)AS INT) = {year}
-        AND CAST(strftime('%m',entries.published)AS INT) = {month}
-        ORDER BY entries.published DESC
-        """.format(
-            year=int(year), month=int(month)
-        )
-    )
-
-    for (row,) in cur.fetchall():
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
+    entries = search_by_date(year, month)
 
     if request.headers.get("Accept") == "application/json":
-        return jsonify(entries)
+        return entries_json(entries)
 
     return render_template("blog_entries.html", entries=entries)
 
@@ -1464,25 +1682,10 @@ def time_search_month(year, month):
 @app.route("/e/<year>/<month>/<day>/")
 def time_search(year, month, day):
     """Gets all notes posted on a specific day"""
-    entries = []
-    cur = g.db.execute(
-        """
-        SELECT entries.location FROM entries
-        WHERE CAST(strftime('%Y',entries.published)AS INT) = {year}
-        AND CAST(strftime('%m',entries.published)AS INT) = {month}
-        AND CAST(strftime('%d',entries.published)AS INT) = {day}
-        ORDER BY entries.published DESC
-        """.format(
-            year=int(year), month=int(month), day=int(day)
-        )
-    )
-
-    for (row,) in cur.fetchall():
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
+    entries = search_by_date(year, month, day)
 
     if request.headers.get("Accept") == "application/json":
-        return jsonify(entries)
+        return entries_json(entries)
 
     return render_template("blog_entries.html", entries=entries)
 
@@ -1490,26 +1693,10 @@ def time_search(year, month, day):
 @app.route("/a/")
 def articles():
     """Gets all the articles"""
-    entries = []
-    cur = g.db.execute(
-        """
-         SELECT entries.location FROM categories
-         INNER JOIN entries ON
-         entries.slug = categories.slug AND
-         entries.published = categories.published
-         WHERE categories.category='{category}'
-         ORDER BY entries.published DESC
-        """.format(
-            category="article"
-        )
-    )
-
-    for (row,) in cur.fetchall():
-        if os.path.exists(row + ".json"):
-            entries.append(file_parser_json(row + ".json"))
+    entries = search_by_tag("article")
 
     if request.headers.get("Accept") == "application/json":
-        return jsonify(entries)
+        return entries_json(entries)
 
     return render_template("blog_entries.html", entries=entries)
 
@@ -1669,7 +1856,7 @@ def show_draft(name):
         form_data = post_from_request(request)
 
         if "Save" in request.form:
-            update_json_entry(form_data, existing_data, g=g, draft=True)
+            update_json_entry(form_data, existing_data, g=g.db, draft=True)
             return redirect("/drafts")
 
         if "Submit" in request.form:
@@ -1678,6 +1865,8 @@ def show_draft(name):
             post = BlogPost(**merged_data)
             location = create_json_entry(post, g=g.db, draft=False)
             os.remove(draft_file)
+            media_store.set_refs(g.db, draft_file, [])
+            g.db.commit()
             return redirect(location)
     abort(405)
 
@@ -1750,6 +1939,35 @@ def follower_individual(account):
     return redirect("/404")
 
 
+@app.route("/diagnostics", methods=["GET"])
+@require_auth
+def diagnostics():
+    """Internal counters for the in-process caches and the connection pool."""
+    return jsonify(
+        {
+            "entry_cache": entry_cache.stats(),
+            "feed_cache": feed_cache.stats(),
+            "db_pool": db_pool.stats(),
+        }
+    )
+
+
+@app.route("/media/jobs", methods=["GET"])
+@require_auth
+def media_jobs():
+    """Queued media work that hasn't finished, including failures."""
+    return jsonify(job_queue.outstanding(g.db))
+
+
+@app.route("/media/jobs/<int:job_id>/retry", methods=["POST"])
+@require_auth
+def retry_media_job(job_id):
+    """Queue a failed job again with a fresh set of attempts."""
+    if not job_queue.retry(g.db, job_id):
+        return jsonify({"error": "No failed job with that id"}), 404
+    return jsonify({"id": job_id, "status": "pending"})
+
+
 @app.route("/already_made", methods=["GET"])
 def post_already_exists():
     return render_template("already_exists.html")
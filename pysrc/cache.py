@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+__author__ = "kongaloosh"
+
+
+class LRUCache:
+    """A small thread-safe, size-bounded least-recently-used cache.
+
+    Keys are arbitrary hashables. A ``tag`` can be attached to every entry so
+    that all entries derived from the same source (e.g. every cached version of
+    one file) can be dropped together with :meth:`invalidate`.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._tags: Dict[Hashable, Hashable] = {}
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, tag: Optional[Hashable] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if tag is not None:
+                self._tags[key] = tag
+            while len(self._data) > self.maxsize:
+                old_key, _ = self._data.popitem(last=False)
+                self._tags.pop(old_key, None)
+
+    def get_or_set(
+        self, key: Hashable, factory: Callable[[], Any], tag: Optional[Hashable] = None
+    ) -> Any:
+        """Return the cached value for ``key``, computing it with ``factory`` on a miss."""
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = factory()
+            self.put(key, value, tag=tag)
+        return value
+
+    def invalidate(self, tag: Hashable) -> int:
+        """Drop every entry stored with ``tag``. Returns the number removed."""
+        with self._lock:
+            keys = [k for k, t in self._tags.items() if t == tag]
+            for k in keys:
+                self._data.pop(k, None)
+                del self._tags[k]
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self) -> int:
+        return len(self._data)
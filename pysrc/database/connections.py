@@ -0,0 +1,133 @@
+"""Opening the blog's SQLite database, and keeping a connection per thread.
+
+``connect`` opens a connection tuned for a small, read-mostly site: the
+database is put in WAL mode, so the media worker's writes don't block page
+requests and page requests don't block each other; commits only sync at
+checkpoints (``synchronous=NORMAL``, which can lose the last commits on a
+power cut but never corrupts the database); reads come through a memory map
+and a larger page cache; and more prepared statements are kept per
+connection than Python's default 128.
+
+``ConnectionPool`` hands each web worker thread one connection that it keeps
+across requests, instead of paying for a new connection, its pragmas and an
+empty statement cache on every request.
+"""
+
+import configparser
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+# seconds a connection waits on another's write lock before giving up
+BUSY_TIMEOUT = config.getfloat("Global", "DatabaseTimeout", fallback=5.0)
+MMAP_SIZE = config.getint("Global", "DatabaseMmapSize", fallback=256 * 1024 * 1024)
+# of each connection's page cache
+CACHE_KIB = config.getint("Global", "DatabaseCacheKiB", fallback=16 * 1024)
+STATEMENT_CACHE = config.getint("Global", "DatabaseStatementCache", fallback=256)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Opens ``path`` in WAL mode with the blog's pragmas."""
+    db = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT,
+        cached_statements=STATEMENT_CACHE,
+        # a pooled connection is only used by its thread, but closed by others
+        check_same_thread=False,
+    )
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(f"PRAGMA mmap_size={MMAP_SIZE:d}")
+    db.execute(f"PRAGMA cache_size={-CACHE_KIB:d}")
+    return db
+
+
+class ConnectionPool:
+    """One persistent connection per thread, opened on its first use.
+
+    Connections of threads that have exited are closed when the next
+    connection is opened. ``stats`` reports how many are open and how long
+    opening them has taken, for ``/diagnostics``.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection]):
+        self._connect = connect
+        self._local = threading.local()
+        self._threads: Dict[sqlite3.Connection, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.connect_seconds = 0.0
+
+    def connection(self) -> sqlite3.Connection:
+        """This thread's connection."""
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            with self._lock:
+                self.reused += 1
+            return db
+        self._close_orphans()
+        start = time.perf_counter()
+        db = self._connect()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._threads[db] = threading.current_thread()
+            self.opened += 1
+            self.connect_seconds += elapsed
+        self._local.db = db
+        return db
+
+    def reset(self, db: Optional[sqlite3.Connection] = None) -> None:
+        """Rolls back what a request left uncommitted, ready for the next one."""
+        db = db or getattr(self._local, "db", None)
+        if db is not None and db.in_transaction:
+            db.rollback()
+
+    def _close_orphans(self) -> None:
+        with self._lock:
+            orphans = [db for db, t in self._threads.items() if not t.is_alive()]
+            for db in orphans:
+                del self._threads[db]
+        for db in orphans:
+            self._close(db)
+
+    def _close(self, db: sqlite3.Connection) -> None:
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self.closed += 1
+
+    def close_all(self) -> None:
+        """Closes every connection, e.g. before forking or in tests."""
+        with self._lock:
+            connections = list(self._threads)
+            self._threads.clear()
+        for db in connections:
+            self._close(db)
+        self._local = threading.local()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            connect_ms = 1000 * self.connect_seconds
+            return {
+                "size": len(self._threads),
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+                "connect_ms": round(connect_ms, 3),
+                "mean_connect_ms": (
+                    round(connect_ms / self.opened, 3) if self.opened else None
+                ),
+            }
+
+    def __len__(self) -> int:
+        return len(self._threads)
@@ -11,18 +11,59 @@ class EntryQueries:
     SELECT_ALL = """
         SELECT entries.location 
         FROM entries
+        ORDER BY entries.published DESC, entries.id
+    """
+
+    SELECT_LATEST = """
+        SELECT entries.location
+        FROM entries
         ORDER BY entries.published DESC
+        LIMIT ? OFFSET ?
+    """
+
+    SELECT_PAGE = """
+        SELECT entries.id, entries.location, entries.published, entries.summary_json
+        FROM entries
+        ORDER BY entries.published DESC, entries.id DESC
+        LIMIT ? OFFSET ?
+    """
+
+    SELECT_PAGE_BEFORE = """
+        SELECT entries.id, entries.location, entries.published, entries.summary_json
+        FROM entries
+        WHERE (entries.published, entries.id) < (?, ?)
+        ORDER BY entries.published DESC, entries.id DESC
+        LIMIT ?
     """
 
+    ADD_SUMMARY_COLUMN = """
+        ALTER TABLE entries ADD COLUMN summary_json TEXT
+    """
+
+    UPDATE_SUMMARY = """
+        UPDATE entries
+        SET summary_json = ?
+        WHERE location = ?
+    """
+
+    # published is compared against half-open [start, end) date strings so the
+    # entries_published index can be used; wrapping it in strftime can't be.
     SELECT_BY_DATE = """
-        SELECT entries.location 
+        SELECT entries.location, entries.summary_json
         FROM entries
-        WHERE CAST(strftime('%Y',entries.published)AS INT) = ?
-        AND CAST(strftime('%m',entries.published)AS INT) = ?
-        AND CAST(strftime('%d',entries.published)AS INT) = ?
+        WHERE entries.published >= ? AND entries.published < ?
         ORDER BY entries.published DESC
     """
 
+    CREATE_INDEXES = """
+        CREATE INDEX IF NOT EXISTS entries_published ON entries(published);
+        CREATE INDEX IF NOT EXISTS entries_slug_published ON entries(slug, published);
+        CREATE INDEX IF NOT EXISTS categories_category_published
+            ON categories(category, published);
+        CREATE INDEX IF NOT EXISTS categories_slug_published
+            ON categories(slug, published);
+    """
+
 
 class CategoryQueries:
     INSERT_OR_REPLACE = """
@@ -36,6 +77,11 @@ class CategoryQueries:
         WHERE slug = ? AND category = ?
     """
 
+    DELETE_FOR_ENTRY = """
+        DELETE FROM categories
+        WHERE slug = ? AND published = ?
+    """
+
     SELECT_POPULAR = """
         SELECT category, COUNT(*) as count
         FROM categories
@@ -45,11 +91,374 @@ class CategoryQueries:
     """
 
     SELECT_BY_CATEGORY = """
-        SELECT entries.location 
+        SELECT entries.location, entries.summary_json
         FROM categories
         INNER JOIN entries ON 
             entries.slug = categories.slug AND 
             entries.published = categories.published
         WHERE categories.category = ?
-        ORDER BY entries.published DESC
+        ORDER BY categories.published DESC
+    """
+
+    SELECT_BY_CATEGORY_AND_DATE = """
+        SELECT entries.location, entries.summary_json
+        FROM categories
+        INNER JOIN entries ON
+            entries.slug = categories.slug AND
+            entries.published = categories.published
+        WHERE categories.category = ?
+        AND categories.published >= ? AND categories.published < ?
+        ORDER BY categories.published DESC
+    """
+
+
+class TagCountQueries:
+    # tag_counts is maintained by triggers on categories, so every insert or
+    # delete of a category row, from any code path, keeps the counts current.
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            category TEXT PRIMARY KEY,
+            count INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tag_counts_count ON tag_counts(count);
+
+        CREATE TRIGGER IF NOT EXISTS categories_count_insert
+        AFTER INSERT ON categories
+        BEGIN
+            INSERT INTO tag_counts (category, count) VALUES (new.category, 1)
+            ON CONFLICT(category) DO UPDATE SET count = count + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS categories_count_delete
+        AFTER DELETE ON categories
+        BEGIN
+            UPDATE tag_counts SET count = count - 1 WHERE category = old.category;
+            DELETE FROM tag_counts WHERE category = old.category AND count <= 0;
+        END;
+    """
+
+    REBUILD = """
+        DELETE FROM tag_counts;
+        INSERT INTO tag_counts (category, count)
+        SELECT category, COUNT(*) FROM categories GROUP BY category;
+    """
+
+    SELECT_TOP = """
+        SELECT category, count
+        FROM tag_counts
+        WHERE category NOT IN ('None', 'image', 'album', 'bookmark', 'note')
+        ORDER BY count DESC
+        LIMIT ?
+    """
+
+    SELECT_ALL = """
+        SELECT category, count
+        FROM tag_counts
+        ORDER BY count DESC
+    """
+
+
+class GeoQueries:
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS geo_points (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            slug TEXT NOT NULL,
+            published DATE NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            kind TEXT NOT NULL,
+            trip_date DATE,
+            FOREIGN KEY (slug) REFERENCES entries(slug)
+        );
+        CREATE INDEX IF NOT EXISTS geo_points_published ON geo_points(published);
+        CREATE INDEX IF NOT EXISTS geo_points_slug ON geo_points(slug, published);
+    """
+
+    INSERT = """
+        INSERT INTO geo_points
+        (slug, published, lat, lon, kind, trip_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+
+    DELETE = """
+        DELETE FROM geo_points
+        WHERE slug = ? AND published = ?
+    """
+
+    SELECT_COORDINATES = """
+        SELECT lat, lon
+        FROM geo_points
+        ORDER BY published DESC, id
+    """
+
+
+class JobQueries:
+    # a job is pending until a worker claims it, then running, then done or,
+    # once it has used up its attempts, failed
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            target TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            error TEXT,
+            result TEXT,
+            progress TEXT,
+            run_after TEXT NOT NULL,
+            created TEXT NOT NULL,
+            updated TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, run_after);
+        CREATE INDEX IF NOT EXISTS jobs_target ON jobs(target);
+    """
+
+    # databases from before jobs recorded their results
+    ADD_RESULT_COLUMN = """
+        ALTER TABLE jobs ADD COLUMN result TEXT
+    """
+
+    ADD_PROGRESS_COLUMN = """
+        ALTER TABLE jobs ADD COLUMN progress TEXT
+    """
+
+    INSERT = """
+        INSERT INTO jobs
+        (kind, payload, target, max_attempts, run_after, created, updated)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """
+
+    CLAIM = """
+        UPDATE jobs
+        SET status = 'running', attempts = attempts + 1, progress = NULL,
+            updated = ?
+        WHERE id = (
+            SELECT id FROM jobs
+            WHERE status = 'pending' AND run_after <= ?
+                AND kind NOT IN (SELECT value FROM json_each(?))
+            ORDER BY id
+            LIMIT 1
+        )
+        RETURNING id, kind, payload, attempts, max_attempts
+    """
+
+    COMPLETE = """
+        UPDATE jobs
+        SET status = 'done', error = NULL, result = ?, updated = ?
+        WHERE id = ?
+    """
+
+    FAIL = """
+        UPDATE jobs
+        SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END,
+            error = ?, run_after = ?, updated = ?
+        WHERE id = ?
+    """
+
+    RETRY = """
+        UPDATE jobs
+        SET status = 'pending', attempts = 0, run_after = ?, updated = ?
+        WHERE id = ? AND status = 'failed'
+    """
+
+    # jobs a worker was running when it died
+    REQUEUE_RUNNING = """
+        UPDATE jobs
+        SET status = 'pending', updated = ?
+        WHERE status = 'running'
+    """
+
+    SELECT_OUTSTANDING = """
+        SELECT id, kind, target, status, attempts, max_attempts, error, created, updated
+        FROM jobs
+        WHERE status != 'done'
+        ORDER BY id
+    """
+
+    SELECT_BY_TARGET = """
+        SELECT payload, status
+        FROM jobs
+        WHERE target = ? AND status != 'done'
+        ORDER BY id DESC
+        LIMIT 1
+    """
+
+    UPDATE_PROGRESS = """
+        UPDATE jobs
+        SET progress = ?, updated = ?
+        WHERE id = ?
+    """
+
+    SELECT_PROGRESS_BY_TARGET = """
+        SELECT progress
+        FROM jobs
+        WHERE target = ?
+        ORDER BY id DESC
+        LIMIT 1
+    """
+
+    SELECT_RESULT_BY_TARGET = """
+        SELECT result
+        FROM jobs
+        WHERE target = ? AND status = 'done'
+        ORDER BY id DESC
+        LIMIT 1
+    """
+
+
+class MediaQueries:
+    # media.refs counts the posts using each stored photo; like tag_counts it's
+    # kept in step by triggers on media_refs
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS media (
+            hash TEXT PRIMARY KEY,
+            refs INTEGER NOT NULL DEFAULT 0,
+            variants_json TEXT,
+            created TEXT NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS media_refs (
+            hash TEXT NOT NULL,
+            post TEXT NOT NULL,
+            PRIMARY KEY (hash, post)
+        );
+        CREATE INDEX IF NOT EXISTS media_refs_post ON media_refs(post);
+
+        CREATE TABLE IF NOT EXISTS media_aliases (
+            path TEXT PRIMARY KEY,
+            hash TEXT NOT NULL
+        );
+
+        CREATE TRIGGER IF NOT EXISTS media_refs_insert
+        AFTER INSERT ON media_refs
+        BEGIN
+            UPDATE media SET refs = refs + 1 WHERE hash = new.hash;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS media_refs_delete
+        AFTER DELETE ON media_refs
+        BEGIN
+            UPDATE media SET refs = refs - 1 WHERE hash = old.hash;
+        END;
+    """
+
+    INSERT = """
+        INSERT OR IGNORE INTO media (hash, created)
+        VALUES (?, ?)
+    """
+
+    UPSERT_VARIANTS = """
+        INSERT INTO media (hash, variants_json, created)
+        VALUES (?, ?, ?)
+        ON CONFLICT(hash) DO UPDATE SET variants_json = excluded.variants_json
+    """
+
+    SELECT_VARIANTS = """
+        SELECT variants_json
+        FROM media
+        WHERE hash = ?
+    """
+
+    SELECT_REFS = """
+        SELECT refs
+        FROM media
+        WHERE hash = ?
+    """
+
+    DELETE = """
+        DELETE FROM media
+        WHERE hash = ?
+    """
+
+    INSERT_REF = """
+        INSERT OR IGNORE INTO media_refs (hash, post)
+        VALUES (?, ?)
+    """
+
+    DELETE_REF = """
+        DELETE FROM media_refs
+        WHERE hash = ? AND post = ?
+    """
+
+    SELECT_BY_POST = """
+        SELECT hash
+        FROM media_refs
+        WHERE post = ?
+    """
+
+    SELECT_POSTS = """
+        SELECT post
+        FROM media_refs
+        WHERE hash = ?
+        ORDER BY post
+    """
+
+    INSERT_ALIAS = """
+        INSERT OR REPLACE INTO media_aliases (path, hash)
+        VALUES (?, ?)
+    """
+
+    SELECT_ALIAS = """
+        SELECT hash
+        FROM media_aliases
+        WHERE path = ?
+    """
+
+
+class PhotoQueries:
+    CREATE_TABLE = """
+        CREATE TABLE IF NOT EXISTS photos (
+            path TEXT PRIMARY KEY,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            orientation INTEGER NOT NULL DEFAULT 1,
+            taken TEXT,
+            lat REAL,
+            lon REAL,
+            bytes INTEGER NOT NULL,
+            mtime INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS photos_taken ON photos(taken);
+    """
+
+    UPSERT = """
+        INSERT OR REPLACE INTO photos
+            (path, width, height, orientation, taken, lat, lon, bytes, mtime)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    SELECT = """
+        SELECT path, width, height, orientation, taken, lat, lon, bytes, mtime
+        FROM photos
+        WHERE path = ?
+    """
+
+    SELECT_UNDER = """
+        SELECT path, width, height, orientation, taken, lat, lon, bytes, mtime
+        FROM photos
+        WHERE substr(path, 1, ?) = ?
+    """
+
+    SELECT_SIZE = """
+        SELECT width, height
+        FROM photos
+        WHERE path = ?
+    """
+
+    SELECT_STAMP = """
+        SELECT bytes, mtime
+        FROM photos
+        WHERE path = ?
+    """
+
+    SELECT_PATHS = """
+        SELECT path
+        FROM photos
+    """
+
+    DELETE = """
+        DELETE FROM photos
+        WHERE path = ?
     """
@@ -0,0 +1,271 @@
+"""Renders the public site to static files so a front proxy can serve it.
+
+    python -m pysrc.export build/
+    flask export build/
+
+Every page is rendered through the Flask app itself, as an anonymous
+visitor, so the output matches what the live site serves. A manifest in the
+output directory records each post's mtime and content hash and which posts
+every page was built from; later runs only re-render pages whose posts
+changed or whose list of posts is different.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+__author__ = "kongaloosh"
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".export-manifest.json"
+ARTICLES_ON_INDEX = 3
+
+# pages that summarise the whole archive rather than listing particular posts
+SITE_WIDE_PAGES = ["/", "/t/"]
+
+_client = None
+
+
+@dataclass
+class ExportResult:
+    rendered: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+
+
+def page_path(output_dir: str, url: str) -> str:
+    """Where a page is written: feeds keep their names, everything else is an index.html."""
+    relative = url.strip("/")
+    if os.path.splitext(relative)[1] in (".xml", ".feed"):
+        return os.path.join(output_dir, relative)
+    return os.path.join(output_dir, relative, "index.html")
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def site_pages(
+    db, blog_storage: str, page_size: int, feed_length: int
+) -> Dict[str, List[str]]:
+    """Maps every public page's url to the posts (locations) it is built from."""
+    from pysrc.database.queries import CategoryQueries, TagCountQueries
+
+    rows = db.execute(
+        """
+        SELECT entries.location, entries.published
+        FROM entries
+        ORDER BY entries.published DESC, entries.id DESC
+        """
+    ).fetchall()
+    rows = [
+        (loc, str(published))
+        for loc, published in rows
+        if os.path.exists(loc + ".json")
+    ]
+    locations = [loc for loc, _ in rows]
+
+    def by_tag(tag: str) -> List[str]:
+        cur = db.execute(CategoryQueries.SELECT_BY_CATEGORY, (tag,))
+        return [loc for loc, _ in cur.fetchall() if os.path.exists(loc + ".json")]
+
+    articles = by_tag("article")
+    pages: Dict[str, List[str]] = {
+        "/": locations[:page_size] + articles[:ARTICLES_ON_INDEX],
+        "/t/": [],
+        "/a/": articles,
+        "/map": [
+            loc
+            for (loc,) in db.execute(
+                """
+                SELECT DISTINCT entries.location
+                FROM geo_points
+                INNER JOIN entries ON
+                    entries.slug = geo_points.slug AND
+                    entries.published = geo_points.published
+                """
+            )
+            if os.path.exists(loc + ".json")
+        ],
+    }
+    for feed in ("/rss.xml", "/atom.xml", "/json.feed"):
+        pages[feed] = locations[:feed_length]
+
+    for number, start in enumerate(range(0, len(locations), page_size)):
+        pages[f"/page/{number}"] = locations[start : start + page_size]
+
+    for (tag, _) in db.execute(TagCountQueries.SELECT_ALL).fetchall():
+        pages[f"/t/{tag}"] = by_tag(tag)
+
+    for location, published in rows:
+        year, month, day = (int(part) for part in published[:10].split("-"))
+        for url in (f"/e/{year}/", f"/e/{year}/{month}/", f"/e/{year}/{month}/{day}/"):
+            pages.setdefault(url, []).append(location)
+        relative = os.path.relpath(location, blog_storage).replace(os.sep, "/")
+        pages[f"/e/{relative}"] = [location]
+
+    return pages
+
+
+def load_manifest(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"sources": {}, "pages": {}}
+
+
+def write_atomically(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".export-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def changed_sources(
+    locations: Iterable[str], previous: Dict[str, dict]
+) -> Tuple[Dict[str, dict], Set[str]]:
+    """Stat every post, hashing only those whose mtime moved.
+
+    Returns:
+        the new source records and the set of posts whose content changed.
+    """
+    sources: Dict[str, dict] = {}
+    changed: Set[str] = set()
+    for location in locations:
+        mtime = os.stat(location + ".json").st_mtime_ns
+        old = previous.get(location)
+        if old and old["mtime"] == mtime:
+            sources[location] = old
+            continue
+        digest = file_hash(location + ".json")
+        sources[location] = {"mtime": mtime, "sha256": digest}
+        if not old or old["sha256"] != digest:
+            changed.add(location)
+    return sources, changed
+
+
+def dirty_pages(
+    pages: Dict[str, List[str]],
+    previous_pages: Dict[str, List[str]],
+    changed: Set[str],
+    removed: Set[str],
+) -> List[str]:
+    """Pages to re-render: new pages, pages whose posts changed or moved."""
+    dirty = {
+        url
+        for url, locations in pages.items()
+        if previous_pages.get(url) != locations or changed.intersection(locations)
+    }
+    if changed or removed:
+        dirty.update(SITE_WIDE_PAGES)
+    return sorted(dirty)
+
+
+def _init_worker() -> None:
+    global _client
+    from kongaloosh import app
+
+    _client = app.test_client()
+
+
+def _render(url: str) -> Tuple[str, int, bytes]:
+    if _client is None:
+        _init_worker()
+    response = _client.get(url)
+    return url, response.status_code, response.get_data()
+
+
+def export_site(
+    output_dir: str, full: bool = False, workers: Optional[int] = None
+) -> ExportResult:
+    """Renders every public page that changed since the last export.
+
+    Args:
+        output_dir: where the static site is written.
+        full: ignore the manifest and render every page.
+        workers: size of the rendering process pool; 0 renders in this process.
+    """
+    from contextlib import closing
+    from kongaloosh import BLOG_STORAGE, FEED_LENGTH, PAGE_SIZE, connect_db
+
+    manifest = {"sources": {}, "pages": {}} if full else load_manifest(output_dir)
+
+    with closing(connect_db()) as db:
+        pages = site_pages(db, BLOG_STORAGE, PAGE_SIZE, FEED_LENGTH)
+
+    locations = {loc for locs in pages.values() for loc in locs}
+    sources, changed = changed_sources(sorted(locations), manifest["sources"])
+    removed = set(manifest["sources"]) - set(sources)
+    to_render = dirty_pages(pages, manifest["pages"], changed, removed)
+
+    result = ExportResult()
+    pool = None
+    if workers == 0:
+        rendered = map(_render, to_render)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        rendered = pool.map(_render, to_render, chunksize=8)
+
+    try:
+        for url, status, body in rendered:
+            if status != 200:
+                logger.error(f"Rendering {url} returned {status}")
+                result.failed.append(url)
+                continue
+            write_atomically(page_path(output_dir, url), body)
+            result.rendered.append(url)
+    finally:
+        # a render or write error mustn't leave the workers running
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    for url in set(manifest["pages"]) - set(pages):
+        path = page_path(output_dir, url)
+        if os.path.exists(path):
+            os.remove(path)
+        result.removed.append(url)
+
+    # leaving failed pages out of the manifest makes the next run retry them
+    for url in result.failed:
+        pages.pop(url, None)
+
+    manifest = {"sources": sources, "pages": pages}
+    write_atomically(
+        os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest).encode()
+    )
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir")
+    parser.add_argument("--full", action="store_true", help="render every page")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    result = export_site(args.output_dir, full=args.full, workers=args.workers)
+    print(
+        f"Rendered {len(result.rendered)} pages, removed {len(result.removed)}, "
+        f"{len(result.failed)} failed"
+    )
+
+
+if __name__ == "__main__":
+    main()
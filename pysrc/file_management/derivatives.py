@@ -0,0 +1,131 @@
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from PIL import Image, ImageOps
+
+__author__ = "kongaloosh"
+
+
+@dataclass(frozen=True)
+class Derivative:
+    """One file produced from a source photo.
+
+    Attributes:
+        path: where the file is written.
+        max_dim: longest side in pixels; None keeps the full resolution.
+        quality: encoder quality.
+        format: a Pillow format name, e.g. JPEG or WEBP.
+        skip_if_smaller: don't write it when the photo is already no larger
+            than max_dim, rather than writing a duplicate of a bigger size.
+    """
+
+    path: str
+    max_dim: Optional[int] = None
+    quality: int = 85
+    format: str = "JPEG"
+    skip_if_smaller: bool = False
+
+
+# (extension, Pillow format, MIME type, quality) of each responsive variant
+VARIANT_FORMATS = [
+    ("jpg", "JPEG", "image/jpeg", 85),
+    ("webp", "WEBP", "image/webp", 80),
+    ("avif", "AVIF", "image/avif", 60),
+]
+
+
+def supported_formats() -> List[Tuple[str, str, str, int]]:
+    """The variant formats this Pillow build can write; AVIF needs a plugin."""
+    Image.init()
+    return [f for f in VARIANT_FORMATS if f[1] in Image.SAVE]
+
+
+def flatten(img: Image.Image) -> Image.Image:
+    """Returns an RGB image, compositing any transparency onto white."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.convert("RGBA").split()[3])
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def save_atomically(
+    img: Image.Image, path: str, quality: int, format: str = "JPEG"
+) -> None:
+    """Writes the image next to ``path`` and renames it into place.
+
+    Readers never see a partially written file, and a failed save leaves any
+    previous version untouched.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".derivative-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, format, quality=quality)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write_derivatives(
+    source: str, derivatives: Iterable[Derivative]
+) -> Dict[str, Tuple[int, int]]:
+    """Decodes ``source`` once and writes every derivative from that decode.
+
+    The photo is turned upright according to its EXIF orientation, and
+    outputs are produced largest first, each one shrinking the previous
+    result in place, so no size is decoded or resampled from the original
+    more than once.
+
+    Returns:
+        the (width, height) of every file written, by path, largest first.
+    """
+    ordered = sorted(
+        derivatives,
+        key=lambda d: float("inf") if d.max_dim is None else d.max_dim,
+        reverse=True,
+    )
+    written = {}
+    with Image.open(source) as original:
+        longest = max(original.size)
+        # uploads keep their camera orientation; this is where it's applied
+        img = flatten(ImageOps.exif_transpose(original))
+        for derivative in ordered:
+            if derivative.max_dim is not None:
+                if derivative.skip_if_smaller and longest < derivative.max_dim:
+                    continue
+                img.thumbnail((derivative.max_dim, derivative.max_dim))
+            save_atomically(img, derivative.path, derivative.quality, derivative.format)
+            written[derivative.path] = img.size
+    return written
+
+
+def write_thumbnail(
+    source: str, path: str, max_dim: int, quality: int = 80
+) -> Tuple[int, int]:
+    """Writes a small JPEG preview of ``source``.
+
+    JPEGs are decoded in draft mode, which lets libjpeg scale by up to 1/8
+    while decoding, so a camera original is never decoded at full size.
+
+    Returns:
+        the thumbnail's (width, height).
+    """
+    with Image.open(source) as original:
+        original.draft("RGB", (max_dim, max_dim))
+        img = flatten(ImageOps.exif_transpose(original))
+        img.thumbnail((max_dim, max_dim))
+        save_atomically(img, path, quality)
+        return img.size
+
+
+def sized_path(path: str, max_dim: int, extension: Optional[str] = None) -> str:
+    """Where a variant of ``path`` lives, e.g. post-0.jpg -> post-0-400w.webp."""
+    root, original = os.path.splitext(path)
+    extension = f".{extension}" if extension else original
+    return f"{root}-{max_dim}w{extension}"
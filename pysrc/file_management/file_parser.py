@@ -4,21 +4,44 @@ import sqlite3
 from slugify import slugify
 import re
 import json
-from pysrc.markdown_hashtags.markdown_hashtag_extension import HashtagExtension
-from pysrc.markdown_albums.markdown_album_extension import AlbumExtension
 import logging
 from PIL import Image
-import markdown as markdown
+from dataclasses import asdict
 from datetime import datetime
 from flask import current_app as app
-from pysrc.post import BlogPost, ReplyTo, Event, DraftPost
+from pysrc.post import (
+    BlogPost,
+    ReplyTo,
+    Event,
+    DraftPost,
+    EntrySummary,
+    PhotoVariant,
+)
 from pydantic import ValidationError
-from typing import Any, Union
+from typing import Any, List, Optional, Set, Tuple, Union
 from pysrc.markdown_albums.markdown_album_extension import album_regexp
-from pysrc.database.queries import EntryQueries, CategoryQueries
+from pysrc.database.queries import EntryQueries, CategoryQueries, GeoQueries
 import shutil
-from pysrc.video_converter import convert_video_to_mp4
+from pysrc.video_converter import (
+    VIDEO_ENCODERS,
+    convert_video_to_mp4,
+    make_streams,
+    poster_path,
+    streams_dir,
+)
 from pysrc.post import GeoLocation
+from pysrc.cache import LRUCache
+from pysrc import job_queue
+from pysrc.rendering import render_markdown
+from pysrc.file_management import media_store, photo_index
+from pysrc.file_management.derivatives import (
+    VARIANT_FORMATS,
+    Derivative,
+    sized_path,
+    supported_formats,
+    write_derivatives,
+    write_thumbnail,
+)
 
 ALBUM_GROUP_RE = re.compile(album_regexp)
 
@@ -46,9 +69,33 @@ BLOG_STORAGE = config.get("PhotoLocations", "BlogStorage")
 BULK_UPLOAD_DIR = config.get("PhotoLocations", "BulkUploadLocation")
 DRAFTS_STORAGE = config.get("PhotoLocations", "DraftsStorage")
 PERMANENT_PHOTOS_DIR = config.get("PhotoLocations", "PermStorage")
+ENTRY_CACHE_SIZE = config.getint("Global", "EntryCacheSize", fallback=512)
+REPLY_DEPTH = config.getint("Global", "ReplyDepth", fallback=3)
+THUMBNAIL_CACHE = config.get(
+    "PhotoLocations", "ThumbnailCache", fallback="images/thumbnails"
+)
+THUMBNAIL_SIZE = config.getint("PhotoLocations", "ThumbnailSize", fallback=300)
+# queued photos are run by the site's own thread unless Global/MediaWorker says a
+# `flask media-worker` runs them
+BACKGROUND_MEDIA = config.getboolean("Global", "BackgroundMedia", fallback=True)
+WEB_SIZE = config.getint("PhotoLocations", "WebSize", fallback=800)
+RESPONSIVE_WIDTHS = [
+    int(size)
+    for size in config.get(
+        "PhotoLocations", "ResponsiveWidths", fallback="400,800,1200,1600"
+    ).split(",")
+    if size.strip()
+]
+
+# in_reply_to urls that point at posts on this site
+LOCAL_POST_PREFIXES = ("http://127.0.0.1:5000/e/", "https://kongaloosh.com/e/")
 
 _MAX_SIZE = 3000
 
+# parsed posts, keyed by (path, mtime, size, md), and reply contexts, keyed by
+# ("reply", path, mtime, size); both are tagged with the path
+entry_cache = LRUCache(maxsize=ENTRY_CACHE_SIZE)
+
 
 def resize(img: Image.Image, max_dim: int) -> Image.Image:
     """Takes an image and resizes to max size along largest dimension.
@@ -72,53 +119,261 @@ def resize(img: Image.Image, max_dim: int) -> Image.Image:
     return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
 
-def move_and_resize(from_location: str, to_copy: str, high_res: str) -> None:
-    """Move a file from a temporary location to a permanent one."""
-    try:
-        # Create directories if they don't exist
-        os.makedirs(os.path.dirname(to_copy), exist_ok=True)
-        os.makedirs(os.path.dirname(high_res), exist_ok=True)
+def photo_derivatives(web_location: str, high_res_location: str) -> List[Derivative]:
+    """The files every uploaded photo becomes.
+
+    A full-resolution archive copy, the web copy the post links to and the
+    responsive variants: one per width in ``PhotoLocations/ResponsiveWidths``
+    and format Pillow can write, next to the web copy.
+    """
+    derivatives = [
+        Derivative(high_res_location, None, quality=95),
+        Derivative(web_location, WEB_SIZE, quality=85),
+    ]
+    return derivatives + variant_derivatives(web_location)
+
+
+def variant_derivatives(web_location: str) -> List[Derivative]:
+    """The responsive variants of a photo; the web copy stands in for its own size."""
+    return [
+        Derivative(
+            sized_path(web_location, width, extension),
+            width,
+            quality=quality,
+            format=format,
+            skip_if_smaller=True,
+        )
+        for width in RESPONSIVE_WIDTHS
+        for extension, format, _, quality in supported_formats()
+        if not (width == WEB_SIZE and format == "JPEG")
+    ]
+
+
+def photo_variants(written: dict) -> List[PhotoVariant]:
+    """Describes the files ``write_derivatives`` produced for a photo's srcset."""
+    mime_types = {f".{ext}": mime for ext, _, mime, _ in VARIANT_FORMATS}
+    variants = [
+        PhotoVariant(
+            path=path,
+            width=width,
+            height=height,
+            type=mime_types.get(os.path.splitext(path)[1], "image/jpeg"),
+        )
+        for path, (width, height) in written.items()
+    ]
+    return sorted(variants, key=lambda v: (v.type, v.width))
 
-        # Open and process the image
-        img = Image.open(from_location)
 
-        # Convert RGBA to RGB if necessary
-        if img.mode in ("RGBA", "LA") or (
-            img.mode == "P" and "transparency" in img.info
-        ):
-            # Create a white background
-            background = Image.new("RGB", img.size, (255, 255, 255))
-            # Paste the image on the background using alpha channel as mask
-            if img.mode == "RGBA":
-                background.paste(img, mask=img.split()[3])
-            else:
-                background.paste(img, mask=img.convert("RGBA").split()[3])
-            img = background
-
-        # Save the web-sized version
-        img.thumbnail((800, 800))  # Resize for web
-        img.save(to_copy, "JPEG", quality=85)
-
-        # Save the high-res version
-        img_high = Image.open(from_location)
-        if img_high.mode in ("RGBA", "LA") or (
-            img_high.mode == "P" and "transparency" in img_high.info
-        ):
-            background = Image.new("RGB", img_high.size, (255, 255, 255))
-            if img_high.mode == "RGBA":
-                background.paste(img_high, mask=img_high.split()[3])
-            else:
-                background.paste(img_high, mask=img_high.convert("RGBA").split()[3])
-            img_high = background
-        img_high.save(high_res, "JPEG", quality=95)
-
-        # Clean up the original file if it's in the temporary directory
-        if BULK_UPLOAD_DIR in from_location:
-            os.remove(from_location)
+def move_and_resize(
+    from_location: str, to_copy: str, high_res: str
+) -> List[PhotoVariant]:
+    """Move a file from a temporary location to a permanent one.
+
+    Returns:
+        the web copy and its responsive variants, for the post's photo_variants.
+    """
+    try:
+        written = write_derivatives(
+            from_location, photo_derivatives(to_copy, high_res)
+        )
+        discard_upload(from_location)
 
     except Exception as e:
         app.logger.error(f"Error processing image {from_location}: {str(e)}")
         raise ValueError(f"Failed to process image: {str(e)}")
+    del written[high_res]
+    return photo_variants(written)
+
+
+def discard_upload(upload: str) -> None:
+    """Removes a published upload, and its thumbnail, from the upload tray."""
+    if BULK_UPLOAD_DIR in upload:
+        os.remove(upload)
+        if os.path.exists(thumbnail_path(upload)):
+            os.remove(thumbnail_path(upload))
+
+
+def thumbnail_path(upload: str) -> str:
+    """Where the upload tray's thumbnail of ``upload`` is cached."""
+    return os.path.join(THUMBNAIL_CACHE, os.path.basename(upload) + ".jpg")
+
+
+def upload_thumbnail(upload: str) -> Optional[str]:
+    """The cached thumbnail of an uploaded photo, made if missing or stale.
+
+    Returns:
+        the thumbnail's path, or None if the upload couldn't be read.
+    """
+    thumbnail = thumbnail_path(upload)
+    try:
+        if os.stat(thumbnail).st_mtime >= os.stat(upload).st_mtime:
+            return thumbnail
+    except OSError:
+        pass
+    try:
+        write_thumbnail(upload, thumbnail, THUMBNAIL_SIZE)
+    except (OSError, ValueError) as e:
+        logger.error(f"Couldn't make a thumbnail of {upload}: {e}")
+        return None
+    return thumbnail
+
+
+def process_photo(payload: dict) -> List[dict]:
+    """Job handler for a queued photo; runs in a media worker process."""
+    variants = move_and_resize(payload["source"], payload["web"], payload["high_res"])
+    return [variant.model_dump() for variant in variants]
+
+
+def finish_photo(db, payload: dict, variants: List[dict]) -> None:
+    """Records a processed photo's variants in every post using it."""
+    upload = payload.get("upload")
+    index_stored_photo(
+        db, payload, photo_index.PhotoMetadata(**upload) if upload else None
+    )
+    posts = [payload.get("post")]
+    digest = media_store.stored_hash(payload["web"])
+    if digest:
+        media_store.record_variants(db, digest, variants)
+        posts += media_store.posts(db, digest)
+    for post in dict.fromkeys(posts):
+        if not post or not os.path.exists(post):
+            continue
+        with open(post) as f:
+            data = json.load(f)
+        if payload["web"] not in (data.get("photo") or []):
+            continue  # the photo was removed while it was waiting
+        data["photo_variants"] = {
+            **(data.get("photo_variants") or {}),
+            payload["web"]: variants,
+        }
+        with open(post, "w") as f:
+            json.dump(data, f)
+        invalidate_entry(post)
+        if not post.startswith(DRAFTS_STORAGE):
+            store_entry_summary(db, post[: -len(".json")])
+    db.commit()
+
+
+job_queue.register("photo", process_photo, finish_photo)
+
+
+def finish_streams(db, payload: dict, streams: dict) -> None:
+    """Records a published video's HLS renditions and poster in its post."""
+    post = payload["post"]
+    if os.path.exists(post):
+        with open(post) as f:
+            data = json.load(f)
+        if payload["source"] in (data.get("video") or []):
+            data["video_streams"] = {
+                **(data.get("video_streams") or {}),
+                payload["source"]: streams,
+            }
+            with open(post, "w") as f:
+                json.dump(data, f)
+            invalidate_entry(post)
+            if not post.startswith(DRAFTS_STORAGE):
+                store_entry_summary(db, post[: -len(".json")])
+    db.commit()
+
+
+job_queue.register(
+    "streams", make_streams, finish_streams, limit=VIDEO_ENCODERS, group="ffmpeg"
+)
+
+
+def remove_streams(video: str) -> None:
+    """Deletes the renditions and poster made of a video that was removed."""
+    shutil.rmtree(streams_dir(video), ignore_errors=True)
+    if os.path.exists(poster_path(video)):
+        os.remove(poster_path(video))
+
+
+def index_stored_photo(
+    db, payload: dict, upload: Optional[photo_index.PhotoMetadata]
+) -> None:
+    """Adds a processed photo's web and archive copies to the photo index.
+
+    Both are re-encoded without EXIF, so they take their capture time and
+    position from the upload's metadata.
+    """
+    for path in (payload["web"], payload["high_res"]):
+        photo_index.index_photo(db, path, exif_from=upload)
+
+
+def process_or_queue_photo(
+    db,
+    source: str,
+    web: str,
+    high_res: str,
+    post: Optional[str] = None,
+    upload: Optional[photo_index.PhotoMetadata] = None,
+) -> Optional[List[PhotoVariant]]:
+    """Processes an uploaded photo, in the background when possible.
+
+    With ``Global/BackgroundMedia`` on (the default) and a database to queue
+    on, the photo becomes a job for the media worker and None is returned;
+    until the job finishes, requests for ``web`` are answered with the
+    upload itself. Otherwise the photo is processed now and its variants
+    returned.
+
+    Args:
+        post: the json file whose photo_variants the result belongs in.
+        upload: the source's metadata, for the photo index.
+    """
+    payload = {"source": source, "web": web, "high_res": high_res, "post": post}
+    if BACKGROUND_MEDIA and db is not None:
+        payload["upload"] = asdict(upload) if upload else None
+        job_queue.enqueue(db, "photo", payload, target=web)
+        return None
+    variants = move_and_resize(source, web, high_res)
+    if db is not None:
+        index_stored_photo(db, payload, upload)
+    return variants
+
+
+def store_photo(
+    db, source: str, post: Optional[str] = None
+) -> Tuple[str, Optional[List[PhotoVariant]]]:
+    """Puts an uploaded photo in the media store, under the hash of its bytes.
+
+    A photo that is already stored, or already queued, isn't processed again:
+    the upload is discarded and the post shares the stored copy.
+
+    Args:
+        post: the json file whose photo_variants the result belongs in.
+
+    Returns:
+        the web copy's path and its variants, or None for the variants while
+        they're being made in the background.
+    """
+    digest = media_store.content_hash(source)
+    web = media_store.web_path(digest)
+    pending = job_queue.pending_job(db, web) if db is not None else None
+    if os.path.exists(web) or pending:
+        if not pending or pending[0]["source"] != source:
+            discard_upload(source)
+        known = media_store.variants(db, digest) if db is not None else None
+        return web, [PhotoVariant(**v) for v in known] if known else None
+
+    upload = photo_index.indexed(db, source) if db is not None else None
+    variants = process_or_queue_photo(
+        db, source, web, media_store.archive_path(digest), post=post, upload=upload
+    )
+    if db is not None and variants is not None:
+        media_store.record_variants(
+            db, digest, [variant.model_dump() for variant in variants]
+        )
+    return web, variants
+
+
+def stored_photos(data: Union[BlogPost, DraftPost]) -> Set[str]:
+    """The hashes of the stored photos a post uses, in its photos or its albums."""
+    digests = media_store.hashes_in(data.content or "")
+    for photo in data.photo or []:
+        digest = media_store.stored_hash(str(photo))
+        if digest:
+            digests.add(digest)
+    return digests
 
 
 def save_to_two(image: str, to_blog_location: str, to_copy: str) -> None:
@@ -129,29 +384,125 @@ def save_to_two(image: str, to_blog_location: str, to_copy: str) -> None:
     :param to_blog_location: Path to save the scaled-down image
     :param to_copy: Path to save the original-size image
     """
-    to_blog_location = to_blog_location.lower()
-    to_copy = to_copy.lower()
-
-    os.makedirs(os.path.dirname(to_copy), exist_ok=True)
-    os.makedirs(os.path.dirname(to_blog_location), exist_ok=True)
-
-    with Image.open(image) as img:
-        # Save original size image
-        img_rgb = img.convert("RGB")
-        img_rgb.save(to_copy, "JPEG")
-
-        # Save resized image
-        img_resized = resize(img_rgb, _MAX_SIZE)
-        img_resized.save(to_blog_location, "JPEG")
+    write_derivatives(
+        image,
+        [
+            Derivative(to_copy.lower(), None, quality=75),
+            Derivative(to_blog_location.lower(), _MAX_SIZE, quality=75),
+        ],
+    )
     # Result:
     # Scaled optimised thumbnail in the blog-source next to the post's json and md files
     # Original-size photos in the self-hosting image server directory
 
 
+def invalidate_entry(filename: str) -> None:
+    """Drops any cached parse of ``filename`` after it has been written or deleted."""
+    entry_cache.invalidate(os.path.abspath(filename))
+
+
 def file_parser_json(filename: str, md: bool = True) -> Union[BlogPost, DraftPost]:
     """
     Parses a json file into a BlogPost object.
+
+    Parsed posts are kept in ``entry_cache`` keyed on the file's mtime and size,
+    so unchanged posts are only rendered once. Callers get their own copy, with
+    replies to local posts resolved by ``reply_context``.
     """
+    post = _cached_entry(filename, md).model_copy(deep=True)
+    if post.in_reply_to:
+        post.in_reply_to = resolve_replies(post.in_reply_to)
+    return post
+
+
+def resolve_replies(in_reply_to: list) -> list:
+    """A post's replies, with those to local posts swapped for their context."""
+    return [
+        reply_context(str(reply.url))
+        if isinstance(reply, ReplyTo) and local_post_path(str(reply.url))
+        else reply
+        for reply in in_reply_to
+    ]
+
+
+def _cached_entry(filename: str, md: bool = True) -> Union[BlogPost, DraftPost]:
+    """The shared, cached parse of ``filename``; callers must not modify it."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return _parse_json_entry(filename, md)
+
+    path = os.path.abspath(filename)
+    key = (path, stat.st_mtime_ns, stat.st_size, md)
+    post = entry_cache.get(key)
+    if post is None:
+        post = _parse_json_entry(filename, md)
+        entry_cache.put(key, post, tag=path)
+    return post
+
+
+def local_post_path(url: str) -> Union[str, None]:
+    """The json file behind a url on this site, or None for other sites."""
+    for prefix in LOCAL_POST_PREFIXES:
+        if url.startswith(prefix):
+            return os.path.join(BLOG_STORAGE, url[len(prefix) :].strip("/")) + ".json"
+    return None
+
+
+def reply_context(
+    url: str, depth: int = REPLY_DEPTH, _seen: frozenset = frozenset()
+) -> ReplyTo:
+    """
+    Resolves what a post is replying to.
+
+    Local targets are projected into a ``ReplyTo`` carrying their title,
+    content and first photo, and their own replies are followed until ``depth``
+    runs out or a post repeats. Each target's projection is cached against its
+    mtime, so a thread costs one parse per post no matter how often it's shown.
+    """
+    filename = local_post_path(url)
+    if filename is None:
+        return ReplyTo(url=url)
+
+    path = os.path.abspath(filename)
+    if depth <= 0 or path in _seen:
+        return ReplyTo(url=url)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return ReplyTo(url=url)
+
+    key = ("reply", path, stat.st_mtime_ns, stat.st_size)
+    context = entry_cache.get(key)
+    if context is None:
+        try:
+            post = _cached_entry(filename)
+        except (ValueError, OSError):
+            return ReplyTo(url=url)
+        context = ReplyTo(
+            url=url,
+            title=post.title,
+            summary=post.summary,
+            content=post.content,
+            photo=post.photo[0] if post.photo else None,
+            published=getattr(post, "published", None),
+            author=FULLNAME,
+            in_reply_to=[
+                reply if isinstance(reply, ReplyTo) else ReplyTo(**reply)
+                for reply in post.in_reply_to or []
+            ],
+        )
+        entry_cache.put(key, context, tag=path)
+
+    # the cached projection only knows its parents' urls; walk them from here
+    parents = [
+        reply_context(str(parent.url), depth - 1, _seen | {path})
+        for parent in context.in_reply_to
+    ]
+    return context.model_copy(update={"in_reply_to": parents or None})
+
+
+def _parse_json_entry(filename: str, md: bool = True) -> Union[BlogPost, DraftPost]:
     with open(filename, "rb") as f:
         data = json.load(f)
 
@@ -178,38 +529,19 @@ def file_parser_json(filename: str, md: bool = True) -> Union[BlogPost, DraftPos
         # Parse markdown content
         if md and data.get("content"):
             data["raw_content"] = data["content"]
-            data["content"] = markdown.markdown(
-                data["content"],
-                extensions=[
-                    "mdx_math",
-                    AlbumExtension(),
-                    HashtagExtension(),
-                    "fenced_code",
-                ],
-            )
+            data["content"] = render_markdown(data["content"])
         elif data.get("content") is None:
             data["content"] = ""
             data["raw_content"] = ""
 
-        # Handle in_reply_to
+        # Handle in_reply_to; local targets are resolved by file_parser_json
         if data.get("in_reply_to"):
             in_reply_to = []
             for i in data["in_reply_to"]:
                 if isinstance(i, dict):
                     in_reply_to.append(i)
-                elif isinstance(i, str):
-                    if i.startswith("http://127.0.0.1:5000") or i.startswith(
-                        "https://kongaloosh.com/"
-                    ):
-                        reply_filename = (
-                            i.replace(
-                                "http://127.0.0.1:5000/e/", BLOG_STORAGE, 1
-                            ).replace("https://kongaloosh.com/e/", BLOG_STORAGE, 1)
-                            + ".json"
-                        )
-                        in_reply_to.append(file_parser_json(reply_filename))
-                    elif i.startswith("http"):
-                        in_reply_to.append({"url": i})
+                elif isinstance(i, str) and i.startswith("http"):
+                    in_reply_to.append({"url": i})
             data["in_reply_to"] = in_reply_to
 
         # Choose model based on file location
@@ -355,6 +687,7 @@ def create_json_entry(
         data.content = run(
             data.content,
             target_dir=f"{data.published.year}/{data.published.month}/{data.published.day}/",
+            db=g,
         )
 
     if not os.path.exists(directory_of_post):  # if the path doesn't exist, make it
@@ -367,38 +700,33 @@ def create_json_entry(
         # Find all the multimedia files which were added with the posts.
         # we name the files based on the slug of the post and colocate them.
         if data.photo:
-            extension = ".jpg"
             file_list = []
+            variants = dict(data.photo_variants or {})
             for file_i in data.photo:
-                # if the image is already in the blog storage directory
-                # we don't need to move it. It's already where we want it.
-                if isinstance(file_i, str) and file_i.startswith(BLOG_STORAGE):
+                # photos already published, in the media store or from before
+                # it, stay where they are
+                if isinstance(file_i, str) and (
+                    file_i.startswith(BLOG_STORAGE)
+                    or media_store.stored_hash(file_i)
+                ):
                     file_list.append(file_i)
                 # if the image is in the bulk upload directory
-                # we need to move it to the blog storage directory.
+                # it goes into the media store.
                 elif isinstance(file_i, str) and file_i.startswith(BULK_UPLOAD_DIR):
-                    i = 0
-                    while os.path.isfile(relative_post_path + "-" + str(i) + extension):
-                        i += 1
-
-                    from_location = file_i
-                    new_name = data.slug + "-" + str(i) + extension
-                    high_res_location = os.path.join(
-                        PERMANENT_PHOTOS_DIR, date_location, new_name
-                    )
-                    web_size_location = os.path.join(
-                        BLOG_STORAGE, date_location, new_name
-                    )
-                    move_and_resize(
-                        from_location,
-                        web_size_location,
-                        high_res_location,
+                    web_size_location, processed = store_photo(
+                        g, file_i, post=relative_post_path + ".json"
                     )
+                    if processed is not None:
+                        variants[web_size_location] = processed
                     file_list.append(web_size_location)
 
             data.photo = file_list
+            data.photo_variants = {
+                photo: variants[photo] for photo in file_list if photo in variants
+            } or None
         if data.video:
             video_list = []
+            streams = dict(data.video_streams or {})
             for video_i in data.video:
                 if isinstance(video_i, str):
                     if video_i.startswith(BLOG_STORAGE):
@@ -409,8 +737,14 @@ def create_json_entry(
                             BLOG_STORAGE, date_location, new_name
                         )
 
-                        # Start conversion but don't wait for it
-                        convert_video_to_mp4(video_i, final_location)
+                        # queued, with its streams to follow, whatever
+                        # BackgroundMedia says: encodes can take hours
+                        convert_video_to_mp4(
+                            g,
+                            video_i,
+                            final_location,
+                            post=relative_post_path + ".json",
+                        )
 
                         # Add the expected path to the list
                         video_list.append(
@@ -418,6 +752,9 @@ def create_json_entry(
                         )
 
             data.video = video_list
+            data.video_streams = {
+                video: streams[video] for video in video_list if video in streams
+            } or None
         try:
             if data.travel and data.travel.map_data:
                 map_file_path = save_map_file(data.travel.map_data, relative_post_path)
@@ -427,10 +764,16 @@ def create_json_entry(
         except (KeyError, AttributeError) as e:
             logger.error(f"Error saving map file: {e}")
 
+        if g:
+            media_store.set_refs(g, relative_post_path + ".json", stored_photos(data))
+
         json_data = data.model_dump(mode="json")
 
         with open(relative_post_path + ".json", "w") as file_writer:
             json.dump(json_data, file_writer)
+        invalidate_entry(relative_post_path + ".json")
+        if g:
+            g.commit()  # queued media jobs become visible once the post exists
 
         if not draft and not update and g:  # if this isn't a draft, put it in the dbms
             assert isinstance(data, BlogPost)
@@ -446,12 +789,265 @@ def create_json_entry(
                         [data.slug, data.published, c],
                     )
                     g.commit()
+
+        if not draft and g:
+            index_geo_points(g, data)
+            store_entry_summary(g, relative_post_path)
+            g.commit()
         return data.url
 
     else:
         return "/already_made"  # a post of this name already exists
 
 
+def index_geo_points(db, data: BlogPost) -> None:
+    """Replaces the geo_points rows for a post with its current geo and trips."""
+    db.execute(GeoQueries.DELETE, (data.slug, data.published))
+    if data.geo and data.geo.coordinates:
+        lat, lon = data.geo.coordinates
+        db.execute(
+            GeoQueries.INSERT, (data.slug, data.published, lat, lon, "post", None)
+        )
+    if data.travel:
+        for trip in data.travel.trips:
+            if trip.location.coordinates:
+                lat, lon = trip.location.coordinates
+                db.execute(
+                    GeoQueries.INSERT,
+                    (data.slug, data.published, lat, lon, "trip", trip.date),
+                )
+
+
+def store_entry_summary(db, location: str) -> None:
+    """Renders the post at ``location`` and stores its EntrySummary in entries.
+
+    Only the post's own fields are stored; replies to local posts keep just
+    their url and are resolved when the summary is read, so editing a post
+    doesn't leave stale copies of it in the summaries of its replies.
+    """
+    post = _cached_entry(location + ".json")
+    if isinstance(post, BlogPost):
+        summary = EntrySummary.from_post(post)
+        db.execute(EntryQueries.UPDATE_SUMMARY, (summary.model_dump_json(), location))
+
+
+def add_summary_column(db) -> None:
+    """Adds entries.summary_json to a database from before summaries were stored."""
+    columns = [row[1] for row in db.execute("PRAGMA table_info(entries)")]
+    if "summary_json" not in columns:
+        db.execute(EntryQueries.ADD_SUMMARY_COLUMN)
+
+
+def backfill_entry_summaries(db) -> int:
+    """Adds the summary_json column if needed and fills it for every post.
+
+    Returns:
+        int: the number of posts summarised.
+    """
+    add_summary_column(db)
+    count = 0
+    for (location,) in db.execute(EntryQueries.SELECT_ALL).fetchall():
+        if not os.path.exists(location + ".json"):
+            continue
+        try:
+            store_entry_summary(db, location)
+        except (ValidationError, json.JSONDecodeError) as e:
+            logger.error(f"Skipping {location}: {e}")
+            continue
+        count += 1
+    db.commit()
+    return count
+
+
+def backfill_photo_variants(db) -> int:
+    """Writes responsive variants for every published photo that lacks them.
+
+    Variants are made from the archive copy in PermStorage when it exists and
+    from the web copy otherwise. Photos that already have variants are left
+    alone, so an interrupted run can simply be started again.
+
+    Returns:
+        int: the number of posts updated.
+    """
+    count = 0
+    for (location,) in db.execute(EntryQueries.SELECT_ALL).fetchall():
+        if not os.path.exists(location + ".json"):
+            continue
+        with open(location + ".json") as f:
+            data = json.load(f)
+        variants = data.get("photo_variants") or {}
+        missing = [
+            photo
+            for photo in data.get("photo") or []
+            if photo not in variants and os.path.exists(photo)
+        ]
+        if not missing:
+            continue
+        for photo in missing:
+            archive = os.path.join(
+                PERMANENT_PHOTOS_DIR, os.path.relpath(photo, BLOG_STORAGE)
+            )
+            source = archive if os.path.exists(archive) else photo
+            try:
+                written = write_derivatives(source, variant_derivatives(photo))
+                with Image.open(photo) as web_copy:
+                    written[photo] = web_copy.size
+            except OSError as e:
+                logger.error(f"Skipping {photo}: {e}")
+                continue
+            variants[photo] = [v.model_dump() for v in photo_variants(written)]
+        data["photo_variants"] = variants
+        with open(location + ".json", "w") as f:
+            json.dump(data, f)
+        invalidate_entry(location + ".json")
+        store_entry_summary(db, location)
+        count += 1
+    db.commit()
+    return count
+
+
+def migrate_media(db) -> int:
+    """Moves every photo of every post and draft into the media store.
+
+    A photo is keyed by the hash of its archive copy in PermStorage, the
+    nearest thing to the upload that's left, or of its web copy when it has
+    no archive copy. Files that duplicate a stored photo are deleted rather
+    than moved. Posts are pointed at the store, in their photos,
+    photo_variants and albums, and each old path is kept as an alias so links
+    to it redirect. Posts with nothing left to move are skipped, so an
+    interrupted run can simply be started again.
+
+    Returns:
+        int: the number of posts updated.
+    """
+    locations = [location for (location,) in db.execute(EntryQueries.SELECT_ALL)]
+    if os.path.isdir(DRAFTS_STORAGE):
+        locations += [
+            os.path.join(DRAFTS_STORAGE, name[: -len(".json")])
+            for name in sorted(os.listdir(DRAFTS_STORAGE))
+            if name.endswith(".json")
+        ]
+    legacy_photo = re.compile(
+        re.escape(os.path.join(BLOG_STORAGE, "")) + r"[^\s()\"']+\.(?:jpe?g|png|gif)",
+        re.IGNORECASE,
+    )
+    count = 0
+    for location in locations:
+        if not os.path.exists(location + ".json"):
+            continue
+        with open(location + ".json") as f:
+            data = json.load(f)
+        photos = data.get("photo") or []
+        content = data.get("content") or ""
+        variants = data.get("photo_variants") or {}
+
+        moved = {}
+        for photo in sorted(
+            {p for p in photos if p.startswith(BLOG_STORAGE)}
+            | set(legacy_photo.findall(content))
+        ):
+            try:
+                digest = _move_into_store(db, photo, variants.get(photo) or [])
+            except OSError as e:
+                logger.error(f"Skipping {photo}: {e}")
+                continue
+            if digest:
+                moved[photo] = media_store.web_path(digest)
+        if not moved:
+            continue
+
+        data["photo"] = [moved.get(photo, photo) for photo in photos]
+        for old, new in moved.items():
+            content = content.replace(old, new)
+            if old in variants:
+                del variants[old]
+                recorded = media_store.variants(db, media_store.stored_hash(new))
+                if recorded:
+                    variants[new] = recorded
+        data["content"] = content
+        data["photo_variants"] = variants or None
+        with open(location + ".json", "w") as f:
+            json.dump(data, f)
+        invalidate_entry(location + ".json")
+
+        digests = media_store.hashes_in(content) | {
+            media_store.stored_hash(photo)
+            for photo in data["photo"]
+            if media_store.stored_hash(photo)
+        }
+        media_store.set_refs(db, location + ".json", digests)
+        if not location.startswith(DRAFTS_STORAGE):
+            store_entry_summary(db, location)
+        db.commit()
+        count += 1
+    return count
+
+
+def _move_into_store(db, photo: str, variants: List[dict]) -> Optional[str]:
+    """Moves one published photo, its archive copy and variants into the store.
+
+    Returns:
+        the photo's hash, or None if it's gone and was never moved.
+    """
+    if not os.path.exists(photo):
+        return media_store.alias(db, photo)
+
+    archive = os.path.join(PERMANENT_PHOTOS_DIR, os.path.relpath(photo, BLOG_STORAGE))
+    has_archive = os.path.exists(archive)
+    digest = media_store.content_hash(archive if has_archive else photo)
+    web = media_store.web_path(digest)
+    moves = [(photo, web)]
+    if has_archive:
+        moves.append((archive, media_store.archive_path(digest)))
+    stem, new_stem = os.path.splitext(photo)[0], os.path.splitext(web)[0]
+    moved_variants = []
+    for variant in variants:
+        new_path = new_stem + variant["path"][len(stem) :]
+        if variant["path"] != photo:
+            moves.append((variant["path"], new_path))
+        moved_variants.append({**variant, "path": new_path})
+
+    duplicate = os.path.exists(web)
+    if not duplicate and moved_variants:
+        media_store.record_variants(db, digest, moved_variants)
+    # committed before anything moves, so a rerun can find the photo again
+    media_store.add_alias(db, photo, digest)
+    db.commit()
+
+    for old, new in moves:
+        if not os.path.exists(old):
+            continue
+        if duplicate:
+            os.remove(old)
+        else:
+            os.makedirs(os.path.dirname(new), exist_ok=True)
+            shutil.move(old, new)
+    return digest
+
+
+def backfill_geo_points(db) -> int:
+    """Rebuilds geo_points from every post in the entries table.
+
+    Returns:
+        int: the number of posts indexed.
+    """
+    db.executescript(GeoQueries.CREATE_TABLE)
+    db.execute("DELETE FROM geo_points")
+    count = 0
+    for (location,) in db.execute(EntryQueries.SELECT_ALL).fetchall():
+        if not os.path.exists(location + ".json"):
+            continue
+        try:
+            entry = file_parser_json(location + ".json", md=False)
+        except (ValidationError, json.JSONDecodeError) as e:
+            logger.error(f"Skipping {location}: {e}")
+            continue
+        index_geo_points(db, entry)
+        count += 1
+    db.commit()
+    return count
+
+
 def update_json_entry(
     data: Union[BlogPost, DraftPost],
     old_entry: Union[BlogPost, DraftPost],
@@ -477,10 +1073,23 @@ def update_json_entry(
         old_photos = old_entry.photo or []
         to_delete = [i for i in old_photos if i not in new_photos]
 
+        old_variants = old_entry.photo_variants or {}
         for i in to_delete:
+            if media_store.stored_hash(i):
+                continue  # other posts may share it; the rewrite drops our ref
+            for variant in old_variants.get(i, []):
+                if os.path.exists(variant.path):
+                    os.remove(variant.path)
             if os.path.exists(i):
                 os.remove(i)
 
+        # keep the variants of photos that survive the edit
+        data.photo_variants = {
+            photo: variants
+            for photo, variants in {**old_variants, **(data.photo_variants or {})}.items()
+            if photo in new_photos
+        } or None
+
         # 4. Handle videos
         new_videos = data.video or []
         old_videos = old_entry.video or []
@@ -493,6 +1102,16 @@ def update_json_entry(
         for i in to_delete:
             if os.path.exists(i):
                 os.remove(i)
+            remove_streams(i)
+
+        data.video_streams = {
+            video: streams
+            for video, streams in {
+                **(old_entry.video_streams or {}),
+                **(data.video_streams or {}),
+            }.items()
+            if video in new_videos
+        } or None
 
         # 4. Handle categories
         if data.category and not draft and g:
@@ -518,10 +1137,11 @@ def update_json_entry(
         raise ValueError(f"Failed to update entry: {str(e)}")
 
 
-def run(lines: str, target_dir: str):
+def run(lines: str, target_dir: str, db=None):
     """
-    Finds all references to images, removes them from their temporary directory, moves
-    them to their new location, and replaces references to them in the original post.
+    Finds all references to images, moves uploaded ones from their temporary directory
+    into the media store, and replaces references to them in the original post.
+    Given a database, the images are processed by the media worker instead.
     """
     text = lines
     last_index = -1
@@ -546,19 +1166,9 @@ def run(lines: str, target_dir: str):
                         image_ref = re.search(image_ref_regexp, images[index]).group()
                         alt = re.search(alt_text_regexp, images[index]).group()
 
+                        web_size_location = image_ref  # already published
                         if image_ref.startswith(ORIGINAL_PHOTOS_DIR):
-                            filename = os.path.basename(image_ref)
-                            high_res_location = os.path.join(
-                                PERMANENT_PHOTOS_DIR, target_dir, filename
-                            )
-                            web_size_location = os.path.join(
-                                BLOG_STORAGE, target_dir, filename
-                            )
-                            move_and_resize(
-                                image_ref,
-                                web_size_location,
-                                high_res_location,
-                            )
+                            web_size_location, _ = store_photo(db, image_ref)
 
                         album += "[%s](%s)" % (alt, web_size_location)
                         if index != len(images) - 1:
@@ -579,39 +1189,6 @@ def run(lines: str, target_dir: str):
     return text
 
 
-def rotate_image_by_exif(image: Image.Image) -> Image.Image:
-    """Rotate image according to EXIF orientation tag"""
-    try:
-        # Get EXIF data
-        exif = image.getexif()
-        if not exif:
-            return image
-
-        # Find orientation tag
-        orientation = next(
-            (tag for tag, name in Image.ExifTags.TAGS.items() if name == "Orientation"),
-            None,
-        )
-
-        if not orientation or orientation not in exif:
-            return image
-
-        # Rotation mapping based on EXIF orientation value
-        rotation_map = {
-            3: 180,  # Upside down
-            6: 270,  # 90 degrees right
-            8: 90,  # 90 degrees left
-        }
-
-        if rotation := rotation_map.get(exif[orientation]):
-            return image.rotate(rotation, expand=True)
-
-    except Exception as e:
-        app.logger.error(f"Error processing EXIF orientation: {e}")
-
-    return image
-
-
 def handle_media_file(
     file_path: str, target_dir: str, slug: str, file_type: str
 ) -> str:
@@ -0,0 +1,122 @@
+"""Checks a batch of freshly stored uploads on a thread pool.
+
+Uploads are streamed to disk as the request is read; the slow part is
+decoding each photo to check that it really is one and to make its upload
+tray thumbnail. Pillow releases the GIL while it decodes, resizes and
+encodes, so a few threads get through a phone's worth of photos several
+times faster than the request thread on its own.
+"""
+
+import configparser
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+from PIL import Image
+from pysrc.file_management import photo_index
+from pysrc.file_management.file_parser import upload_thumbnail
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = config.getint(
+    "Global", "IngestWorkers", fallback=min(4, os.cpu_count() or 1)
+)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".qt", ".m4v", ".avi", ".wmv", ".flv", ".mkv")
+
+
+@dataclass
+class IngestResult:
+    """What became of one uploaded file.
+
+    Attributes:
+        filename: the name the client sent.
+        path: where it was stored; rejected files are removed.
+        kind: photo or video.
+        ok: whether it was kept.
+        width: upright width of a photo, in pixels.
+        height: upright height of a photo, in pixels.
+        thumbnail: the upload tray thumbnail of a photo.
+        error: why the file was rejected.
+        metadata: what was read from a photo's header, for the photo index.
+    """
+
+    filename: str
+    path: str
+    kind: str
+    ok: bool
+    width: Optional[int] = None
+    height: Optional[int] = None
+    thumbnail: Optional[str] = None
+    error: Optional[str] = None
+    metadata: Optional[photo_index.PhotoMetadata] = None
+
+
+def is_video(filename: str) -> bool:
+    return filename.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def check_upload(filename: str, path: str) -> IngestResult:
+    """Validates one stored upload, removing it if it isn't usable."""
+    if is_video(filename):
+        ok = os.path.getsize(path) > 0
+        result = IngestResult(
+            filename, path, "video", ok, error=None if ok else "empty file"
+        )
+    else:
+        try:
+            # uploads keep their camera orientation; this reports them upright
+            metadata = photo_index.read_metadata(path)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            result = IngestResult(filename, path, "photo", False, error=str(e))
+        else:
+            # making the thumbnail decodes the photo, so it also catches
+            # files that are truncated or corrupt past the header
+            thumbnail = upload_thumbnail(path)
+            result = IngestResult(
+                filename,
+                path,
+                "photo",
+                thumbnail is not None,
+                metadata.width,
+                metadata.height,
+                thumbnail,
+                None if thumbnail else "couldn't decode the image",
+                metadata,
+            )
+    if not result.ok:
+        logger.warning(f"Rejected upload {filename}: {result.error}")
+        os.remove(path)
+    return result
+
+
+def ingest(
+    stored: Iterable[Tuple[str, str]], workers: Optional[int] = None, db=None
+) -> List[IngestResult]:
+    """Checks every (filename, path) of a batch, in the order given.
+
+    Args:
+        stored: the uploads, already written to disk.
+        workers: size of the thread pool, defaulting to IngestWorkers in
+            config.ini; 0 checks them in this thread.
+        db: where to record the photos kept in the photo index.
+    """
+    stored = list(stored)
+    workers = INGEST_WORKERS if workers is None else workers
+    if workers == 0 or len(stored) < 2:
+        results = [check_upload(filename, path) for filename, path in stored]
+    else:
+        with ThreadPoolExecutor(min(workers, len(stored))) as pool:
+            results = list(pool.map(lambda upload: check_upload(*upload), stored))
+    if db is not None:
+        for result in results:
+            if result.ok and result.metadata:
+                photo_index.save(db, result.metadata)
+        db.commit()
+    return results
@@ -0,0 +1,134 @@
+"""Photos stored once, under the sha256 of the uploaded file.
+
+    media/3f/3fa9…c1/photo.jpg             the web copy posts link to
+    media/3f/3fa9…c1/photo-400w.webp       its responsive variants
+    media/3f/3fa9…c1/original.jpg          the full-resolution archive copy
+
+Posts that use a photo hold a reference to its hash in ``media_refs``; the
+``media.refs`` count is kept in step by triggers, and a photo's directory is
+removed when its last reference goes. Uploading or publishing a photo that is
+already in the store only adds a reference.
+"""
+
+import configparser
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+from datetime import datetime
+from typing import Iterable, List, Optional, Set
+from pysrc.database.queries import MediaQueries
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+logger = logging.getLogger(__name__)
+
+MEDIA_STORE = config.get("PhotoLocations", "MediaStore", fallback="media")
+
+WEB_NAME = "photo.jpg"
+ARCHIVE_NAME = "original.jpg"
+
+_HASH_RE = re.compile(r"[0-9a-f]{2}/([0-9a-f]{64})/")
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def media_dir(digest: str) -> str:
+    return os.path.join(MEDIA_STORE, digest[:2], digest)
+
+
+def web_path(digest: str) -> str:
+    return os.path.join(media_dir(digest), WEB_NAME)
+
+
+def archive_path(digest: str) -> str:
+    return os.path.join(media_dir(digest), ARCHIVE_NAME)
+
+
+def stored_hash(path: str) -> Optional[str]:
+    """The hash of a path inside the store, or None for any other path."""
+    prefix = os.path.join(MEDIA_STORE, "")
+    if not path.startswith(prefix):
+        return None
+    match = _HASH_RE.match(path[len(prefix) :])
+    return match.group(1) if match else None
+
+
+def hashes_in(text: str) -> Set[str]:
+    """The hashes of every store path mentioned in ``text``, e.g. a post's albums."""
+    pattern = re.escape(os.path.join(MEDIA_STORE, "")) + _HASH_RE.pattern
+    return set(re.findall(pattern, text or ""))
+
+
+def variants(db, digest: str) -> Optional[List[dict]]:
+    """The recorded responsive variants of a stored photo, if it's been processed."""
+    row = db.execute(MediaQueries.SELECT_VARIANTS, (digest,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def record_variants(db, digest: str, photo_variants: List[dict]) -> None:
+    db.execute(
+        MediaQueries.UPSERT_VARIANTS,
+        (digest, json.dumps(photo_variants), datetime.now().isoformat()),
+    )
+
+
+def posts(db, digest: str) -> List[str]:
+    """The json files of every post using a stored photo."""
+    return [row[0] for row in db.execute(MediaQueries.SELECT_POSTS, (digest,))]
+
+
+def set_refs(db, post: str, digests: Iterable[str]) -> List[str]:
+    """Makes ``digests`` the stored photos ``post`` uses; the caller commits.
+
+    Photos the post no longer uses lose its reference, and those nobody uses
+    any more are deleted.
+
+    Returns:
+        the hashes that were deleted.
+    """
+    wanted = set(digests)
+    held = {row[0] for row in db.execute(MediaQueries.SELECT_BY_POST, (post,))}
+    now = datetime.now().isoformat()
+    for digest in wanted - held:
+        db.execute(MediaQueries.INSERT, (digest, now))
+        db.execute(MediaQueries.INSERT_REF, (digest, post))
+    for digest in held - wanted:
+        db.execute(MediaQueries.DELETE_REF, (digest, post))
+    return collect_garbage(db, held - wanted)
+
+
+def collect_garbage(db, digests: Iterable[str]) -> List[str]:
+    """Deletes whichever of ``digests`` no post references."""
+    removed = []
+    for digest in digests:
+        row = db.execute(MediaQueries.SELECT_REFS, (digest,)).fetchone()
+        if row is None or row[0] > 0:
+            continue
+        shutil.rmtree(media_dir(digest), ignore_errors=True)
+        db.execute(MediaQueries.DELETE, (digest,))
+        removed.append(digest)
+        logger.info(f"Removed unreferenced photo {digest}")
+    return removed
+
+
+def add_alias(db, path: str, digest: str) -> None:
+    """Remembers that a photo which used to live at ``path`` is now ``digest``."""
+    db.execute(MediaQueries.INSERT_ALIAS, (path, digest))
+
+
+def alias(db, path: str) -> Optional[str]:
+    """The hash of the stored photo that replaced ``path``, if any."""
+    row = db.execute(MediaQueries.SELECT_ALIAS, (path,)).fetchone()
+    return row[0] if row else None
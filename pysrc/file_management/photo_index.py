@@ -0,0 +1,309 @@
+"""What is known about each photo on disk, read once from its header.
+
+The ``photos`` table holds every photo's upright size, EXIF orientation,
+capture time, GPS position and byte size, so the upload tray can sort by when
+photos were taken, the editor can suggest a post's location from its photos
+and ``<img>`` tags can carry their dimensions, without opening any images
+while a page is served.
+
+Rows are written when photos are uploaded and published, and
+``flask backfill-photos`` fills in the rest. A row is trusted for as long as
+its file's size and mtime match. Published copies are re-encoded without
+EXIF, so they take their capture time and position from the upload they were
+made from.
+"""
+
+import configparser
+import logging
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import astuple, dataclass, replace
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from flask import g, has_app_context, has_request_context
+from PIL import ExifTags, Image
+from pysrc.database.queries import PhotoQueries
+from pysrc.file_management import media_store
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+logger = logging.getLogger(__name__)
+
+BLOG_STORAGE = config.get("PhotoLocations", "BlogStorage")
+PERMANENT_PHOTOS_DIR = config.get("PhotoLocations", "PermStorage")
+BULK_UPLOAD_DIR = config.get("PhotoLocations", "BulkUploadLocation")
+INDEX_WORKERS = config.getint(
+    "Global", "IndexWorkers", fallback=min(4, os.cpu_count() or 1)
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+# responsive variants, e.g. post-0-400w.webp, share their photo's metadata
+_VARIANT_RE = re.compile(r"-\d+w\.[a-z]+$")
+
+
+@dataclass
+class PhotoMetadata:
+    """One row of the photo index.
+
+    Attributes:
+        path: the photo, relative to the blog's directory.
+        width: upright width in pixels.
+        height: upright height in pixels.
+        orientation: the EXIF orientation, 1 when there is none.
+        taken: when the photo was taken, as an ISO 8601 local time.
+        lat: latitude from the photo's GPS tags.
+        lon: longitude from the photo's GPS tags.
+        bytes: size of the file.
+        mtime: the file's mtime in nanoseconds, for spotting changes.
+    """
+
+    path: str
+    width: int
+    height: int
+    orientation: int = 1
+    taken: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    bytes: int = 0
+    mtime: int = 0
+
+
+def read_metadata(path: str) -> PhotoMetadata:
+    """Reads a photo's metadata from its header, without decoding it.
+
+    Raises:
+        OSError, ValueError: if ``path`` isn't an image Pillow can open.
+    """
+    stat = os.stat(path)
+    with Image.open(path) as img:
+        width, height = img.size
+        exif = img.getexif()
+    orientation = exif.get(ExifTags.Base.Orientation) or 1
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return PhotoMetadata(
+        path=path,
+        width=width,
+        height=height,
+        orientation=orientation,
+        taken=_taken(exif),
+        lat=_coordinate(exif, ExifTags.GPS.GPSLatitude, ExifTags.GPS.GPSLatitudeRef),
+        lon=_coordinate(
+            exif, ExifTags.GPS.GPSLongitude, ExifTags.GPS.GPSLongitudeRef
+        ),
+        bytes=stat.st_size,
+        mtime=stat.st_mtime_ns,
+    )
+
+
+def _taken(exif: Image.Exif) -> Optional[str]:
+    value = exif.get_ifd(ExifTags.IFD.Exif).get(
+        ExifTags.Base.DateTimeOriginal
+    ) or exif.get(ExifTags.Base.DateTime)
+    try:
+        taken = datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    return taken.isoformat()
+
+
+def _coordinate(exif: Image.Exif, tag: int, ref_tag: int) -> Optional[float]:
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    try:
+        degrees, minutes, seconds = (float(part) for part in gps[tag])
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    value = round(degrees + minutes / 60 + seconds / 3600, 6)  # to about 10cm
+    return -value if gps.get(ref_tag) in ("S", "W") else value
+
+
+def save(db, metadata: PhotoMetadata) -> None:
+    """Writes a row of the index; the caller commits."""
+    db.execute(PhotoQueries.UPSERT, astuple(metadata))
+
+
+def lookup(db, path: str) -> Optional[PhotoMetadata]:
+    row = db.execute(PhotoQueries.SELECT, (path,)).fetchone()
+    return PhotoMetadata(*row) if row else None
+
+
+def under(db, directory: str) -> Dict[str, PhotoMetadata]:
+    """Every indexed photo in ``directory`` and below, by path."""
+    prefix = os.path.join(directory, "")
+    return {
+        row[0]: PhotoMetadata(*row)
+        for row in db.execute(PhotoQueries.SELECT_UNDER, (len(prefix), prefix))
+    }
+
+
+def indexed(db, path: str) -> Optional[PhotoMetadata]:
+    """A photo's row of the index, read and recorded if missing or stale."""
+    row = lookup(db, path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return row
+    if row and (row.bytes, row.mtime) == (stat.st_size, stat.st_mtime_ns):
+        return row
+    return index_photo(db, path)
+
+
+def index_photo(
+    db, path: str, exif_from: Optional[PhotoMetadata] = None
+) -> Optional[PhotoMetadata]:
+    """Reads and records one photo; the caller commits.
+
+    Args:
+        exif_from: the photo ``path`` was made from, whose capture time and
+            position it keeps when it has none of its own.
+
+    Returns:
+        the recorded metadata, or None if ``path`` couldn't be read.
+    """
+    try:
+        metadata = read_metadata(path)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.error(f"Couldn't index {path}: {e}")
+        return None
+    if exif_from is not None and metadata.taken is None:
+        metadata = replace(
+            metadata, taken=exif_from.taken, lat=exif_from.lat, lon=exif_from.lon
+        )
+    save(db, metadata)
+    return metadata
+
+
+def index_photos(
+    db,
+    paths: Iterable[str],
+    workers: Optional[int] = None,
+    sources: Optional[dict] = None,
+) -> int:
+    """Records every photo in ``paths`` whose row is missing or stale.
+
+    Headers are read on a thread pool and written from this thread; the
+    caller commits.
+
+    Args:
+        workers: size of the thread pool, defaulting to IndexWorkers in
+            config.ini; 0 reads them in this thread.
+        sources: for each path that was made from another photo, that
+            photo's path, to take its capture time and position from.
+
+    Returns:
+        the number of photos recorded.
+    """
+    sources = sources or {}
+    stale = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        known = db.execute(PhotoQueries.SELECT_STAMP, (path,)).fetchone()
+        if known != (stat.st_size, stat.st_mtime_ns):
+            stale.append(path)
+
+    def read(path: str) -> Optional[PhotoMetadata]:
+        try:
+            metadata = read_metadata(path)
+            source = sources.get(path)
+            if source and metadata.taken is None and os.path.exists(source):
+                original = read_metadata(source)
+                metadata = replace(
+                    metadata, taken=original.taken, lat=original.lat, lon=original.lon
+                )
+            return metadata
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.error(f"Couldn't index {path}: {e}")
+            return None
+
+    workers = INDEX_WORKERS if workers is None else workers
+    if workers == 0 or len(stale) < 2:
+        read_all = [read(path) for path in stale]
+    else:
+        with ThreadPoolExecutor(min(workers, len(stale))) as pool:
+            read_all = list(pool.map(read, stale))
+    for metadata in read_all:
+        if metadata is not None:
+            save(db, metadata)
+    return sum(metadata is not None for metadata in read_all)
+
+
+def photo_files(directory: str) -> List[str]:
+    """Every photo under ``directory``, leaving out responsive variants."""
+    found = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            lower = name.lower()
+            if (
+                lower.endswith(IMAGE_EXTENSIONS)
+                and not name.startswith(".")
+                and not _VARIANT_RE.search(lower)
+            ):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def backfill_photo_index(db, workers: Optional[int] = None) -> int:
+    """Indexes every photo in the blog, the archive, the upload tray and the store.
+
+    Published copies borrow their capture time and position from their
+    archive copy, and rows for files that no longer exist are dropped.
+    Photos already indexed and unchanged are skipped, so an interrupted run
+    can simply be started again.
+
+    Returns:
+        int: the number of photos indexed.
+    """
+    db.executescript(PhotoQueries.CREATE_TABLE)
+    paths = []
+    for directory in (
+        BLOG_STORAGE,
+        PERMANENT_PHOTOS_DIR,
+        BULK_UPLOAD_DIR,
+        media_store.MEDIA_STORE,
+    ):
+        paths += photo_files(directory)
+
+    sources = {}
+    blog = os.path.join(BLOG_STORAGE, "")
+    for path in paths:
+        digest = media_store.stored_hash(path)
+        if digest and path == media_store.web_path(digest):
+            sources[path] = media_store.archive_path(digest)
+        elif path.startswith(blog):
+            sources[path] = os.path.join(PERMANENT_PHOTOS_DIR, path[len(blog) :])
+
+    count = index_photos(db, paths, workers, sources)
+    existing = set(paths)
+    for (path,) in db.execute(PhotoQueries.SELECT_PATHS).fetchall():
+        if path not in existing:
+            db.execute(PhotoQueries.DELETE, (path,))
+    db.commit()
+    return count
+
+
+def dimensions(path: str) -> Optional[Tuple[int, int]]:
+    """The indexed upright (width, height) of a photo, for ``<img>`` tags.
+
+    Looked up on the request's connection; outside a request, or for a photo
+    that isn't indexed, returns None.
+    """
+    if has_request_context():
+        db = g.db  # taken from the pool if the request hasn't yet
+    else:
+        db = g.get("db") if has_app_context() else None
+    if db is None:
+        return None
+    try:
+        row = db.execute(PhotoQueries.SELECT_SIZE, (path.lstrip("/"),)).fetchone()
+    except sqlite3.Error:
+        return None  # a database from before the index; see flask upgrade-db
+    return (row[0], row[1]) if row else None
@@ -0,0 +1,197 @@
+"""Photos resized on request, kept in a size-bounded disk cache.
+
+    /img/400/data/2024/3/1/post-0.jpg
+    /img/400/media/3f/3fa9…c1/photo.jpg
+    /img/400/images/photos/2024/3/1/post-0.jpg
+
+A photo is resized from its archive copy when it has one, so any size up to
+the original can be asked for, but only sizes in ``PhotoLocations/ResizeSizes``
+are made. Results live in ``PhotoLocations/ResizeCache`` until the cache grows
+past ``PhotoLocations/ResizeCacheMB``, when the least recently used are
+deleted.
+"""
+
+import configparser
+import hashlib
+import logging
+import os
+import threading
+from typing import Callable, Dict, Optional
+from werkzeug.security import safe_join
+from pysrc.file_management import media_store
+from pysrc.file_management.derivatives import write_thumbnail
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+logger = logging.getLogger(__name__)
+
+BLOG_STORAGE = config.get("PhotoLocations", "BlogStorage")
+PERMANENT_PHOTOS_DIR = config.get("PhotoLocations", "PermStorage")
+RESIZE_SIZES = [
+    int(size)
+    for size in config.get(
+        "PhotoLocations", "ResizeSizes", fallback="200,400,800,1200,1600"
+    ).split(",")
+    if size.strip()
+]
+RESIZE_CACHE_DIR = config.get(
+    "PhotoLocations", "ResizeCache", fallback="images/resized"
+)
+RESIZE_CACHE_BYTES = (
+    config.getint("PhotoLocations", "ResizeCacheMB", fallback=512) * 1024 * 1024
+)
+RESIZE_QUALITY = 85
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+class DiskLRU:
+    """Files made on demand and kept until the directory outgrows ``max_bytes``.
+
+    A file's mtime is its last use; eviction deletes the oldest until the
+    directory is back under 90% of its budget. Concurrent requests for the
+    same key in this process wait for one of them to make it; files are
+    written atomically, so other processes racing on a key only waste work.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._usage: Optional[int] = None
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def path(self, key: str) -> str:
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], name + ".jpg")
+
+    def get(self, key: str, make: Callable[[str], object]) -> str:
+        """The cached file for ``key``, written by ``make(path)`` if missing."""
+        path = self.path(key)
+        if self._touch(path):
+            return path
+        lock = self._acquire(key)
+        try:
+            with lock:
+                if self._touch(path):
+                    return path
+                make(path)
+                self._added(os.path.getsize(path))
+        finally:
+            self._release(key)
+        return path
+
+    def usage(self) -> int:
+        """Bytes in the cache, counted from disk on first use."""
+        with self._lock:
+            if self._usage is None:
+                self._usage = sum(os.path.getsize(p) for p in self._files())
+            return self._usage
+
+    def evict(self, target: Optional[int] = None) -> int:
+        """Deletes least recently used files until at most ``target`` bytes remain.
+
+        Returns:
+            the number of files deleted.
+        """
+        target = int(self.max_bytes * 0.9) if target is None else target
+        with self._lock:
+            files = sorted(
+                (os.stat(p).st_mtime_ns, os.path.getsize(p), p) for p in self._files()
+            )
+            usage = sum(size for _, size, _ in files)
+            removed = 0
+            for _, size, path in files:
+                if usage <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                usage -= size
+                removed += 1
+            self._usage = usage
+        if removed:
+            logger.info(f"Evicted {removed} files from {self.directory}")
+        return removed
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _added(self, size: int) -> None:
+        if self.usage() + size > self.max_bytes:
+            self.evict()
+        else:
+            with self._lock:
+                self._usage += size
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.startswith("."):  # skip half-written temporaries
+                    yield os.path.join(root, name)
+
+    def _acquire(self, key: str) -> threading.Lock:
+        with self._lock:
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._key_locks[key]
+
+
+resize_cache = DiskLRU(RESIZE_CACHE_DIR, RESIZE_CACHE_BYTES)
+
+
+def resize_source(path: str) -> Optional[str]:
+    """The file to resize for a photo path, preferring its archive copy.
+
+    Returns:
+        None unless ``path`` is a photo in blog storage, the archive or the
+        media store.
+    """
+    if not path.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    digest = media_store.stored_hash(path)
+    if digest:
+        candidates = [media_store.archive_path(digest), media_store.web_path(digest)]
+    elif path.startswith(os.path.join(BLOG_STORAGE, "")):
+        relative = path[len(os.path.join(BLOG_STORAGE, "")) :]
+        candidates = [
+            safe_join(PERMANENT_PHOTOS_DIR, relative),
+            safe_join(BLOG_STORAGE, relative),
+        ]
+    elif path.startswith(os.path.join(PERMANENT_PHOTOS_DIR, "")):
+        relative = path[len(os.path.join(PERMANENT_PHOTOS_DIR, "")) :]
+        candidates = [safe_join(PERMANENT_PHOTOS_DIR, relative)]
+    else:
+        return None
+    return next((c for c in candidates if c and os.path.isfile(c)), None)
+
+
+def resized(source: str, size: int) -> str:
+    """``source`` at most ``size`` pixels on its longest side, from the cache."""
+    stat = os.stat(source)
+    key = f"{os.path.abspath(source)}:{stat.st_mtime_ns}:{stat.st_size}:{size}"
+    return resize_cache.get(
+        key, lambda path: write_thumbnail(source, path, size, RESIZE_QUALITY)
+    )
+
+
+def resized_url(path: str, size: int) -> str:
+    """The url of ``path`` at ``size``, or of ``path`` itself for other sizes."""
+    if size not in RESIZE_SIZES:
+        return "/" + path
+    return f"/img/{size}/{path}"
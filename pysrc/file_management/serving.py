@@ -0,0 +1,117 @@
+"""Serving photos and videos from disk.
+
+Files whose url names their content, the media store's and any requested
+with the file's current ``v`` fingerprint (the one ``rendering.media_url``
+adds), are sent with a year-long ``immutable`` Cache-Control, so browsers
+never revalidate them. A stale or made-up ``v`` is revalidated like any other
+request. Everything gets Werkzeug's strong ETag and Last-Modified, and range
+support when Flask sends the bytes.
+
+With ``Global/Sendfile`` set, Flask only sends headers and a front proxy sends
+the bytes:
+
+    x-sendfile         Apache's mod_xsendfile, lighttpd; the absolute path
+    x-accel-redirect   nginx; ``Global/SendfilePrefix`` plus the path under the
+                       blog's directory, for an ``internal`` location like
+
+        location /protected/ { internal; alias /srv/blog/; }
+"""
+
+import configparser
+import mimetypes
+import os
+from typing import Optional
+from zlib import adler32
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    request,
+    send_from_directory,
+)
+from werkzeug.security import safe_join
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
+
+SENDFILE = config.get("Global", "Sendfile", fallback="").lower()
+SENDFILE_PREFIX = config.get("Global", "SendfilePrefix", fallback="/protected")
+SENDFILE_ROOT = os.getcwd()
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# HLS segments; mimetypes otherwise takes .ts for Qt translations
+mimetypes.add_type("video/mp2t", ".ts")
+
+
+def fingerprint(path: str) -> Optional[str]:
+    """The ``v`` query ``rendering.media_url`` gives ``path``: its mtime and size."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def send_media(directory: str, filename: str, immutable: bool = False) -> Response:
+    """Sends ``filename`` from ``directory``, or has the front proxy send it.
+
+    Args:
+        immutable: the url names the file's content, so it may be cached for
+            good; requests with the file's current ``v`` fingerprint always are.
+    """
+    if SENDFILE == "x-accel-redirect":
+        response = _accel_redirect(directory, filename)
+    else:
+        # x-sendfile is handled by send_file, through USE_X_SENDFILE
+        response = send_from_directory(directory, filename)
+    if immutable or _fingerprinted(directory, filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def _fingerprinted(directory: str, filename: str) -> bool:
+    v = request.args.get("v")
+    path = safe_join(directory, filename)
+    return v is not None and path is not None and v == fingerprint(path)
+
+
+def _accel_redirect(directory: str, filename: str) -> Response:
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    relative = os.path.relpath(path, SENDFILE_ROOT).replace(os.sep, "/")
+    internal = SENDFILE_PREFIX.rstrip("/") + "/" + relative
+    response = Response(
+        mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream"
+    )
+    response.headers["X-Accel-Redirect"] = internal
+    # the validators send_file would give, so both paths answer alike
+    path = os.path.join(current_app.root_path, path)
+    stat = os.stat(path)
+    response.last_modified = stat.st_mtime
+    check = adler32(path.encode()) & 0xFFFFFFFF
+    response.set_etag(f"{stat.st_mtime}-{stat.st_size}-{check}")
+    return response.make_conditional(request)
+
+
+class MediaBlueprint(Blueprint):
+    """A blueprint whose static folder is photos or videos.
+
+    Args:
+        immutable: every file in the folder is named by its content, so any
+            request for it may be cached for good, fingerprinted or not.
+    """
+
+    def __init__(self, *args, immutable: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable = immutable
+
+    def send_static_file(self, filename: str) -> Response:
+        return send_media(self.static_folder, filename, self.immutable)
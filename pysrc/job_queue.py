@@ -0,0 +1,377 @@
+"""A small persistent job queue kept in the blog's SQLite database.
+
+Work that is too slow for a request (resizing photos, ...) is recorded with
+``enqueue`` and carried out later by ``run_worker``, which hands each job's
+handler to a process pool. Jobs survive restarts, failed jobs are retried
+with a growing delay, and jobs that use up their attempts wait in the
+``failed`` state for ``retry``.
+
+Every kind of job is registered once with a handler, which runs in a worker
+process and must be a picklable top-level function, and optionally a
+finisher, which runs in the worker's parent with a database connection and
+the handler's result. A kind can also be given a limit on how many of its
+jobs run at once, so a few heavy jobs (encoding videos, ...) can't take
+every worker, and kinds registered in the same group share that limit.
+Long handlers can call ``report_progress`` as they go, and anyone can read
+it back with ``progress``.
+
+Sites without a worker process can call ``run_in_thread`` after queueing
+work, which runs the queue one job at a time in a thread of their own.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from pysrc.database.queries import JobQueries
+
+__author__ = "kongaloosh"
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = timedelta(seconds=30)
+
+_kinds: Dict[str, Tuple[Callable, Optional[Callable], Optional[int]]] = {}
+# the group each kind's limit counts against; by default its own
+_groups: Dict[str, str] = {}
+
+# in a worker process: how to reach the database, and the job being run
+_worker_connect: Optional[Callable] = None
+_worker_db = None
+_current_job: Optional[int] = None
+
+# the thread run_in_thread drains the queue in, and whether it should look again
+_thread: Optional[threading.Thread] = None
+_thread_lock = threading.Lock()
+_thread_woken = False
+
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: dict
+    attempts: int
+    max_attempts: int
+
+
+def register(
+    kind: str,
+    handler: Callable[[dict], Any],
+    finisher: Optional[Callable] = None,
+    limit: Optional[int] = None,
+    group: Optional[str] = None,
+) -> None:
+    """Registers how to run jobs of ``kind``.
+
+    Args:
+        kind: the name jobs are enqueued under.
+        handler: called with the job's payload in a worker process.
+        finisher: called as ``finisher(db, payload, result)`` in the parent
+            once the handler has succeeded.
+        limit: the most jobs of this kind's group a worker runs at once
+            before it holds back jobs of this kind; by default as many as
+            its pool has room for.
+        group: a name shared by kinds that compete for the same resource
+            (``ffmpeg``, ...), so their running jobs count together against
+            ``limit``.
+    """
+    _kinds[kind] = (handler, finisher, limit)
+    _groups[kind] = group or kind
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+def enqueue(
+    db, kind: str, payload: dict, target: Optional[str] = None, max_attempts: int = 3
+) -> int:
+    """Adds a job; the caller commits.
+
+    Args:
+        target: the file the job will produce, so requests for it can be
+            answered while the job is outstanding (see ``pending_job``).
+    """
+    now = _now()
+    cur = db.execute(
+        JobQueries.INSERT,
+        (kind, json.dumps(payload), target, max_attempts, now, now, now),
+    )
+    return cur.lastrowid
+
+
+def claim(db, exclude: Iterable[str] = ()) -> Optional[Job]:
+    """Marks the oldest runnable job as running and returns it.
+
+    Args:
+        exclude: kinds of job to leave for later.
+    """
+    now = _now()
+    row = db.execute(JobQueries.CLAIM, (now, now, json.dumps(list(exclude)))).fetchone()
+    db.commit()
+    if row is None:
+        return None
+    job_id, kind, payload, attempts, max_attempts = row
+    return Job(job_id, kind, json.loads(payload), attempts, max_attempts)
+
+
+def complete(db, job: Job, result: Any = None) -> None:
+    """Runs the job's finisher and marks it done, or failed if the finisher fails."""
+    _, finisher, _ = _kinds[job.kind]
+    try:
+        if finisher is not None:
+            finisher(db, job.payload, result)
+    except Exception as e:
+        logger.exception(f"Finishing job {job.id} failed")
+        fail(db, job, e)
+        return
+    db.execute(JobQueries.COMPLETE, (json.dumps(result, default=str), _now(), job.id))
+    db.commit()
+
+
+def fail(db, job: Job, error: BaseException) -> None:
+    """Records a failure; the job is retried later unless it is out of attempts."""
+    run_after = (datetime.now() + RETRY_DELAY * job.attempts).isoformat()
+    message = f"{type(error).__name__}: {error}"
+    db.execute(JobQueries.FAIL, (message, run_after, _now(), job.id))
+    db.commit()
+
+
+def retry(db, job_id: int) -> bool:
+    """Puts a failed job back in the queue with a fresh set of attempts."""
+    now = _now()
+    cur = db.execute(JobQueries.RETRY, (now, now, job_id))
+    db.commit()
+    return cur.rowcount > 0
+
+
+def outstanding(db) -> List[dict]:
+    """Every job that isn't done, oldest first."""
+    cur = db.execute(JobQueries.SELECT_OUTSTANDING)
+    columns = [column[0] for column in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def pending_job(db, target: str) -> Optional[Tuple[dict, str]]:
+    """The payload and status of the newest unfinished job producing ``target``."""
+    row = db.execute(JobQueries.SELECT_BY_TARGET, (target,)).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]), row[1]
+
+
+def last_result(db, target: str) -> Any:
+    """What the handler of the newest finished job producing ``target`` returned."""
+    row = db.execute(JobQueries.SELECT_RESULT_BY_TARGET, (target,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def report_progress(progress: dict) -> None:
+    """Records how far the running job has got, from inside its handler.
+
+    Does nothing when the handler isn't being run by ``run_worker``, so
+    handlers can still be called directly.
+    """
+    global _worker_db
+    if _current_job is None or _worker_connect is None:
+        return
+    if _worker_db is None:
+        _worker_db = _worker_connect()
+    _worker_db.execute(
+        JobQueries.UPDATE_PROGRESS, (json.dumps(progress), _now(), _current_job)
+    )
+    _worker_db.commit()
+
+
+def progress(db, target: str) -> Optional[dict]:
+    """The last progress reported by the newest job producing ``target``."""
+    row = db.execute(JobQueries.SELECT_PROGRESS_BY_TARGET, (target,)).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+
+def upgrade(db) -> None:
+    """Brings an existing jobs table up to date; the caller commits."""
+    db.executescript(JobQueries.CREATE_TABLE)
+    columns = [row[1] for row in db.execute("PRAGMA table_info(jobs)")]
+    if "result" not in columns:
+        db.execute(JobQueries.ADD_RESULT_COLUMN)
+    if "progress" not in columns:
+        db.execute(JobQueries.ADD_PROGRESS_COLUMN)
+
+
+def _init_worker(connect: Callable, initializer: Optional[Callable]) -> None:
+    global _worker_connect
+    _worker_connect = connect
+    if initializer is not None:
+        initializer()
+
+
+def _run_job(handler: Callable, job_id: int, payload: dict) -> Any:
+    global _current_job
+    _current_job = job_id
+    try:
+        return handler(payload)
+    finally:
+        _current_job = None
+
+
+def run_worker(
+    connect: Callable,
+    workers: Optional[int] = None,
+    once: bool = False,
+    poll_interval: float = 1.0,
+    initializer: Optional[Callable] = None,
+) -> int:
+    """Drains the queue with a pool of ``workers`` processes.
+
+    Only one worker should run against a database: on start it puts back any
+    job a previous worker left running.
+
+    Args:
+        connect: returns a new database connection; worker processes use it
+            to report progress, so it must be picklable where processes are
+            spawned rather than forked.
+        workers: pool size, defaulting to the CPU count; 0 runs jobs in this
+            process, one at a time.
+        once: return when the queue is empty instead of polling for more.
+        initializer: run in each worker process before its first job.
+
+    Returns:
+        the number of jobs that finished, successfully or not.
+    """
+    global _worker_connect, _worker_db
+    db = connect()
+    db.execute(JobQueries.REQUEUE_RUNNING, (_now(),))
+    db.commit()
+    finished = 0
+    try:
+        if workers == 0:
+            _worker_connect, _worker_db = connect, db
+            while (job := claim(db)) is not None or not once:
+                if job is None:
+                    time.sleep(poll_interval)
+                    continue
+                _run_here(db, job)
+                finished += 1
+            return finished
+
+        capacity = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+            capacity, initializer=_init_worker, initargs=(connect, initializer)
+        ) as pool:
+            running = {}
+            while True:
+                while (
+                    len(running) < capacity
+                    and (job := claim(db, _at_limit(running.values()))) is not None
+                ):
+                    # handlers are pickled by name, so spawned workers import them
+                    handler, _, _ = _kinds[job.kind]
+                    running[pool.submit(_run_job, handler, job.id, job.payload)] = job
+                if not running:
+                    if once:
+                        return finished
+                    time.sleep(poll_interval)
+                    continue
+                done, _ = wait(
+                    running, timeout=poll_interval, return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+                        fail(db, job, e)
+                    else:
+                        complete(db, job, result)
+                    finished += 1
+    finally:
+        _worker_connect = _worker_db = None
+        db.close()
+
+
+def _run_here(db, job: Job) -> None:
+    try:
+        result = _run_job(_kinds[job.kind][0], job.id, job.payload)
+    except Exception as e:
+        logger.exception(f"Job {job.id} ({job.kind}) failed")
+        fail(db, job, e)
+    else:
+        complete(db, job, result)
+
+
+def run_in_thread(
+    connect: Callable,
+    initializer: Optional[Callable] = None,
+    poll_interval: float = 1.0,
+) -> None:
+    """Runs the queue in a daemon thread of this process, one job at a time.
+
+    Call it once new jobs are committed. The thread is started if it isn't
+    running, and otherwise told to look again; it exits once no job is left
+    pending, waiting out retry delays first. Unlike ``run_worker`` it doesn't
+    put back jobs left running, which another process may be running.
+
+    Args:
+        connect: returns a new database connection, for the thread.
+        initializer: run in the thread before its first job.
+    """
+    global _thread, _thread_woken
+    with _thread_lock:
+        _thread_woken = True
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(
+                target=_drain,
+                args=(connect, initializer, poll_interval),
+                name="job-queue",
+                daemon=True,
+            )
+            _thread.start()
+
+
+def _drain(
+    connect: Callable, initializer: Optional[Callable], poll_interval: float
+) -> None:
+    global _worker_connect, _worker_db, _thread, _thread_woken
+    if initializer is not None:
+        initializer()
+    db = connect()
+    _worker_connect, _worker_db = connect, db
+    try:
+        while True:
+            with _thread_lock:
+                _thread_woken = False
+            while (job := claim(db)) is not None:
+                _run_here(db, job)
+            if any(job["status"] == "pending" for job in outstanding(db)):
+                time.sleep(poll_interval)
+                continue
+            with _thread_lock:
+                if not _thread_woken:
+                    _thread = None
+                    return
+    except Exception:
+        logger.exception("Running the queue in a thread failed")
+        with _thread_lock:
+            _thread = None
+    finally:
+        _worker_connect = _worker_db = None
+        db.close()
+
+
+def _at_limit(running: Iterable[Job]) -> List[str]:
+    """The kinds with as many jobs of their group running as they're allowed."""
+    counts = Counter(_groups.get(job.kind, job.kind) for job in running)
+    return [
+        kind
+        for kind, (_, _, limit) in _kinds.items()
+        if limit is not None and counts[_groups.get(kind, kind)] >= limit
+    ]
@@ -4,6 +4,8 @@ import re
 import configparser
 import os
 import posixpath
+from pysrc.file_management.photo_index import dimensions
+from pysrc.file_management.resizing import RESIZE_SIZES, resized_url
 
 __author__ = "kongaloosh"
 
@@ -15,7 +17,7 @@ GROUP_WRAP = """
 
 IMG_WRAP = """
     <a class="fancybox p-2 text-center" rel="group"  href="%s">
-        <img src="%s" class="u-photo img-responsive img-thumbnail" style="max-height:auto">
+        <img src="%s" srcset="%s"%s class="u-photo img-responsive img-thumbnail" style="max-height:auto">
     </a>
     """
 
@@ -31,6 +33,16 @@ BULK_UPLOAD_DIR = config["PhotoLocations"]["BulkUploadLocation"]
 PERMANENT_PHOTOS_DIR = config["PhotoLocations"]["PermStorage"]
 BLOG_STORAGE = config["PhotoLocations"]["BlogStorage"]
 HIGH_RES_URL = "images/"
+# album thumbnails are resized on request by /img, at 1x and 2x
+ALBUM_SIZE = 400
+
+
+def fitted(size, max_dim):
+    """``size`` shrunk to at most ``max_dim`` on its longest side, as /img does."""
+    width, height = size
+    scale = min(1, max_dim / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
 
 class AlbumExtension(Extension):
 
@@ -63,6 +75,8 @@ class AlbumPreprocessor(Preprocessor):
                         # Strip any leading slash for consistent joining
                         image_location = image_location.lstrip("/")
 
+                        srcset = ""
+                        size = dimensions(image_location)
                         if image_location.startswith(BULK_UPLOAD_DIR):
                             path = posixpath.join("/", image_location)
                             href_path = path
@@ -74,7 +88,22 @@ class AlbumPreprocessor(Preprocessor):
                             href_path = posixpath.join(
                                 "/", HIGH_RES_URL, src_path
                             )
-                        generated_html += IMG_WRAP % (href_path, src_path)
+                            src_path = resized_url(image_location, ALBUM_SIZE)
+                            srcset = "%s 1x, %s 2x" % (
+                                src_path,
+                                resized_url(image_location, ALBUM_SIZE * 2),
+                            )
+                            if size and ALBUM_SIZE in RESIZE_SIZES:
+                                size = fitted(size, ALBUM_SIZE)
+                        # from the photo index, so the page doesn't reflow as
+                        # thumbnails load
+                        sized = ' width="%d" height="%d"' % size if size else ""
+                        generated_html += IMG_WRAP % (
+                            href_path,
+                            src_path,
+                            srcset,
+                            sized,
+                        )
                     except Exception as e:
                         print(f"Error processing image {image}: {e}")
                 generated_html = GROUP_WRAP % generated_html
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, HttpUrl, Field, field_validator
-from typing import List, Optional, Union, Tuple
+from typing import Dict, List, Optional, Union, Tuple
 from datetime import datetime
 import base64
 
@@ -27,7 +27,21 @@ class Event(BaseModel):
 
 
 class ReplyTo(BaseModel):
+    """What a post is replying to.
+
+    Replies to other sites only carry the url; replies to this site also carry
+    a small projection of the target post and, up to a depth limit, what the
+    target was itself replying to.
+    """
+
     url: HttpUrl
+    title: Optional[str] = None
+    summary: Optional[str] = None
+    content: Optional[str] = None
+    photo: Optional[str] = None
+    published: Optional[datetime] = None
+    author: Optional[str] = None
+    in_reply_to: Optional[List["ReplyTo"]] = None
 
 
 class GeoLocation(BaseModel):
@@ -80,6 +94,24 @@ class Travel(BaseModel):
         return data
 
 
+class PhotoVariant(BaseModel):
+    """One pre-sized, pre-encoded copy of a photo, for srcset."""
+
+    path: str
+    width: int
+    height: int
+    type: str = "image/jpeg"  # MIME type
+
+
+class VideoStream(BaseModel):
+    """The HLS renditions and poster frame made of a published video."""
+
+    playlist: str  # the master playlist
+    poster: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
 class DraftPost(BaseModel):
     """Model for posts being created/edited before storage"""
 
@@ -97,6 +129,10 @@ class DraftPost(BaseModel):
     # Media
     photo: Optional[List[str]] = None
     video: Optional[List[str]] = None
+    # sized copies of each photo, keyed by its path in ``photo``
+    photo_variants: Optional[Dict[str, List[PhotoVariant]]] = None
+    # streams of each video, keyed by its path in ``video``
+    video_streams: Optional[Dict[str, VideoStream]] = None
 
     # Location
     geo: Optional[GeoLocation] = None
@@ -146,3 +182,36 @@ class BlogPost(DraftPost):
                 ).decode("utf-8")
             return data
         return super().model_dump(**kwargs)
+
+
+class EntrySummary(BaseModel):
+    """The parts of a post that list views render, stored in the entries table.
+
+    ``content`` holds the already rendered HTML, so index, tag and date pages
+    can be drawn from a single query without touching the filesystem.
+    """
+
+    slug: str
+    url: str
+    published: datetime
+    title: Optional[str] = None
+    summary: Optional[str] = None
+    content: str = ""
+    category: Optional[List[str]] = None
+    photo: Optional[List[str]] = None
+    photo_variants: Optional[Dict[str, List[PhotoVariant]]] = None
+    video: Optional[List[str]] = None
+    video_streams: Optional[Dict[str, VideoStream]] = None
+    geo: Optional[GeoLocation] = None
+    event: Optional[Event] = None
+    travel: Optional[Travel] = None
+    in_reply_to: Optional[List[Union[str, ReplyTo]]] = None
+    twitter: Optional[TwitterInfo] = None
+
+    @classmethod
+    def from_post(cls, post: BlogPost) -> "EntrySummary":
+        """Project a post whose content has already been rendered to HTML."""
+        data = post.model_dump(mode="json")
+        if data.get("travel"):
+            data["travel"]["map_data"] = None
+        return cls(**data)
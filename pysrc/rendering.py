@@ -0,0 +1,141 @@
+import threading
+from typing import Optional
+import markdown
+from markupsafe import Markup
+from pysrc.markdown_albums.markdown_album_extension import AlbumExtension
+from pysrc.markdown_hashtags.markdown_hashtag_extension import HashtagExtension
+from pysrc.file_management.media_store import stored_hash
+from pysrc.file_management.photo_index import dimensions
+from pysrc.file_management.serving import fingerprint
+
+__author__ = "kongaloosh"
+
+_local = threading.local()
+
+
+def markdown_extensions() -> list:
+    """The one extension set posts are rendered with, published or previewed."""
+    return ["mdx_math", AlbumExtension(), HashtagExtension(), "fenced_code"]
+
+
+def get_markdown() -> markdown.Markdown:
+    """This thread's configured Markdown instance, built on first use.
+
+    Building a Markdown instance registers every extension and compiles their
+    patterns, which costs more than converting a typical post. Instances are
+    not thread-safe, so each thread keeps its own and resets it between
+    documents.
+    """
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = markdown.Markdown(extensions=markdown_extensions())
+        _local.md = md
+    return md
+
+
+def render_markdown(text: str) -> str:
+    """Renders a post's markdown to HTML."""
+    md = get_markdown()
+    md.reset()
+    return md.convert(text)
+
+
+def media_url(path: str) -> str:
+    """The url of a photo or video, fingerprinted so it can be cached for good.
+
+    Paths in the media store are named by their content already; other files
+    get their mtime and size as a ``v`` query, so replacing one changes its url.
+    """
+    if stored_hash(path):
+        return "/" + path
+    v = fingerprint(path)
+    return "/" + path if v is None else f"/{path}?v={v}"
+
+
+def picture(
+    photo: str,
+    variants: Optional[dict] = None,
+    sizes: str = "(max-width: 800px) 100vw, 800px",
+    **attrs,
+) -> Markup:
+    """``<picture>`` markup for a post photo, with a srcset per format.
+
+    ``variants`` is the post's ``photo_variants``; photos published before
+    variants existed fall back to a plain ``<img>``, sized from the photo
+    index when it knows the photo. Extra keyword arguments
+    become attributes of the ``<img>``; use ``class_`` for ``class``.
+    """
+    img_attrs = {key.rstrip("_"): value for key, value in attrs.items()}
+    by_type = {}
+    for variant in (variants or {}).get(photo, []):
+        by_type.setdefault(variant.type, []).append(variant)
+    fallback = by_type.pop("image/jpeg", [])
+
+    img_attrs["src"] = media_url(photo)
+    if fallback:
+        img_attrs["srcset"] = _srcset(fallback)
+        img_attrs["sizes"] = sizes
+        web_copy = next((v for v in fallback if v.path == photo), fallback[-1])
+        img_attrs["width"] = web_copy.width
+        img_attrs["height"] = web_copy.height
+    else:
+        size = dimensions(photo)
+        if size:
+            img_attrs["width"], img_attrs["height"] = size
+    img_attrs.setdefault("loading", "lazy")
+    img = Markup("<img {}>").format(_attributes(img_attrs))
+    if not by_type:
+        return img
+
+    # browsers take the first source they support, so smallest files first
+    sources = [
+        Markup('<source type="{}" srcset="{}" sizes="{}">').format(
+            mime, _srcset(by_type[mime]), sizes
+        )
+        for mime in ("image/avif", "image/webp")
+        if mime in by_type
+    ]
+    return Markup("<picture>{}{}</picture>").format(Markup("").join(sources), img)
+
+
+def video_player(video: str, streams: Optional[dict] = None, **attrs) -> Markup:
+    """``<video>`` markup for a post video, offering its HLS stream first.
+
+    ``streams`` is the post's ``video_streams``. Browsers that play HLS
+    natively take the adaptive playlist and the rest fall back to the MP4;
+    videos without streams get the MP4 alone. Extra keyword arguments become
+    attributes of the ``<video>``; use ``class_`` for ``class``.
+    """
+    video_attrs = {key.rstrip("_"): value for key, value in attrs.items()}
+    stream = (streams or {}).get(video)
+    sources = []
+    if stream is not None:
+        if stream.poster:
+            video_attrs["poster"] = media_url(stream.poster)
+        if stream.width and stream.height:
+            video_attrs["width"], video_attrs["height"] = stream.width, stream.height
+        video_attrs.setdefault("preload", "none")
+        sources.append(
+            Markup('<source src="{}" type="application/vnd.apple.mpegurl">').format(
+                media_url(stream.playlist)
+            )
+        )
+    sources.append(
+        Markup('<source src="{}" type="video/mp4">').format(media_url(video))
+    )
+    return Markup("<video controls {}>{}</video>").format(
+        _attributes(video_attrs), Markup("").join(sources)
+    )
+
+
+def _srcset(variants) -> str:
+    return ", ".join(
+        f"{media_url(v.path)} {v.width}w"
+        for v in sorted(variants, key=lambda v: v.width)
+    )
+
+
+def _attributes(attrs: dict) -> Markup:
+    return Markup(" ").join(
+        Markup('{}="{}"').format(key, value) for key, value in attrs.items()
+    )
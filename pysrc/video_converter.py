@@ -1,77 +1,590 @@
-from concurrent.futures import ThreadPoolExecutor
+"""Uploaded videos made into web MP4s by ``flask media-worker``.
+
+Each upload is probed first. Most phones already record H.264 and AAC, and
+those are only remuxed into a fast-start MP4, which takes seconds; anything
+else is re-encoded with libx264, which takes minutes. Which was done is
+recorded as the job's result.
+
+Every video is a ``video`` job in the blog's job queue, so encodes survive
+restarts and their state, and ffmpeg's progress through them, can be
+looked up from any web worker with ``conversion_status`` and
+``conversion_progress``. Each run of ffmpeg gets time in proportion to the
+video's length. ffmpeg is CPU bound for minutes at a time, so at
+most ``Global/VideoEncoders`` encodes run at once, each at ``nice``
+``Global/VideoNice`` and with ``Global/VideoThreads`` encoder threads, and
+photos keep being processed alongside them.
+
+With ``Global/VideoStreaming`` on, each published video's MP4 is followed by
+a ``streams`` job making a poster frame and an HLS bitrate ladder
+(``Global/VideoLadder``) beside it, which posts offer before the MP4.
+"""
+
+import configparser
+import json
 import logging
-import subprocess
 import os
-from typing import Optional, Dict
-from threading import Lock
+import shutil
+import subprocess
+import tempfile
 import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+from pysrc import job_queue
+
+__author__ = "kongaloosh"
+
+config = configparser.ConfigParser()
+config.read("config.ini")
 
 logger = logging.getLogger(__name__)
-executor = ThreadPoolExecutor(max_workers=1)
-conversion_status: Dict[str, str] = {}
-status_lock = Lock()
 
+VIDEO_ENCODERS = config.getint("Global", "VideoEncoders", fallback=1)
+VIDEO_NICE = config.getint("Global", "VideoNice", fallback=10)
+# 0 lets ffmpeg use every core
+VIDEO_THREADS = config.getint("Global", "VideoThreads", fallback=2)
+# seconds allowed per second of video, and the limits either side of that;
+# without a duration from ffprobe an encode gets the longest
+VIDEO_TIMEOUT_FACTOR = config.getfloat("Global", "VideoTimeoutFactor", fallback=20)
+VIDEO_TIMEOUT_MIN = config.getint("Global", "VideoTimeoutMin", fallback=300)
+VIDEO_TIMEOUT = config.getint("Global", "VideoTimeout", fallback=4 * 3600)
+PROBE_TIMEOUT = 60
+# how often a running encode records its progress
+PROGRESS_INTERVAL = 2.0
+# HLS renditions and a poster frame for each published video, made after its MP4
+VIDEO_STREAMING = config.getboolean("Global", "VideoStreaming", fallback=False)
+# short side:video kbps for each rendition, smallest first
+VIDEO_LADDER = sorted(
+    tuple(int(part) for part in rung.split(":"))
+    for rung in config.get(
+        "Global", "VideoLadder", fallback="360:800,720:2800,1080:5000"
+    ).split(",")
+    if rung.strip()
+)
+HLS_SEGMENT_SECONDS = 6
+HLS_AUDIO_KBPS = 128
 
-def convert_video_to_mp4(input_path: str, output_path: str) -> Optional[str]:
-    """Start video conversion in background and return immediately"""
-    video_id = os.path.basename(input_path)
+# what every browser plays from an MP4 without re-encoding
+WEB_VIDEO_CODECS = {"h264"}
+WEB_PIXEL_FORMATS = {"yuv420p", "yuvj420p"}
+WEB_AUDIO_CODECS = {"aac"}
+MP4_FORMATS = {"mov", "mp4"}
 
-    def convert_in_background():
-        try:
-            command = [
-                "ffmpeg",
-                "-i",
-                input_path,
-                "-c:v",
-                "libx264",
-                "-crf",
-                "18",  # Lower CRF = higher quality (18 is visually lossless)
-                "-preset",
-                "slow",  # Slower preset = better compression
-                "-vf",
-                "format=yuv420p",  # Simpler color conversion
-                "-c:a",
-                "aac",
-                "-b:a",
-                "192k",  # Higher audio bitrate
-                "-movflags",
-                "+faststart",
-                "-y",
-                output_path,
-            ]
-
-            logger.info(f"Starting conversion in background: {input_path}")
-
-            result = subprocess.run(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False,
-                timeout=300,
+
+def probe(path: str) -> dict:
+    """ffprobe's description of a video's container and streams.
+
+    Returns:
+        the parsed json, or an empty dict if ffprobe couldn't read the file.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=format_name,duration"
+                ":stream=codec_type,codec_name,pix_fmt,width,height"
+                ":stream_side_data=rotation",
+                "-of",
+                "json",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            check=False,
+            timeout=PROBE_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Couldn't probe {path}: {e}")
+        return {}
+    if result.returncode != 0:
+        logger.warning(f"Couldn't probe {path}: {result.stderr.strip()}")
+        return {}
+    try:
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        return {}
+
+
+def can_remux(info: dict) -> bool:
+    """Whether a probed video only needs its streams copied into an MP4."""
+    formats = set(info.get("format", {}).get("format_name", "").split(","))
+    streams = info.get("streams", [])
+    video = [s for s in streams if s.get("codec_type") == "video"]
+    audio = [s for s in streams if s.get("codec_type") == "audio"]
+    return (
+        bool(formats & MP4_FORMATS)
+        and len(video) >= 1
+        and video[0].get("codec_name") in WEB_VIDEO_CODECS
+        and video[0].get("pix_fmt") in WEB_PIXEL_FORMATS
+        and all(a.get("codec_name") in WEB_AUDIO_CODECS for a in audio[:1])
+    )
+
+
+def remux_command(input_path: str, output_path: str) -> list:
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-i",
+        input_path,
+        # phones add timecode and metadata tracks that MP4 can't always hold
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a:0?",
+        "-c",
+        "copy",
+        "-movflags",
+        "+faststart",
+        "-f",
+        "mp4",
+        "-y",
+        output_path,
+    ]
+
+
+def ffmpeg_command(input_path: str, output_path: str) -> list:
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-i",
+        input_path,
+        "-c:v",
+        "libx264",
+        "-crf",
+        "18",  # Lower CRF = higher quality (18 is visually lossless)
+        "-preset",
+        "slow",  # Slower preset = better compression
+        "-threads",
+        str(VIDEO_THREADS),
+        "-vf",
+        "format=yuv420p",  # Simpler color conversion
+        "-c:a",
+        "aac",
+        "-b:a",
+        "192k",  # Higher audio bitrate
+        "-movflags",
+        "+faststart",
+        "-f",
+        "mp4",
+        "-y",
+        output_path,
+    ]
+
+
+def _lower_priority() -> None:
+    # runs in the ffmpeg child, so requests and photo jobs stay responsive
+    os.nice(VIDEO_NICE)
+
+
+def transcode(payload: dict) -> dict:
+    """Job handler for a queued video; runs in a media worker process.
+
+    ffmpeg writes next to the output and the result is renamed into place,
+    so a failed or interrupted run never leaves a truncated video behind. A
+    remux that ffmpeg rejects falls back to a full encode. Progress is
+    reported to the job queue as ffmpeg goes.
+
+    Returns:
+        the output's path and how it was made: ``remux`` or ``encode``.
+
+    Raises:
+        RuntimeError: if ffmpeg fails or runs out of time, so the job is
+            retried.
+    """
+    source, output = payload["source"], payload["output"]
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    partial = os.path.join(
+        os.path.dirname(output), ".transcoding-" + os.path.basename(output)
+    )
+    try:
+        info = probe(source)
+        duration = duration_of(info)
+        method = "remux" if can_remux(info) else "encode"
+        if method == "remux":
+            ok, error = _run_ffmpeg(
+                remux_command(source, partial), partial, duration, method
             )
+            if not ok:
+                logger.warning(f"Remuxing {source} failed, encoding it: {error}")
+                method = "encode"
+        if method == "encode":
+            ok, error = _run_ffmpeg(
+                ffmpeg_command(source, partial), partial, duration, method
+            )
+            if not ok:
+                raise RuntimeError(error)
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    logger.info(f"Made {output} from {source} by {method}")
+    return {"output": output, "method": method}
+
+
+def duration_of(info: dict) -> Optional[float]:
+    """A probed video's length in seconds, if ffprobe could tell."""
+    try:
+        return float(info["format"]["duration"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def timeout_for(duration: Optional[float]) -> float:
+    """How long ffmpeg may take over a video of ``duration`` seconds."""
+    if not duration:
+        return VIDEO_TIMEOUT
+    return min(VIDEO_TIMEOUT, max(VIDEO_TIMEOUT_MIN, duration * VIDEO_TIMEOUT_FACTOR))
+
+
+def parse_progress(lines: Iterable[str], duration: Optional[float]) -> Iterator[dict]:
+    """Reads ffmpeg's ``-progress`` output as it's written.
+
+    ffmpeg writes blocks of ``key=value`` lines, each ending with
+    ``progress=continue``, or ``progress=end`` after the last.
+
+    Yields:
+        for each block: percent done, frames per second and the estimated
+        seconds left, each None when it can't be known.
+    """
+    block = {}
+    for line in lines:
+        key, _, value = line.strip().partition("=")
+        if key != "progress":
+            block[key] = value
+            continue
+        done = value == "end"
+        position = _number(block.get("out_time_us") or block.get("out_time_ms"))
+        speed = _number(block.get("speed", "").rstrip("x"))
+        percent = eta = None
+        if duration and position is not None:
+            seconds = position / 1_000_000
+            percent = 100.0 if done else min(99.9, 100 * seconds / duration)
+            if done:
+                eta = 0.0
+            elif speed:
+                eta = max(0.0, (duration - seconds) / speed)
+        yield {
+            "percent": None if percent is None else round(percent, 1),
+            "fps": _number(block.get("fps")),
+            "eta": None if eta is None else round(eta),
+        }
+        block = {}
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None  # ffmpeg writes N/A before it knows
+
+
+def _run_ffmpeg(
+    command: list, partial: str, duration: Optional[float], method: str
+) -> Tuple[bool, str]:
+    """Runs ffmpeg, reporting its progress, within the video's time limit.
+
+    Only the tail of stderr is kept, in a temporary file, rather than
+    everything ffmpeg says over a long encode.
+
+    Returns:
+        whether it produced ``partial``, and why not.
+    """
+    command = command[:1] + ["-progress", "pipe:1", "-nostats"] + command[1:]
+    timeout = timeout_for(duration)
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            text=True,
+            preexec_fn=_lower_priority if VIDEO_NICE else None,
+        )
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        try:
+            reported = 0.0
+            for progress in parse_progress(process.stdout, duration):
+                finished = progress["percent"] == 100.0
+                if finished or time.monotonic() - reported >= PROGRESS_INTERVAL:
+                    job_queue.report_progress({**progress, "method": method})
+                    reported = time.monotonic()
+            returncode = process.wait()
+        finally:
+            watchdog.cancel()
+        if returncode == 0 and os.path.exists(partial):
+            return True, ""
+        if timed_out.is_set():
+            return False, f"ffmpeg ran out of time after {timeout:.0f}s"
+        stderr.seek(max(0, stderr.seek(0, os.SEEK_END) - 500))
+        tail = stderr.read().decode(errors="replace")
+        return False, f"ffmpeg exited with {returncode}: {tail}"
 
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                logger.info(f"Successfully converted video to: {output_path}")
-                with status_lock:
-                    conversion_status[video_id] = "completed"
-            else:
-                logger.error(f"Conversion failed for: {input_path}")
-                with status_lock:
-                    conversion_status[video_id] = "failed"
-
-        except Exception as e:
-            logger.error(f"Error converting video: {str(e)}")
-            with status_lock:
-                conversion_status[video_id] = "error"
-
-    # Start conversion in background
-    with status_lock:
-        conversion_status[video_id] = "starting"
-
-    thread = threading.Thread(target=convert_in_background)
-    thread.daemon = True
-    thread.start()
-
-    # Return immediately with the expected output path
+
+def display_size(info: dict) -> Optional[Tuple[int, int]]:
+    """A probed video's upright (width, height), as players show it."""
+    video = [s for s in info.get("streams", []) if s.get("codec_type") == "video"]
+    if not video or not video[0].get("width") or not video[0].get("height"):
+        return None
+    width, height = video[0]["width"], video[0]["height"]
+    rotation = next(
+        (d["rotation"] for d in video[0].get("side_data_list", []) if "rotation" in d),
+        0,
+    )
+    if abs(int(rotation)) % 180 == 90:
+        width, height = height, width
+    return width, height
+
+
+def streams_dir(output_path: str) -> str:
+    """Where the HLS renditions of a published MP4 go: beside it, as clip-0-hls/."""
+    return os.path.splitext(output_path)[0] + "-hls"
+
+
+def poster_path(output_path: str) -> str:
+    return os.path.splitext(output_path)[0] + "-poster.jpg"
+
+
+def ladder_for(size: Optional[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """The renditions worth making of a video: none larger than the video itself."""
+    if size is None:
+        return VIDEO_LADDER[:1]
+    short = min(size)
+    return [rung for rung in VIDEO_LADDER if rung[0] <= short] or [
+        (short - short % 2, VIDEO_LADDER[0][1])
+    ]
+
+
+def _scaled(size: Tuple[int, int], short: int) -> Tuple[int, int]:
+    # matches scale's -2: the long side rounded to an even number
+    width, height = size
+    if width >= height:
+        return round(width * short / height / 2) * 2, short
+    return short, round(height * short / width / 2) * 2
+
+
+def rendition_command(input_path: str, directory: str, short: int, kbps: int) -> list:
+    """ffmpeg writing one rendition's playlist and segments into ``directory``.
+
+    Keyframes are forced on segment boundaries so every rendition's segments
+    line up and players can switch between them.
+    """
+    name = f"{short}p"
+    landscape = f"if(gte(iw,ih),-2,{short})"
+    portrait = f"if(gte(iw,ih),{short},-2)"
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-i",
+        input_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a:0?",
+        "-vf",
+        f"scale=w='{landscape}':h='{portrait}',format=yuv420p",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "medium",
+        "-threads",
+        str(VIDEO_THREADS),
+        "-b:v",
+        f"{kbps}k",
+        "-maxrate",
+        f"{kbps * 107 // 100}k",
+        "-bufsize",
+        f"{kbps * 3 // 2}k",
+        "-force_key_frames",
+        f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-c:a",
+        "aac",
+        "-b:a",
+        f"{HLS_AUDIO_KBPS}k",
+        "-ac",
+        "2",
+        "-f",
+        "hls",
+        "-hls_time",
+        str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_filename",
+        os.path.join(directory, name + "_%03d.ts"),
+        "-y",
+        os.path.join(directory, name + ".m3u8"),
+    ]
+
+
+def poster_command(input_path: str, output_path: str, at: float) -> list:
+    return [
+        "ffmpeg",
+        "-nostdin",
+        "-ss",
+        f"{at:.2f}",
+        "-i",
+        input_path,
+        "-frames:v",
+        "1",
+        "-q:v",
+        "3",
+        "-f",
+        "image2",
+        "-y",
+        output_path,
+    ]
+
+
+def master_playlist(renditions: List[Tuple[int, int, Tuple[int, int]]]) -> str:
+    """The playlist players start from, listing each (short, kbps, size) rendition."""
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for short, kbps, (width, height) in renditions:
+        bandwidth = (kbps * 107 // 100 + HLS_AUDIO_KBPS) * 1000
+        lines.append(
+            f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},"
+            f"AVERAGE-BANDWIDTH={(kbps + HLS_AUDIO_KBPS) * 1000},"
+            f'RESOLUTION={width}x{height},CODECS="avc1.640028,mp4a.40.2"'
+        )
+        lines.append(f"{short}p.m3u8")
+    return "\n".join(lines) + "\n"
+
+
+def make_streams(payload: dict) -> dict:
+    """Job handler making a published MP4's HLS renditions and poster frame.
+
+    Like ``transcode``, everything is written to a partial directory that is
+    renamed into place, so players never see half a ladder. The poster is
+    best effort; without one the player shows the first frame.
+
+    Returns:
+        the master playlist, the poster and the video's upright size, as
+        recorded in a post's ``video_streams``.
+
+    Raises:
+        RuntimeError: if a rendition fails, so the job is retried.
+    """
+    source = payload["source"]
+    directory = streams_dir(source)
+    partial = os.path.join(
+        os.path.dirname(directory), ".streaming-" + os.path.basename(directory)
+    )
+    info = probe(source)
+    duration = duration_of(info)
+    size = display_size(info)
+
+    poster = poster_path(source)
+    at = min(1.0, duration / 2) if duration else 0.0
+    ok, error = _run_ffmpeg(poster_command(source, poster, at), poster, None, "poster")
+    if not ok:
+        logger.warning(f"Couldn't take a poster frame from {source}: {error}")
+        poster = None
+
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    try:
+        renditions = []
+        for short, kbps in ladder_for(size):
+            command = rendition_command(source, partial, short, kbps)
+            ok, error = _run_ffmpeg(command, command[-1], duration, f"{short}p")
+            if not ok:
+                raise RuntimeError(error)
+            renditions.append((short, kbps, _scaled(size or (16, 9), short)))
+        with open(os.path.join(partial, "master.m3u8"), "w") as f:
+            f.write(master_playlist(renditions))
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(partial, directory)
+    finally:
+        shutil.rmtree(partial, ignore_errors=True)
+    logger.info(f"Made {len(renditions)} renditions of {source}")
+    width, height = size or (None, None)
+    return {
+        "playlist": os.path.join(directory, "master.m3u8"),
+        "poster": poster,
+        "width": width,
+        "height": height,
+    }
+
+
+def queue_streams(db, payload: dict, result: dict) -> None:
+    """Finisher for a video job: queues its streams once the MP4 exists."""
+    if payload.get("post") and VIDEO_STREAMING:
+        job_queue.enqueue(
+            db,
+            "streams",
+            {"source": result["output"], "post": payload["post"]},
+            target=os.path.join(streams_dir(result["output"]), "master.m3u8"),
+        )
+
+
+job_queue.register(
+    "video", transcode, queue_streams, limit=VIDEO_ENCODERS, group="ffmpeg"
+)
+
+
+def convert_video_to_mp4(
+    db,
+    input_path: str,
+    output_path: str,
+    post: Optional[str] = None,
+) -> str:
+    """Transcodes an uploaded video to ``output_path``, never in the request.
+
+    With a database to queue on, the video becomes a job and the caller
+    commits; it is run by ``flask media-worker``, or by the site itself (see
+    ``job_queue.run_in_thread``). Until it finishes, requests for
+    ``output_path`` are answered with the upload itself. Without a database
+    the video is transcoded in a thread, and a failure is only logged.
+
+    Args:
+        post: the post the video is published in. With VideoStreaming on,
+            a queued video is followed by a ``streams`` job for it.
+
+    Returns:
+        the path the video will be at.
+    """
+    payload = {"source": input_path, "output": output_path}
+    if post:
+        payload["post"] = post
+    if db is not None:
+        job_queue.enqueue(db, "video", payload, target=output_path)
+        return output_path
+    threading.Thread(target=_transcode_quietly, args=(payload,), daemon=True).start()
     return output_path
+
+
+def _transcode_quietly(payload: dict) -> None:
+    try:
+        transcode(payload)
+    except Exception:
+        logger.exception(f"Couldn't transcode {payload['source']}")
+
+
+def conversion_status(db, output_path: str) -> Optional[str]:
+    """Where the video for ``output_path`` is up to, as seen by any worker.
+
+    Returns:
+        pending, running or failed while it has a job, done once the file
+        exists, and None for a video that was never queued.
+    """
+    job = job_queue.pending_job(db, output_path)
+    if job is not None:
+        return job[1]
+    return "done" if os.path.exists(output_path) else None
+
+
+def conversion_progress(db, output_path: str) -> Optional[dict]:
+    """How far the video for ``output_path`` has got: percent, fps and eta."""
+    return job_queue.progress(db, output_path)
+
+
+def conversion_method(db, output_path: str) -> Optional[str]:
+    """How a queued video was made, remux or encode, once it's done."""
+    result = job_queue.last_result(db, output_path)
+    return result.get("method") if isinstance(result, dict) else None
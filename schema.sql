@@ -3,7 +3,8 @@ create table entries (
   id integer primary key autoincrement,
   slug text not null,
   published date not null,
-  location text not null
+  location text not null,
+  summary_json text -- EntrySummary of the post, for list views
 );
 
 drop table if exists categories;
@@ -13,4 +14,112 @@ create table categories(
   published date not null,
   category text not null,
   FOREIGN KEY (slug) REFERENCES entries(slug)
-);
\ No newline at end of file
+);
+
+create index if not exists entries_published on entries(published);
+create index if not exists entries_slug_published on entries(slug, published);
+create index if not exists categories_category_published on categories(category, published);
+create index if not exists categories_slug_published on categories(slug, published);
+
+-- per-tag usage counts, kept in step with categories by the triggers below
+drop table if exists tag_counts;
+create table tag_counts(
+  category text primary key,
+  count integer not null
+);
+create index tag_counts_count on tag_counts(count);
+
+create trigger if not exists categories_count_insert after insert on categories
+begin
+  insert into tag_counts (category, count) values (new.category, 1)
+  on conflict(category) do update set count = count + 1;
+end;
+
+create trigger if not exists categories_count_delete after delete on categories
+begin
+  update tag_counts set count = count - 1 where category = old.category;
+  delete from tag_counts where category = old.category and count <= 0;
+end;
+
+drop table if exists geo_points;
+create table geo_points(
+  id integer primary key autoincrement,
+  slug text not null,
+  published date not null,
+  lat real not null,
+  lon real not null,
+  kind text not null, -- 'post' for an entry's geo, 'trip' for a travel stop
+  trip_date date,
+  FOREIGN KEY (slug) REFERENCES entries(slug)
+);
+create index geo_points_published on geo_points(published);
+create index geo_points_slug on geo_points(slug, published);
+
+-- background work (e.g. photo processing), drained by `flask media-worker`
+drop table if exists jobs;
+create table jobs(
+  id integer primary key autoincrement,
+  kind text not null,
+  payload text not null, -- json arguments for the job's handler
+  target text, -- the file the job produces, if any
+  status text not null default 'pending', -- pending, running, done, failed
+  attempts integer not null default 0,
+  max_attempts integer not null default 3,
+  error text,
+  result text, -- json of what the handler returned, once done
+  progress text, -- json the handler last reported while running
+  run_after text not null,
+  created text not null,
+  updated text not null
+);
+create index jobs_status on jobs(status, run_after);
+create index jobs_target on jobs(target);
+
+-- photos in the content-addressed media store, by sha256 of the uploaded file
+drop table if exists media;
+create table media(
+  hash text primary key,
+  refs integer not null default 0, -- posts using it, kept in step with media_refs by the triggers below
+  variants_json text, -- the web copy's responsive variants, once processed
+  created text not null
+);
+
+drop table if exists media_refs;
+create table media_refs(
+  hash text not null,
+  post text not null, -- the json file of the post or draft using it
+  primary key (hash, post)
+);
+create index media_refs_post on media_refs(post);
+
+-- where photos lived before `flask migrate-media` moved them into the store
+drop table if exists media_aliases;
+create table media_aliases(
+  path text primary key,
+  hash text not null
+);
+
+create trigger if not exists media_refs_insert after insert on media_refs
+begin
+  update media set refs = refs + 1 where hash = new.hash;
+end;
+
+create trigger if not exists media_refs_delete after delete on media_refs
+begin
+  update media set refs = refs - 1 where hash = old.hash;
+end;
+
+-- metadata read from each photo's header, so pages never have to open images
+drop table if exists photos;
+create table photos(
+  path text primary key,
+  width integer not null, -- upright, after the EXIF orientation
+  height integer not null,
+  orientation integer not null default 1,
+  taken text, -- EXIF capture time, ISO 8601 local time
+  lat real,
+  lon real,
+  bytes integer not null,
+  mtime integer not null -- nanoseconds; a row is stale once size or mtime change
+);
+create index photos_taken on photos(taken);
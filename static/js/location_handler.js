@@ -58,27 +58,43 @@ async function getCurrentLocation() {
             navigator.geolocation.getCurrentPosition(resolve, reject);
         });
 
-        const lat = position.coords.latitude;
-        const lng = position.coords.longitude;
-        const coordinates = `${lat},${lng}`;
-
-        // Get place name from coordinates
-        const response = await fetch(
-            `https://nominatim.openstreetmap.org/reverse?format=json&lat=${lat}&lon=${lng}`,
-            { headers: { 'User-Agent': 'YourWebsite/1.0' } }
-        );
-        const data = await response.json();
-
-        if (data.display_name) {
-            const locationInput = document.getElementById('location_input');
-            locationInput.value = data.display_name;
-            updateLocationData(data.display_name, coordinates);
-        }
+        await setLocationFromCoordinates(position.coords.latitude, position.coords.longitude);
     } catch (error) {
         console.error('Error getting location:', error);
     }
 }
 
+// Name the place at lat, lng and make it the post's location
+async function setLocationFromCoordinates(lat, lng) {
+    const response = await fetch(
+        `https://nominatim.openstreetmap.org/reverse?format=json&lat=${lat}&lon=${lng}`,
+        { headers: { 'User-Agent': 'YourWebsite/1.0' } }
+    );
+    const data = await response.json();
+
+    if (data.display_name) {
+        const locationInput = document.getElementById('location_input');
+        locationInput.value = data.display_name;
+        updateLocationData(data.display_name, `${lat},${lng}`);
+    }
+}
+
+// Set when a place is picked by hand, which photos then leave alone
+let locationChosen = false;
+
+// Suggest the position of a geotagged photo from the upload tray as the
+// post's location; the tray marks them with data-geo="lat,lon"
+async function suggestPhotoLocation(element) {
+    const geo = element && element.dataset.geo;
+    if (!geo || locationChosen || !document.getElementById('geo_coordinates')) return;
+    const [lat, lng] = geo.split(',');
+    try {
+        await setLocationFromCoordinates(lat, lng);
+    } catch (error) {
+        console.error('Error naming photo location:', error);
+    }
+}
+
 // Initialize location functionality
 document.addEventListener('DOMContentLoaded', function () {
     const locationInput = document.getElementById('location_input');
@@ -151,6 +167,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
                             itemDiv.addEventListener("click", () => {
                                 locationInput.value = place.display_name;
+                                locationChosen = true;
                                 updateLocationData(place.display_name, `${place.lat},${place.lon}`);
                                 closeAllLists();
 
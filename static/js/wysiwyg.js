@@ -227,6 +227,7 @@ function initializePreviews() {
                 previewContainer.appendChild(video);
                 previewContainer.appendChild(deleteButton);
                 mediaPreviewGrid.appendChild(previewContainer);
+                watchVideoStatus(videoPath, video, previewContainer);
             });
         }
 
@@ -556,3 +557,37 @@ style.textContent = `
 `;
 document.head.appendChild(style);
 
+// Shows how far a video's transcode has got, polling until the mp4 exists
+async function watchVideoStatus(videoPath, video, container) {
+    const label = document.createElement('small');
+    label.className = 'text-muted video-status';
+    container.appendChild(label);
+
+    while (true) {
+        let state;
+        try {
+            const response = await fetch('/video_status/' + videoPath);
+            if (!response.ok) break;
+            state = await response.json();
+        } catch (error) {
+            console.error('Error checking video status:', error);
+            break;
+        }
+        if (state.status === 'done') {
+            if (label.textContent) {
+                video.src = state.url; // the finished mp4, fingerprinted by its mtime
+            }
+            break;
+        }
+        if (state.status === 'failed') {
+            label.textContent = 'Transcoding failed';
+            break;
+        }
+        const progress = state.progress || {};
+        label.textContent = progress.percent == null
+            ? 'Waiting to transcode…'
+            : `Transcoding ${progress.percent}%` + (progress.eta ? `, about ${Math.ceil(progress.eta / 60)} min left` : '');
+        await new Promise(resolve => setTimeout(resolve, 3000));
+    }
+    if (!label.textContent.startsWith('Transcoding failed')) label.remove();
+}
@@ -1,8 +1,11 @@
+import json
+import os
 import pytest
 import sqlite3
 from unittest.mock import patch
 from flask import g
-from kongaloosh import app as flask_app, init_db
+import kongaloosh
+from kongaloosh import app as flask_app, db_pool, init_db
 
 
 @pytest.fixture
@@ -15,6 +18,20 @@ def app():
     return flask_app
 
 
+@pytest.fixture(autouse=True)
+def fresh_db_pool():
+    """Each test's requests take connections from whichever connect_db it patches"""
+    db_pool.close_all()
+    yield
+    db_pool.close_all()
+
+
+@pytest.fixture(autouse=True)
+def no_media_thread(monkeypatch):
+    """Tests run queued media themselves, with job_queue.run_worker"""
+    monkeypatch.setattr(kongaloosh, "MEDIA_WORKER", "external")
+
+
 @pytest.fixture
 def db():
     """Create an in-memory test database"""
@@ -42,3 +59,61 @@ def client(app, db):
 def runner(app):
     """Create a test CLI runner"""
     return app.test_cli_runner()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Create a database file initialised from schema.sql"""
+    path = str(tmp_path / "test.db")
+    conn = sqlite3.connect(path)
+    with flask_app.open_resource("schema.sql", mode="r") as f:
+        conn.executescript(f.read())
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def file_client(app, db_path):
+    """Create a test client where every request opens its own connection to db_path"""
+    with patch("kongaloosh.connect_db", side_effect=lambda: sqlite3.connect(db_path)):
+        with app.test_client() as client:
+            yield client
+
+
+@pytest.fixture
+def make_post(tmp_path, db_path):
+    """Write a post's JSON to disk and register it in the entries table"""
+
+    def _make_post(slug, published, category=None, directory=None, **fields):
+        directory = directory or str(tmp_path)
+        os.makedirs(directory, exist_ok=True)
+        location = os.path.join(directory, slug)
+        data = {
+            "title": slug.replace("-", " ").title(),
+            "content": f"Content of {slug}",
+            "published": published.isoformat(),
+            "slug": slug,
+            "url": f"/e/{published.year}/{published.month}/{published.day}/{slug}",
+            "u_uid": f"uuid-{slug}",
+            "category": category,
+        }
+        data.update(fields)
+        with open(location + ".json", "w") as f:
+            json.dump(data, f)
+
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "INSERT INTO entries (slug, published, location) VALUES (?, ?, ?)",
+            (slug, published, location),
+        )
+        for c in category or []:
+            conn.execute(
+                "INSERT INTO categories (slug, published, category) VALUES (?, ?, ?)",
+                (slug, published, c),
+            )
+        conn.commit()
+        conn.close()
+        return location
+
+    return _make_post
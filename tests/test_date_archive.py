@@ -0,0 +1,79 @@
+import json
+import pytest
+from datetime import datetime
+from kongaloosh import date_range
+from pysrc.database.queries import EntryQueries, CategoryQueries
+
+
+def query_plan(db, query, params):
+    return [row[3] for row in db.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+@pytest.fixture
+def archive(make_post):
+    make_post("end-of-february", datetime(2024, 2, 29, 23, 59, 59))
+    make_post("start-of-march", datetime(2024, 3, 1, 0, 0, 0), category=["python"])
+    make_post("end-of-march", datetime(2024, 3, 31, 23, 59, 59, 999999))
+    make_post("start-of-april", datetime(2024, 4, 1, 0, 0, 0), category=["python"])
+    make_post("new-year", datetime(2025, 1, 1, 8, 0, 0))
+
+
+def test_date_range():
+    assert date_range(2024) == ("2024-01-01", "2025-01-01")
+    assert date_range("2024", "12") == ("2024-12-01", "2025-01-01")
+    assert date_range("2024", "2", "29") == ("2024-02-29", "2024-03-01")
+    with pytest.raises(ValueError):
+        date_range("2023", "2", "29")
+
+
+def test_month_archive_is_half_open(file_client, archive):
+    response = file_client.get("/e/2024/3/", headers={"Accept": "application/json"})
+    slugs = [entry["slug"] for entry in json.loads(response.data)]
+
+    assert slugs == ["end-of-march", "start-of-march"]
+
+
+def test_year_and_day_archives(file_client, archive):
+    year = file_client.get("/e/2024/", headers={"Accept": "application/json"})
+    assert len(json.loads(year.data)) == 4
+
+    day = file_client.get("/e/2024/2/29/", headers={"Accept": "application/json"})
+    assert [e["slug"] for e in json.loads(day.data)] == ["end-of-february"]
+
+
+def test_impossible_date_is_404(file_client, archive):
+    assert file_client.get("/e/2024/13/").status_code == 404
+
+
+def test_tag_archive_filters_by_date(file_client, archive):
+    response = file_client.get(
+        "/t/python?y=2024&m=4", headers={"Accept": "application/json"}
+    )
+    assert [e["slug"] for e in json.loads(response.data)] == ["start-of-april"]
+
+
+def test_date_query_uses_index(db):
+    plan = query_plan(db, EntryQueries.SELECT_BY_DATE, ("2024-03-01", "2024-04-01"))
+
+    assert plan == [
+        "SEARCH entries USING INDEX entries_published (published>? AND published<?)"
+    ]
+
+
+def test_page_queries_use_index(db):
+    page = query_plan(db, EntryQueries.SELECT_PAGE, (11, 0))
+    assert page == ["SCAN entries USING INDEX entries_published"]
+
+    before = query_plan(db, EntryQueries.SELECT_PAGE_BEFORE, ("2024-03-01", 5, 11))
+    assert any("USING INDEX entries_published" in step for step in before)
+    assert not any("TEMP B-TREE" in step for step in before)
+
+
+def test_category_query_uses_indexes(db):
+    plan = query_plan(db, CategoryQueries.SELECT_BY_CATEGORY, ("python",))
+
+    assert plan[0].startswith(
+        "SEARCH categories USING INDEX categories_category_published"
+    )
+    assert plan[1].startswith("SEARCH entries USING INDEX entries_slug_published")
+    assert not any("TEMP B-TREE" in step for step in plan)
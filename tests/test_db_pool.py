@@ -0,0 +1,70 @@
+import threading
+from unittest.mock import patch
+from flask import g
+from kongaloosh import db_pool
+from pysrc.database import connections
+from pysrc.database.connections import ConnectionPool
+
+
+def test_connections_use_wal_and_the_tuned_pragmas(db_path):
+    db = connections.connect(db_path)
+
+    assert db.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    assert db.execute("PRAGMA synchronous").fetchone() == (1,)  # NORMAL
+    assert db.execute("PRAGMA cache_size").fetchone() == (-connections.CACHE_KIB,)
+    db.close()
+
+
+def test_each_thread_keeps_its_own_connection(db_path):
+    pool = ConnectionPool(lambda: connections.connect(db_path))
+    mine = pool.connection()
+    theirs = []
+    thread = threading.Thread(target=lambda: theirs.append(pool.connection()))
+    thread.start()
+    thread.join()
+
+    assert pool.connection() is mine
+    assert theirs[0] is not mine
+    assert len(pool) == 2
+
+    # the exited thread's connection goes when the next one is opened
+    other = threading.Thread(target=pool.connection)
+    other.start()
+    other.join()
+    assert len(pool) == 2
+    assert pool.stats()["closed"] == 1
+    pool.close_all()
+
+
+def test_requests_share_a_connection_and_static_files_take_none(file_client):
+    opened = db_pool.stats()["opened"]
+    file_client.get("/")
+    file_client.get("/")
+    assert db_pool.stats()["opened"] == opened + 1
+
+    with patch.object(db_pool, "connection") as connection:
+        file_client.get("/static/css/clean-blog.css")
+        assert not connection.called
+
+
+def test_uncommitted_writes_are_rolled_back_after_the_request(file_client, app):
+    with app.test_request_context():
+        g.db.execute(
+            "INSERT INTO categories (slug, published, category) "
+            "VALUES ('a', '2024-01-01', 'left')"
+        )
+
+    db = db_pool.connection()
+    assert not db.in_transaction
+    assert db.execute("SELECT COUNT(*) FROM categories").fetchone() == (0,)
+
+
+def test_pool_stats_are_in_diagnostics(file_client):
+    with file_client.session_transaction() as sess:
+        sess["logged_in"] = True
+    file_client.get("/")
+
+    stats = file_client.get("/diagnostics").get_json()["db_pool"]
+
+    assert stats["size"] == 1 and stats["opened"] >= 1
+    assert stats["mean_connect_ms"] >= 0
@@ -0,0 +1,134 @@
+import os
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from pysrc.file_management import derivatives, file_parser
+from pysrc.file_management.derivatives import Derivative, sized_path, write_derivatives
+from pysrc.file_management.file_parser import move_and_resize
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = str(tmp_path / "upload.png")
+    Image.new("RGBA", (1600, 1200), (255, 0, 0, 0)).save(path)
+    return path
+
+
+def test_every_size_from_one_decode(photo, tmp_path):
+    outputs = [
+        Derivative(str(tmp_path / "small.jpg"), 400),
+        Derivative(str(tmp_path / "full.jpg"), None, quality=95),
+        Derivative(str(tmp_path / "web.jpg"), 800),
+    ]
+
+    with patch.object(derivatives.Image, "open", wraps=Image.open) as opened:
+        written = write_derivatives(photo, outputs)
+
+    assert opened.call_count == 1
+    assert [os.path.basename(p) for p in written] == ["full.jpg", "web.jpg", "small.jpg"]
+    sizes = {os.path.basename(p): Image.open(p).size for p in written}
+    assert sizes == {
+        "full.jpg": (1600, 1200),
+        "web.jpg": (800, 600),
+        "small.jpg": (400, 300),
+    }
+
+
+def test_transparency_is_flattened_onto_white(photo, tmp_path):
+    (path,) = write_derivatives(photo, [Derivative(str(tmp_path / "out.jpg"), 100)])
+
+    with Image.open(path) as img:
+        assert img.mode == "RGB"
+        assert all(channel > 250 for channel in img.getpixel((50, 30)))
+
+
+def test_failed_save_leaves_nothing_behind(photo, tmp_path):
+    target = tmp_path / "out" / "web.jpg"
+
+    with patch.object(Image.Image, "save", side_effect=OSError("disk full")):
+        with pytest.raises(OSError):
+            write_derivatives(photo, [Derivative(str(target), 800)])
+
+    assert os.listdir(tmp_path / "out") == []
+
+
+def test_move_and_resize_writes_variants(photo, tmp_path, monkeypatch):
+    monkeypatch.setattr(file_parser, "RESPONSIVE_WIDTHS", [320, 800, 2000])
+    web = str(tmp_path / "data" / "post-0.jpg")
+    high_res = str(tmp_path / "photos" / "post-0.jpg")
+
+    variants = move_and_resize(photo, web, high_res)
+
+    assert Image.open(high_res).size == (1600, 1200)
+    assert Image.open(web).size == (800, 600)
+    assert Image.open(sized_path(web, 320, "webp")).size == (320, 240)
+    assert sized_path(web, 320).endswith("post-0-320w.jpg")
+
+    described = {(v.path, v.width, v.height, v.type) for v in variants}
+    assert (web, 800, 600, "image/jpeg") in described
+    assert (sized_path(web, 320), 320, 240, "image/jpeg") in described
+    assert (sized_path(web, 800, "webp"), 800, 600, "image/webp") in described
+    # the web copy is the 800px JPEG and nothing is upscaled to 2000px
+    assert not os.path.exists(sized_path(web, 800))
+    assert not any(v.width > 1600 for v in variants)
+    assert high_res not in {v.path for v in variants}
+
+
+# how to store an upright photo so that each EXIF orientation turns it back
+STORED_AS = {
+    1: None,
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_90,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_270,
+}
+
+
+@pytest.mark.parametrize("orientation", sorted(STORED_AS))
+def test_every_exif_orientation_is_applied(orientation, tmp_path):
+    upright = Image.new("RGB", (400, 200), "blue")
+    upright.paste("red", (0, 0, 100, 100))
+    method = STORED_AS[orientation]
+    stored = upright if method is None else upright.transpose(method)
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    source = str(tmp_path / "camera.jpg")
+    stored.save(source, exif=exif, quality=95)
+
+    (path,) = write_derivatives(source, [Derivative(str(tmp_path / "out.jpg"), 200)])
+
+    with Image.open(path) as img:
+        assert img.size == (200, 100)
+        assert "exif" not in img.info or Image.Exif().load(img.info["exif"]) is None
+        red, green, blue = img.getpixel((10, 10))
+        assert red > 200 and blue < 60
+        red, green, blue = img.getpixel((190, 90))
+        assert blue > 200 and red < 60
+
+
+def test_upload_is_stored_byte_for_byte(file_client, tmp_path, monkeypatch):
+    import io
+    import kongaloosh
+
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(kongaloosh.BULK_UPLOAD_DIR)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 32), "red").save(buffer, "JPEG", exif=exif)
+    original = buffer.getvalue()
+
+    with file_client.session_transaction() as sess:
+        sess["logged_in"] = True
+    file_client.post(
+        "/bulk_upload",
+        data={"file": (io.BytesIO(original), "camera.jpg")},
+        content_type="multipart/form-data",
+    )
+
+    (name,) = [n for n in os.listdir(kongaloosh.BULK_UPLOAD_DIR)]
+    with open(os.path.join(kongaloosh.BULK_UPLOAD_DIR, name), "rb") as f:
+        assert f.read() == original
@@ -0,0 +1,90 @@
+import json
+import os
+import pytest
+from pysrc.cache import LRUCache
+from pysrc.file_management import file_parser
+from pysrc.file_management.file_parser import file_parser_json, invalidate_entry
+
+
+@pytest.fixture
+def entry_file(tmp_path):
+    """Write a minimal post to disk and return its path"""
+    path = tmp_path / "cached-entry.json"
+    path.write_text(
+        json.dumps(
+            {
+                "title": "Cached Entry",
+                "content": "Some *markdown*",
+                "published": "2024-03-01T12:00:00",
+                "slug": "cached-entry",
+                "url": "/e/2024/3/1/cached-entry",
+                "u_uid": "uuid-cached",
+            }
+        )
+    )
+    file_parser.entry_cache.clear()
+    yield str(path)
+    file_parser.entry_cache.clear()
+
+
+def test_second_parse_is_a_hit(entry_file):
+    first = file_parser_json(entry_file)
+    second = file_parser_json(entry_file)
+
+    assert first.content == second.content
+    assert "<em>markdown</em>" in second.content
+    assert file_parser.entry_cache.hits == 1
+    assert file_parser.entry_cache.misses == 1
+
+
+def test_md_flag_is_part_of_the_key(entry_file):
+    rendered = file_parser_json(entry_file)
+    raw = file_parser_json(entry_file, md=False)
+
+    assert "<em>" in rendered.content
+    assert raw.content == "Some *markdown*"
+    assert file_parser.entry_cache.misses == 2
+
+
+def test_rewrite_changes_key(entry_file):
+    file_parser_json(entry_file)
+    with open(entry_file) as f:
+        data = json.load(f)
+    data["title"] = "Edited Entry With A Longer Title"
+    with open(entry_file, "w") as f:
+        json.dump(data, f)
+
+    assert file_parser_json(entry_file).title == "Edited Entry With A Longer Title"
+
+
+def test_invalidate_drops_entry(entry_file):
+    file_parser_json(entry_file)
+    assert len(file_parser.entry_cache) == 1
+
+    invalidate_entry(entry_file)
+    assert len(file_parser.entry_cache) == 0
+
+
+def test_callers_get_independent_copies(entry_file):
+    first = file_parser_json(entry_file)
+    first.title = "mutated"
+
+    assert file_parser_json(entry_file).title == "Cached Entry"
+
+
+def test_missing_file_is_not_cached(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        file_parser_json(os.path.join(tmp_path, "nope.json"))
+
+
+def test_lru_evicts_oldest():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,117 @@
+import os
+import pytest
+import sqlite3
+from datetime import datetime
+from unittest.mock import patch
+from pysrc.file_management.file_parser import (
+    backfill_entry_summaries,
+    store_entry_summary,
+)
+from pysrc.post import EntrySummary
+
+
+@pytest.fixture
+def summarised(make_post, db_path):
+    """Two tagged posts with their summaries stored"""
+    locations = [
+        make_post(
+            "first-post",
+            datetime(2024, 3, 1, 12, 0, 0),
+            category=["python"],
+            content="Hello *world*",
+            geo={"coordinates": [53.54, -113.49], "name": "Edmonton"},
+        ),
+        make_post(
+            "second-post",
+            datetime(2024, 3, 2, 12, 0, 0),
+            category=["python", "article"],
+            photo=["data/2024/3/2/second-post-0.jpg"],
+        ),
+    ]
+    db = sqlite3.connect(db_path)
+    for location in locations:
+        store_entry_summary(db, location)
+    db.commit()
+    db.close()
+    return locations
+
+
+def test_summary_holds_rendered_content(summarised, db_path):
+    db = sqlite3.connect(db_path)
+    (summary_json,) = db.execute(
+        "SELECT summary_json FROM entries WHERE slug = 'first-post'"
+    ).fetchone()
+
+    summary = EntrySummary.model_validate_json(summary_json)
+    assert summary.content == "<p>Hello <em>world</em></p>"
+    assert summary.geo.name == "Edmonton"
+    assert summary.url == "/e/2024/3/1/first-post"
+
+
+def test_tag_page_renders_without_files(file_client, summarised):
+    for location in summarised:
+        os.remove(location + ".json")
+
+    with patch("kongaloosh.file_parser_json", side_effect=AssertionError("parsed")):
+        response = file_client.get("/t/python")
+
+    assert response.status_code == 200
+    assert b"<p>Hello <em>world</em></p>" in response.data
+    assert b"/data/2024/3/2/second-post-0.jpg" in response.data
+
+
+def test_rows_without_summary_fall_back(file_client, make_post):
+    make_post("legacy-post", datetime(2024, 1, 1), category=["python"])
+
+    response = file_client.get("/t/python")
+    assert b"Content of legacy-post" in response.data
+
+
+def test_backfill_adds_column(make_post, tmp_path):
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        create table entries (
+          id integer primary key autoincrement,
+          slug text not null,
+          published date not null,
+          location text not null
+        );
+        """
+    )
+    location = make_post("old-post", datetime(2020, 5, 5))
+    db.execute(
+        "INSERT INTO entries (slug, published, location) VALUES (?, ?, ?)",
+        ("old-post", datetime(2020, 5, 5), location),
+    )
+    db.commit()
+
+    assert backfill_entry_summaries(db) == 1
+    (summary_json,) = db.execute("SELECT summary_json FROM entries").fetchone()
+    assert EntrySummary.model_validate_json(summary_json).slug == "old-post"
+
+
+def test_upgrade_db_adds_column(runner, tmp_path, app, monkeypatch):
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.executescript(
+        """
+        create table entries (
+          id integer primary key autoincrement,
+          slug text not null,
+          published date not null,
+          location text not null
+        );
+        create table categories (slug text, published date, category text);
+        """
+    )
+    db.close()
+    monkeypatch.setitem(app.config, "DATABASE", path)
+
+    assert runner.invoke(args=["upgrade-db"]).exit_code == 0
+    assert runner.invoke(args=["upgrade-db"]).exit_code == 0  # and again
+
+    db = sqlite3.connect(path)
+    columns = [row[1] for row in db.execute("PRAGMA table_info(entries)")]
+    assert "summary_json" in columns
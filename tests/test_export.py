@@ -0,0 +1,100 @@
+import os
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+import kongaloosh
+from pysrc.export import MANIFEST_NAME, export_site, page_path
+
+
+@pytest.fixture
+def site(file_client, make_post, tmp_path, monkeypatch):
+    """Two posts stored under a blog directory, exported with no mentions"""
+    storage = str(tmp_path / "data")
+    monkeypatch.setattr(kongaloosh, "BLOG_STORAGE", storage)
+    first = make_post(
+        "first-post",
+        datetime(2024, 3, 1, 12, 0, 0),
+        category=["python"],
+        directory=os.path.join(storage, "2024/3/1"),
+    )
+    second = make_post(
+        "second-post",
+        datetime(2024, 3, 2, 12, 0, 0),
+        category=["travel"],
+        directory=os.path.join(storage, "2024/3/2"),
+    )
+    with patch("kongaloosh.get_mentions", return_value=([], [], [])):
+        yield {"first": first, "second": second, "output": str(tmp_path / "build")}
+
+
+def test_page_path():
+    assert page_path("build", "/") == os.path.join("build", "", "index.html")
+    assert page_path("build", "/rss.xml") == os.path.join("build", "rss.xml")
+    assert page_path("build", "/e/2024/3/1/post") == os.path.join(
+        "build", "e/2024/3/1/post", "index.html"
+    )
+
+
+def test_export_writes_every_page(site):
+    result = export_site(site["output"], workers=0)
+
+    assert not result.failed
+    for url in ("/", "/t/", "/t/python", "/e/2024/3/", "/e/2024/3/1/first-post"):
+        assert url in result.rendered
+        assert os.path.exists(page_path(site["output"], url))
+    assert os.path.exists(os.path.join(site["output"], MANIFEST_NAME))
+
+    with open(page_path(site["output"], "/e/2024/3/1/first-post")) as f:
+        assert "Content of first-post" in f.read()
+
+
+def test_second_run_renders_nothing(site):
+    export_site(site["output"], workers=0)
+
+    assert export_site(site["output"], workers=0).rendered == []
+
+
+def test_edit_renders_only_affected_pages(site):
+    export_site(site["output"], workers=0)
+
+    with open(site["first"] + ".json") as f:
+        data = f.read()
+    with open(site["first"] + ".json", "w") as f:
+        f.write(data.replace("Content of first-post", "Edited first-post"))
+
+    rendered = set(export_site(site["output"], workers=0).rendered)
+
+    assert "/e/2024/3/1/first-post" in rendered
+    assert "/t/python" in rendered
+    assert {"/", "/t/"} <= rendered
+    assert "/e/2024/3/2/second-post" not in rendered
+    assert "/t/travel" not in rendered
+    assert "/e/2024/3/2/" not in rendered
+
+
+def test_full_export_ignores_manifest(site):
+    first = export_site(site["output"], workers=0)
+
+    assert export_site(site["output"], full=True, workers=0).rendered == first.rendered
+
+
+def test_deleted_post_pages_are_removed(site):
+    export_site(site["output"], workers=0)
+    os.remove(site["second"] + ".json")
+
+    result = export_site(site["output"], workers=0)
+
+    assert "/e/2024/3/2/second-post" in result.removed
+    assert not os.path.exists(page_path(site["output"], "/e/2024/3/2/second-post"))
+    assert os.path.exists(page_path(site["output"], "/e/2024/3/1/first-post"))
+
+
+def test_pool_is_shut_down_when_rendering_fails(site):
+    with patch("pysrc.export.ProcessPoolExecutor") as pool_class:
+        pool = pool_class.return_value
+        pool.map.return_value = iter([("/", 200, b"ok")])
+        with patch("pysrc.export.write_atomically", side_effect=OSError("full")):
+            with pytest.raises(OSError):
+                export_site(site["output"], workers=2)
+
+    pool.shutdown.assert_called_once_with(cancel_futures=True)
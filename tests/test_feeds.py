@@ -0,0 +1,65 @@
+import json
+import os
+import pytest
+from datetime import datetime, timedelta
+from kongaloosh import feed_cache, FEED_LENGTH
+
+
+@pytest.fixture
+def posts(make_post):
+    """Fifteen posts, one per day, newest last"""
+    feed_cache.clear()
+    start = datetime(2024, 3, 1, 12, 0, 0)
+    locations = [
+        make_post(f"post-{i}", start + timedelta(days=i)) for i in range(15)
+    ]
+    yield locations
+    feed_cache.clear()
+
+
+def test_json_feed_is_bounded(file_client, posts):
+    response = file_client.get("/json.feed")
+    assert response.status_code == 200
+
+    items = json.loads(response.data)["items"]
+    assert len(items) == FEED_LENGTH
+    assert items[0]["url"] == "/e/2024/3/15/post-14"
+    assert items[-1]["url"] == "/e/2024/3/6/post-5"
+
+
+def test_json_feed_empty(file_client):
+    feed_cache.clear()
+    response = file_client.get("/json.feed")
+    assert response.status_code == 404
+
+
+def test_feed_body_is_cached(file_client, posts):
+    first = file_client.get("/rss.xml")
+    second = file_client.get("/rss.xml")
+
+    assert first.data == second.data
+    assert b"Post 14" in first.data
+    assert b"Post 4" not in first.data
+    assert feed_cache.stats()["hits"] == 1
+
+
+def test_feed_regenerates_after_edit(file_client, posts):
+    file_client.get("/atom.xml")
+
+    with open(posts[-1] + ".json") as f:
+        data = json.load(f)
+    data["title"] = "A Freshly Edited Title"
+    with open(posts[-1] + ".json", "w") as f:
+        json.dump(data, f)
+
+    response = file_client.get("/atom.xml")
+    assert b"A Freshly Edited Title" in response.data
+    assert feed_cache.stats()["hits"] == 0
+
+
+def test_feed_skips_missing_files(file_client, posts):
+    os.remove(posts[-1] + ".json")
+    items = json.loads(file_client.get("/json.feed").data)["items"]
+
+    assert len(items) == FEED_LENGTH
+    assert items[0]["url"] == "/e/2024/3/14/post-13"
@@ -0,0 +1,88 @@
+import pytest
+import sqlite3
+from datetime import datetime
+from unittest.mock import patch
+from pysrc.file_management.file_parser import backfill_geo_points, index_geo_points
+from pysrc.post import BlogPost, GeoLocation, Travel, Trip
+
+
+@pytest.fixture
+def geo_posts(make_post):
+    """A post with a location, a post with a trip and a post with neither"""
+    make_post(
+        "in-edmonton",
+        datetime(2024, 3, 1, 12, 0, 0),
+        geo={"coordinates": [53.54, -113.49], "name": "Edmonton"},
+    )
+    make_post(
+        "a-trip",
+        datetime(2024, 3, 2, 12, 0, 0),
+        travel={
+            "trips": [
+                {
+                    "location": {"coordinates": [51.04, -114.07], "name": "Calgary"},
+                    "date": "2024-03-02T08:00:00",
+                },
+                {
+                    "location": {"coordinates": [49.28, -123.12], "name": "Vancouver"},
+                    "date": "2024-03-03T08:00:00",
+                },
+            ]
+        },
+    )
+    make_post("nowhere", datetime(2024, 3, 3, 12, 0, 0))
+
+
+def test_backfill_indexes_posts_and_trips(geo_posts, db_path):
+    db = sqlite3.connect(db_path)
+    assert backfill_geo_points(db) == 3
+
+    rows = db.execute(
+        "SELECT slug, lat, lon, kind FROM geo_points ORDER BY published, id"
+    ).fetchall()
+    assert rows == [
+        ("in-edmonton", 53.54, -113.49, "post"),
+        ("a-trip", 51.04, -114.07, "trip"),
+        ("a-trip", 49.28, -123.12, "trip"),
+    ]
+
+
+def test_backfill_creates_missing_table(geo_posts, db_path):
+    db = sqlite3.connect(db_path)
+    db.execute("DROP TABLE geo_points")
+
+    backfill_geo_points(db)
+    assert db.execute("SELECT COUNT(*) FROM geo_points").fetchone()[0] == 3
+
+
+def test_reindex_replaces_rows(db):
+    published = datetime(2024, 3, 1, 12, 0, 0)
+    post = BlogPost(
+        content="",
+        slug="moving",
+        url="/e/2024/3/1/moving",
+        u_uid="uuid",
+        published=published,
+        geo=GeoLocation(coordinates=(10.0, 20.0)),
+    )
+    index_geo_points(db, post)
+
+    post.geo = GeoLocation(coordinates=(30.0, 40.0))
+    post.travel = Travel(
+        trips=[Trip(location=GeoLocation(coordinates=(1.0, 2.0)), date=published)]
+    )
+    index_geo_points(db, post)
+
+    rows = db.execute("SELECT lat, lon, kind FROM geo_points ORDER BY id").fetchall()
+    assert [tuple(r) for r in rows] == [(30.0, 40.0, "post"), (1.0, 2.0, "trip")]
+
+
+def test_map_reads_only_the_index(file_client, geo_posts, db_path):
+    backfill_geo_points(sqlite3.connect(db_path))
+
+    with patch("kongaloosh.file_parser_json", side_effect=AssertionError("parsed")):
+        response = file_client.get("/map")
+
+    assert response.status_code == 200
+    assert b"53.54,-113.49" in response.data
+    assert b"49.28,-123.12" in response.data
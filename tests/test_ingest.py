@@ -0,0 +1,103 @@
+import io
+import os
+import threading
+import pytest
+from PIL import Image
+import kongaloosh
+from pysrc.file_management import ingest as ingest_module
+from pysrc.file_management.file_parser import thumbnail_path
+from pysrc.file_management.ingest import ingest
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(kongaloosh.BULK_UPLOAD_DIR)
+    return kongaloosh.BULK_UPLOAD_DIR
+
+
+def jpeg(size=(640, 480), orientation=None) -> bytes:
+    buffer = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    Image.new("RGB", size, "green").save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def store(directory, name, data) -> tuple:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return name, path
+
+
+def test_photos_are_measured_upright_and_thumbnailed(upload_dir):
+    (result,) = ingest([store(upload_dir, "a.jpg", jpeg(orientation=6))])
+
+    assert result.ok and result.kind == "photo"
+    assert (result.width, result.height) == (480, 640)
+    assert result.thumbnail == thumbnail_path(result.path)
+    assert os.path.exists(result.thumbnail)
+
+
+def test_unusable_uploads_are_rejected_and_removed(upload_dir):
+    truncated = jpeg((1200, 900))[:2000]
+    results = ingest(
+        [
+            store(upload_dir, "notes.jpg", b"not an image"),
+            store(upload_dir, "cut-off.jpg", truncated),
+            store(upload_dir, "empty.mp4", b""),
+        ],
+        workers=0,
+    )
+
+    assert [r.ok for r in results] == [False, False, False]
+    assert all(r.error for r in results)
+    assert os.listdir(upload_dir) == []
+
+
+def test_videos_are_kept_without_decoding(upload_dir):
+    (result,) = ingest([store(upload_dir, "clip.MOV", b"\x00" * 64)])
+
+    assert result.ok and result.kind == "video"
+    assert result.thumbnail is None
+
+
+def test_batch_is_checked_on_the_pool_in_order(upload_dir, monkeypatch):
+    threads = set()
+    check_upload = ingest_module.check_upload
+
+    def recording(filename, path):
+        threads.add(threading.get_ident())
+        return check_upload(filename, path)
+
+    monkeypatch.setattr(ingest_module, "check_upload", recording)
+    stored = [store(upload_dir, f"{i}.jpg", jpeg()) for i in range(8)]
+    results = ingest(stored, workers=4)
+
+    assert [r.filename for r in results] == [name for name, _ in stored]
+    assert all(r.ok for r in results)
+    assert threading.get_ident() not in threads
+
+
+def test_bulk_upload_returns_a_manifest(file_client, upload_dir):
+    with file_client.session_transaction() as sess:
+        sess["logged_in"] = True
+    response = file_client.post(
+        "/bulk_upload",
+        data={
+            "file": [
+                (io.BytesIO(jpeg()), "good.jpg"),
+                (io.BytesIO(b"junk"), "bad.jpg"),
+            ]
+        },
+        content_type="multipart/form-data",
+    )
+
+    manifest = response.get_json()
+    assert [(r["filename"], r["ok"]) for r in manifest] == [
+        ("good.jpg", True),
+        ("bad.jpg", False),
+    ]
+    assert os.listdir(upload_dir) == [os.path.basename(manifest[0]["path"])]
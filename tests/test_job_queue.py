@@ -0,0 +1,143 @@
+import pytest
+import sqlite3
+import time
+from datetime import datetime
+from pysrc import job_queue
+from pysrc.database.queries import JobQueries
+
+results = []
+
+
+def double(payload):
+    return payload["n"] * 2
+
+
+def explode(payload):
+    raise RuntimeError("boom")
+
+
+def record(db, payload, result):
+    results.append(result)
+
+
+@pytest.fixture
+def queue_db(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    db = sqlite3.connect(path)
+    db.executescript(JobQueries.CREATE_TABLE)
+    job_queue.register("double", double, record)
+    job_queue.register("explode", explode)
+    results.clear()
+    yield path, db
+    db.close()
+
+
+def test_jobs_run_in_order(queue_db):
+    path, db = queue_db
+    for n in (1, 2, 3):
+        job_queue.enqueue(db, "double", {"n": n})
+    db.commit()
+
+    finished = job_queue.run_worker(lambda: sqlite3.connect(path), workers=0, once=True)
+
+    assert finished == 3
+    assert results == [2, 4, 6]
+    assert job_queue.outstanding(db) == []
+
+
+def test_process_pool_runs_jobs(queue_db):
+    path, db = queue_db
+    job_queue.enqueue(db, "double", {"n": 21})
+    db.commit()
+
+    job_queue.run_worker(lambda: sqlite3.connect(path), workers=1, once=True)
+
+    assert results == [42]
+
+
+def test_failures_back_off_then_fail(queue_db):
+    path, db = queue_db
+    job_id = job_queue.enqueue(db, "explode", {}, max_attempts=2)
+    db.commit()
+
+    job_queue.run_worker(lambda: sqlite3.connect(path), workers=0, once=True)
+    (job,) = job_queue.outstanding(db)
+    assert job["status"] == "pending"
+    assert job["attempts"] == 1
+    assert job["error"] == "RuntimeError: boom"
+
+    # the retry waits out its delay
+    assert job_queue.claim(db) is None
+    db.execute("UPDATE jobs SET run_after = ?", (datetime.now().isoformat(),))
+    db.commit()
+    job_queue.run_worker(lambda: sqlite3.connect(path), workers=0, once=True)
+
+    (job,) = job_queue.outstanding(db)
+    assert job["id"] == job_id
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
+
+
+def test_retry_requeues_failed_jobs(queue_db):
+    path, db = queue_db
+    job_id = job_queue.enqueue(db, "explode", {}, max_attempts=1)
+    db.commit()
+    job_queue.run_worker(lambda: sqlite3.connect(path), workers=0, once=True)
+
+    assert job_queue.retry(db, job_id)
+    assert not job_queue.retry(db, job_id)  # it's pending now, not failed
+    (job,) = job_queue.outstanding(db)
+    assert (job["status"], job["attempts"]) == ("pending", 0)
+
+
+def test_worker_requeues_abandoned_jobs(queue_db):
+    path, db = queue_db
+    job_queue.enqueue(db, "double", {"n": 5})
+    db.commit()
+    assert job_queue.claim(db) is not None  # a worker took it and died
+
+    job_queue.run_worker(lambda: sqlite3.connect(path), workers=0, once=True)
+
+    assert results == [10]
+
+
+def test_pending_job_by_target(queue_db):
+    _, db = queue_db
+    job_queue.enqueue(db, "double", {"n": 1}, target="data/photo.jpg")
+
+    payload, status = job_queue.pending_job(db, "data/photo.jpg")
+    assert payload == {"n": 1}
+    assert status == "pending"
+    assert job_queue.pending_job(db, "data/other.jpg") is None
+
+
+def test_kinds_at_their_limit_are_skipped(queue_db):
+    _, db = queue_db
+    job_queue.register("heavy", double, limit=1)
+    job_queue.enqueue(db, "heavy", {"n": 1})
+    job_queue.enqueue(db, "heavy", {"n": 2})
+    job_queue.enqueue(db, "double", {"n": 3})
+
+    first = job_queue.claim(db)
+    assert first.kind == "heavy"
+    assert job_queue._at_limit([first]) == ["heavy"]
+
+    second = job_queue.claim(db, exclude=job_queue._at_limit([first]))
+    assert (second.kind, second.payload) == ("double", {"n": 3})
+
+
+def test_a_thread_can_run_the_queue(queue_db):
+    path, db = queue_db
+    for n in (1, 2):
+        job_queue.enqueue(db, "double", {"n": n})
+    db.commit()
+
+    job_queue.run_in_thread(lambda: sqlite3.connect(path))
+    deadline = time.monotonic() + 5
+    # it stops once the queue is empty
+    while job_queue._thread is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert job_queue._thread is None
+    assert results == [2, 4]
+    assert job_queue.outstanding(db) == []
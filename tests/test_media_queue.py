@@ -0,0 +1,131 @@
+import json
+import os
+import pytest
+import sqlite3
+from datetime import datetime
+from unittest.mock import patch
+from PIL import Image
+import kongaloosh
+from pysrc import job_queue
+from pysrc.file_management import file_parser, media_store
+from pysrc.file_management.file_parser import create_json_entry
+from pysrc.post import BlogPost
+
+
+@pytest.fixture
+def queued_post(tmp_path, db_path, monkeypatch):
+    """A post published with one photo still waiting in the upload directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(file_parser, "BACKGROUND_MEDIA", True)
+    monkeypatch.setattr(file_parser, "RESPONSIVE_WIDTHS", [400])
+    upload = os.path.join(file_parser.BULK_UPLOAD_DIR, "upload.jpg")
+    os.makedirs(os.path.dirname(upload))
+    Image.new("RGB", (1200, 900), "green").save(upload)
+    web = media_store.web_path(media_store.content_hash(upload))
+
+    post = BlogPost(
+        content="",
+        slug="with-photo",
+        url="/e/2024/3/1/with-photo",
+        u_uid="uuid-with-photo",
+        published=datetime(2024, 3, 1, 12, 0, 0),
+        photo=[upload],
+    )
+    db = sqlite3.connect(db_path)
+    create_json_entry(post, g=db)
+    db.close()
+
+    return {
+        "upload": upload,
+        "web": web,
+        "json": os.path.join(file_parser.BLOG_STORAGE, "2024/3/1/", "with-photo.json"),
+    }
+
+
+def run_queue(db_path):
+    return job_queue.run_worker(lambda: sqlite3.connect(db_path), workers=0, once=True)
+
+
+def test_publishing_queues_the_photo(queued_post, db_path):
+    with open(queued_post["json"]) as f:
+        data = json.load(f)
+
+    assert data["photo"] == [queued_post["web"]]
+    assert not data.get("photo_variants")
+    assert not os.path.exists(queued_post["web"])
+
+    (job,) = job_queue.outstanding(sqlite3.connect(db_path))
+    assert (job["kind"], job["target"], job["status"]) == (
+        "photo",
+        queued_post["web"],
+        "pending",
+    )
+
+
+def test_worker_processes_and_records_variants(queued_post, db_path):
+    assert run_queue(db_path) == 1
+
+    assert Image.open(queued_post["web"]).size == (800, 600)
+    assert not os.path.exists(queued_post["upload"])
+    with open(queued_post["json"]) as f:
+        variants = json.load(f)["photo_variants"][queued_post["web"]]
+    assert {v["width"] for v in variants} >= {400, 800}
+
+    db = sqlite3.connect(db_path)
+    assert job_queue.outstanding(db) == []
+    (summary_json,) = db.execute("SELECT summary_json FROM entries").fetchone()
+    assert queued_post["web"] in json.loads(summary_json)["photo_variants"]
+
+
+def test_upload_is_served_until_processed(queued_post, db_path, file_client):
+    response = file_client.get("/" + queued_post["web"])
+
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    with open(queued_post["upload"], "rb") as f:
+        assert response.data == f.read()
+
+
+def disk_full(*args):
+    raise OSError("disk full")
+
+
+def test_status_and_retry(queued_post, db_path, file_client, monkeypatch):
+    db = sqlite3.connect(db_path)
+    db.execute("UPDATE jobs SET max_attempts = 1")
+    db.commit()
+    with monkeypatch.context() as m:
+        m.setattr(file_parser, "move_and_resize", disk_full)
+        run_queue(db_path)
+
+    with file_client.session_transaction() as sess:
+        sess["logged_in"] = True
+    (job,) = file_client.get("/media/jobs").get_json()
+    assert job["status"] == "failed"
+    assert job["error"].startswith("OSError")
+
+    response = file_client.post(f"/media/jobs/{job['id']}/retry")
+    assert response.get_json()["status"] == "pending"
+    assert file_client.post(f"/media/jobs/{job['id']}/retry").status_code == 404
+
+    assert run_queue(db_path) == 1
+    assert os.path.exists(queued_post["web"])
+
+
+def test_without_a_media_worker_posts_run_the_queue(file_client, monkeypatch):
+    monkeypatch.setattr(kongaloosh, "MEDIA_WORKER", "thread")
+    with file_client.session_transaction() as sess:
+        sess["logged_in"] = True
+
+    with patch.object(job_queue, "run_in_thread") as run_in_thread:
+        file_client.get("/media/jobs")
+        assert not run_in_thread.called
+        file_client.post("/media/jobs/1/retry")
+
+    run_in_thread.assert_called_once_with(
+        kongaloosh.connect_db, initializer=kongaloosh._media_worker_init
+    )
+
+
+def test_status_needs_login(file_client):
+    assert file_client.get("/media/jobs").status_code == 401
@@ -0,0 +1,96 @@
+import os
+import pytest
+from PIL import Image
+import kongaloosh
+from pysrc.file_management import serving
+from pysrc.rendering import media_url
+
+DIGEST = "ab" * 32
+
+
+@pytest.fixture
+def media_files(tmp_path, monkeypatch):
+    """A stored photo and one from before the store, in their blueprints' folders"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(kongaloosh.media, "static_folder", str(tmp_path / "media"))
+    monkeypatch.setattr(kongaloosh.photos, "static_folder", str(tmp_path / "data"))
+    monkeypatch.setattr(serving, "SENDFILE_ROOT", str(tmp_path))
+    stored = os.path.join("media", DIGEST[:2], DIGEST, "photo.jpg")
+    legacy = os.path.join("data", "2024", "3", "1", "post-0.jpg")
+    for path in (stored, legacy):
+        os.makedirs(os.path.dirname(path))
+        Image.new("RGB", (80, 60), "purple").save(path)
+    return {"stored": stored, "legacy": legacy}
+
+
+def test_stored_photos_are_immutable(file_client, media_files):
+    response = file_client.get("/" + media_files["stored"])
+
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == serving.IMMUTABLE_MAX_AGE
+    etag, weak = response.get_etag()
+    assert etag and not weak
+
+    again = file_client.get(
+        "/" + media_files["stored"], headers={"If-None-Match": f'"{etag}"'}
+    )
+    assert again.status_code == 304
+
+
+def test_only_fingerprinted_legacy_urls_are_immutable(file_client, media_files):
+    plain = file_client.get("/" + media_files["legacy"])
+    fingerprinted = file_client.get(media_url(media_files["legacy"]))
+
+    assert not plain.cache_control.immutable
+    assert plain.cache_control.no_cache
+    assert fingerprinted.cache_control.immutable
+    assert fingerprinted.data == plain.data
+
+    stale = file_client.get("/" + media_files["legacy"] + "?v=made-up")
+    assert not stale.cache_control.immutable
+    assert stale.cache_control.no_cache
+
+
+def test_fingerprint_follows_the_file(media_files):
+    assert media_url(media_files["stored"]) == "/" + media_files["stored"]
+
+    before = media_url(media_files["legacy"])
+    Image.new("RGB", (40, 30), "orange").save(media_files["legacy"])
+    os.utime(media_files["legacy"], (1_700_000_000, 1_700_000_000))
+
+    assert before.startswith("/" + media_files["legacy"] + "?v=")
+    assert media_url(media_files["legacy"]) != before
+
+
+def test_x_accel_redirect_leaves_the_bytes_to_the_proxy(
+    file_client, media_files, monkeypatch
+):
+    monkeypatch.setattr(serving, "SENDFILE", "x-accel-redirect")
+
+    stored = media_files["stored"]
+    response = file_client.get("/" + stored)
+
+    assert response.headers["X-Accel-Redirect"] == "/protected/" + stored
+    assert response.mimetype == "image/jpeg"
+    assert response.cache_control.immutable
+    assert response.data == b""
+    assert file_client.get("/media/ab/missing.jpg").status_code == 404
+
+    monkeypatch.setattr(serving, "SENDFILE", "")
+    direct = file_client.get("/" + stored)
+    assert response.get_etag() == direct.get_etag()
+    assert response.last_modified == direct.last_modified
+
+    monkeypatch.setattr(serving, "SENDFILE", "x-accel-redirect")
+    etag, _ = response.get_etag()
+    again = file_client.get("/" + stored, headers={"If-None-Match": f'"{etag}"'})
+    assert again.status_code == 304
+
+
+def test_x_sendfile(app, file_client, media_files, monkeypatch):
+    monkeypatch.setitem(app.config, "USE_X_SENDFILE", True)
+
+    response = file_client.get("/" + media_files["legacy"])
+
+    assert response.headers["X-Sendfile"] == os.path.abspath(media_files["legacy"])
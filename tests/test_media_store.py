@@ -0,0 +1,153 @@
+import json
+import os
+import pytest
+import shutil
+import sqlite3
+from datetime import datetime
+from PIL import Image
+from pysrc import job_queue
+from pysrc.file_management import file_parser, media_store
+from pysrc.file_management.file_parser import create_json_entry, migrate_media
+from pysrc.post import BlogPost
+
+
+@pytest.fixture
+def store(tmp_path, db_path, monkeypatch):
+    """An empty upload tray and media store, with photos processed inline"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(file_parser, "BACKGROUND_MEDIA", False)
+    monkeypatch.setattr(file_parser, "RESPONSIVE_WIDTHS", [400])
+    os.makedirs(file_parser.BULK_UPLOAD_DIR)
+    return sqlite3.connect(db_path)
+
+
+def upload(name, color="green"):
+    path = os.path.join(file_parser.BULK_UPLOAD_DIR, name)
+    Image.new("RGB", (1200, 900), color).save(path)
+    return path
+
+
+def publish(db, slug, photos, day=1):
+    post = BlogPost(
+        content="",
+        slug=slug,
+        url=f"/e/2024/3/{day}/{slug}",
+        u_uid=f"uuid-{slug}",
+        published=datetime(2024, 3, day, 12, 0, 0),
+        photo=photos,
+    )
+    create_json_entry(post, g=db)
+    with open(os.path.join(file_parser.BLOG_STORAGE, f"2024/3/{day}/{slug}.json")) as f:
+        return json.load(f)
+
+
+def test_the_same_photo_is_stored_once(store):
+    first = upload("camera.jpg")
+    again = os.path.join(file_parser.BULK_UPLOAD_DIR, "again.jpg")
+    shutil.copyfile(first, again)
+    digest = media_store.content_hash(first)
+
+    one = publish(store, "one", [first])
+    two = publish(store, "two", [again])
+
+    web = media_store.web_path(digest)
+    assert one["photo"] == two["photo"] == [web]
+    assert two["photo_variants"] == one["photo_variants"]
+    assert os.listdir(file_parser.BULK_UPLOAD_DIR) == []
+    assert os.listdir(os.path.dirname(media_store.media_dir(digest))) == [digest]
+    assert store.execute("SELECT refs FROM media").fetchall() == [(2,)]
+
+
+def test_a_queued_photo_is_shared_while_it_waits(store, monkeypatch, db_path):
+    monkeypatch.setattr(file_parser, "BACKGROUND_MEDIA", True)
+    first = upload("camera.jpg")
+    again = os.path.join(file_parser.BULK_UPLOAD_DIR, "again.jpg")
+    shutil.copyfile(first, again)
+
+    publish(store, "one", [first])
+    publish(store, "two", [again])
+    assert len(job_queue.outstanding(store)) == 1
+
+    job_queue.run_worker(lambda: sqlite3.connect(db_path), workers=0, once=True)
+
+    for slug in ("one", "two"):
+        with open(os.path.join(file_parser.BLOG_STORAGE, f"2024/3/1/{slug}.json")) as f:
+            data = json.load(f)
+        assert data["photo_variants"][data["photo"][0]]
+
+
+def test_a_photo_is_deleted_with_its_last_reference(store):
+    photo = upload("camera.jpg")
+    digest = media_store.content_hash(photo)
+    publish(store, "one", [photo])
+    media_store.set_refs(store, "elsewhere.json", [digest])
+
+    assert media_store.set_refs(store, "data/2024/3/1/one.json", []) == []
+    assert os.path.exists(media_store.web_path(digest))
+
+    assert media_store.set_refs(store, "elsewhere.json", []) == [digest]
+    assert not os.path.exists(media_store.media_dir(digest))
+    assert store.execute("SELECT COUNT(*) FROM media").fetchone() == (0,)
+
+
+@pytest.fixture
+def legacy_posts(store, make_post, tmp_path):
+    """Two posts from before the store, the second a re-upload of the first's photo"""
+    paths = {}
+    day = os.path.join("2024", "3", "1")
+    for slug in ("old", "copy"):
+        web = os.path.join(file_parser.BLOG_STORAGE, day, f"{slug}-0.jpg")
+        archive = os.path.join(file_parser.PERMANENT_PHOTOS_DIR, day, f"{slug}-0.jpg")
+        variant = web.replace(".jpg", "-400w.jpg")
+        for path, size in ((web, 800), (archive, 1600), (variant, 400)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            Image.new("RGB", (size, size // 2), "blue").save(path)
+        paths[slug] = (web, archive, variant)
+        make_post(
+            slug,
+            datetime(2024, 3, 1),
+            directory=os.path.join(file_parser.BLOG_STORAGE, day),
+            content=f"@@@\n[]({web})\n@@@",
+            photo=[web],
+            photo_variants={
+                web: [
+                    {"path": path, "width": w, "height": w // 2, "type": "image/jpeg"}
+                    for path, w in ((web, 800), (variant, 400))
+                ]
+            },
+        )
+    return paths
+
+
+def test_migration_moves_and_deduplicates(store, legacy_posts):
+    digest = media_store.content_hash(legacy_posts["old"][1])
+
+    assert migrate_media(store) == 2
+
+    web = media_store.web_path(digest)
+    for slug, files in legacy_posts.items():
+        assert not any(os.path.exists(path) for path in files)
+        with open(os.path.join(file_parser.BLOG_STORAGE, f"2024/3/1/{slug}.json")) as f:
+            data = json.load(f)
+        assert data["photo"] == [web]
+        assert web in data["content"]
+        assert [v["path"] for v in data["photo_variants"][web]] == [
+            web,
+            web.replace(".jpg", "-400w.jpg"),
+        ]
+        assert media_store.alias(store, files[0]) == digest
+    assert os.path.exists(media_store.archive_path(digest))
+    assert store.execute("SELECT refs FROM media").fetchall() == [(2,)]
+
+    assert migrate_media(store) == 0
+
+
+def test_old_photo_urls_redirect_into_the_store(store, legacy_posts, file_client):
+    migrate_media(store)
+    old = legacy_posts["old"][0]
+
+    response = file_client.get("/" + old)
+
+    assert response.status_code == 301
+    digest = media_store.alias(store, old)
+    assert response.location == "/" + media_store.web_path(digest)
@@ -0,0 +1,91 @@
+import pytest
+import sqlite3
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from flask import g
+import kongaloosh
+from kongaloosh import app, get_page, next_page_url, PAGE_SIZE
+
+
+@pytest.fixture
+def paged_posts(make_post):
+    """Twenty-five posts, one per day"""
+    start = datetime(2024, 1, 1, 9, 0, 0)
+    for i in range(25):
+        make_post(f"post-{i:02d}", start + timedelta(days=i))
+
+
+@pytest.fixture
+def paged_db(paged_posts, db_path):
+    """A request context bound to the paged posts"""
+    conn = sqlite3.connect(db_path)
+    with app.test_request_context():
+        g.db = conn
+        yield conn
+    conn.close()
+
+
+def test_first_page_is_newest(paged_db):
+    page = get_page(0)
+
+    assert len(page.entries) == PAGE_SIZE
+    assert page.entries[0].slug == "post-24"
+    assert page.entries[-1].slug == "post-15"
+    assert page.has_next
+
+
+def test_last_page_has_no_next(paged_db):
+    page = get_page(2)
+
+    assert [e.slug for e in page.entries] == [f"post-{i:02d}" for i in range(4, -1, -1)]
+    assert not page.has_next
+    assert next_page_url(2, page) is None
+
+
+def test_page_past_the_end_is_empty(paged_db):
+    page = get_page(10)
+    assert page.entries == []
+    assert not page.has_next
+
+
+def test_cursor_matches_offset(paged_db):
+    first = get_page(0)
+    by_cursor = get_page(1, first.cursor)
+    by_offset = get_page(1)
+
+    assert [e.slug for e in by_cursor.entries] == [e.slug for e in by_offset.entries]
+
+
+def test_cursor_breaks_ties_on_id(paged_db, make_post):
+    same_time = datetime(2023, 6, 1, 12, 0, 0)
+    for i in range(PAGE_SIZE + 2):
+        make_post(f"tie-{i:02d}", same_time)
+
+    seen = []
+    page = get_page(0)
+    number = 0
+    while True:
+        seen += [e.slug for e in page.entries]
+        if not page.has_next:
+            break
+        number += 1
+        page = get_page(number, page.cursor)
+
+    assert len(seen) == len(set(seen)) == 25 + PAGE_SIZE + 2
+
+
+def test_page_only_reads_its_rows(paged_db):
+    with patch(
+        "kongaloosh.file_parser_json", wraps=kongaloosh.file_parser_json
+    ) as parse:
+        get_page(1)
+    assert parse.call_count == PAGE_SIZE
+
+
+def test_page_route_links_next_cursor(file_client, paged_posts):
+    response = file_client.get("/page/0")
+    assert response.status_code == 200
+    assert b"/page/1?before=" in response.data
+
+    response = file_client.get("/page/2")
+    assert b"/page/3" not in response.data
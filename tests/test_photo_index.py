@@ -0,0 +1,130 @@
+import os
+import sqlite3
+from datetime import datetime
+import pytest
+from PIL import Image
+from flask import g
+from pysrc.file_management import file_parser, media_store, photo_index
+from pysrc.file_management.file_parser import create_json_entry
+from pysrc.post import BlogPost
+from pysrc.rendering import picture
+
+
+def photo(path, size=(1200, 900), taken=None, gps=None, orientation=None):
+    """A JPEG with whichever EXIF tags are given"""
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    if taken:
+        exif[0x8769] = {0x9003: taken}
+    if gps:
+        (lat, lat_ref), (lon, lon_ref) = gps
+        exif[0x8825] = {1: lat_ref, 2: lat, 3: lon_ref, 4: lon}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, "olive").save(path, exif=exif)
+    return path
+
+
+BANFF = (((51.0, 10.0, 12.0), "N"), ((115.0, 34.0, 12.0), "W"))
+
+
+@pytest.fixture
+def index_db(tmp_path, db_path, monkeypatch):
+    """An empty upload tray, and a connection to a database with the photos table"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(file_parser.BULK_UPLOAD_DIR)
+    return sqlite3.connect(db_path)
+
+
+def test_metadata_is_read_from_the_header(index_db):
+    path = photo(
+        os.path.join(file_parser.BULK_UPLOAD_DIR, "a.jpg"),
+        taken="2023:07:14 09:30:00",
+        gps=BANFF,
+        orientation=6,
+    )
+
+    metadata = photo_index.read_metadata(path)
+
+    assert (metadata.width, metadata.height) == (900, 1200)
+    assert metadata.orientation == 6
+    assert metadata.taken == "2023-07-14T09:30:00"
+    assert metadata.lat == pytest.approx(51.17)
+    assert metadata.lon == pytest.approx(-115.57)
+    assert metadata.bytes == os.path.getsize(path)
+
+
+def test_tray_is_ordered_by_capture_time_and_carries_gps(index_db, file_client):
+    tray = file_parser.BULK_UPLOAD_DIR
+    photo(os.path.join(tray, "old-shot.jpg"), taken="2020:01:01 12:00:00")
+    photo(os.path.join(tray, "new-shot.jpg"), taken="2024:05:01 12:00:00", gps=BANFF)
+    # copied in last, but taken first
+    os.utime(os.path.join(tray, "new-shot.jpg"), (1_600_000_000,) * 2)
+
+    html = file_client.get("/recent_uploads").get_data(as_text=True)
+
+    assert html.index("new-shot.jpg") < html.index("old-shot.jpg")
+    assert 'data-geo="51.17,-115.57"' in html
+    assert index_db.execute("SELECT COUNT(*) FROM photos").fetchone() == (2,)
+
+
+def test_published_copies_keep_the_uploads_capture_time(index_db, monkeypatch):
+    monkeypatch.setattr(file_parser, "BACKGROUND_MEDIA", False)
+    monkeypatch.setattr(file_parser, "RESPONSIVE_WIDTHS", [400])
+    upload = photo(
+        os.path.join(file_parser.BULK_UPLOAD_DIR, "camera.jpg"),
+        taken="2023:07:14 09:30:00",
+        gps=BANFF,
+    )
+    digest = media_store.content_hash(upload)
+    post = BlogPost(
+        content="",
+        slug="hike",
+        url="/e/2024/3/1/hike",
+        u_uid="uuid-hike",
+        published=datetime(2024, 3, 1, 12, 0, 0),
+        photo=[upload],
+    )
+
+    create_json_entry(post, g=index_db)
+
+    web = photo_index.lookup(index_db, media_store.web_path(digest))
+    archive = photo_index.lookup(index_db, media_store.archive_path(digest))
+    assert (web.width, web.height) == (800, 600)
+    assert (archive.width, archive.height) == (1200, 900)
+    assert web.taken == archive.taken == "2023-07-14T09:30:00"
+    assert web.lat == pytest.approx(51.17)
+
+
+def test_backfill_indexes_each_photo_once(index_db):
+    day = os.path.join("2024", "3", "1")
+    web = photo(os.path.join(file_parser.BLOG_STORAGE, day, "post-0.jpg"), (800, 600))
+    photo(os.path.join(file_parser.BLOG_STORAGE, day, "post-0-400w.jpg"), (400, 300))
+    photo(
+        os.path.join(file_parser.PERMANENT_PHOTOS_DIR, day, "post-0.jpg"),
+        taken="2019:08:02 18:45:00",
+    )
+    photo_index.save(index_db, photo_index.PhotoMetadata("data/gone.jpg", 10, 10))
+
+    assert photo_index.backfill_photo_index(index_db, workers=2) == 2
+    assert photo_index.lookup(index_db, web).taken == "2019-08-02T18:45:00"
+    assert photo_index.lookup(index_db, "data/gone.jpg") is None
+    assert index_db.execute("SELECT COUNT(*) FROM photos").fetchone() == (2,)
+
+    assert photo_index.backfill_photo_index(index_db, workers=2) == 0
+
+
+def test_img_tags_are_sized_from_the_index(index_db, app):
+    web = photo(os.path.join(file_parser.BLOG_STORAGE, "2024/3/1/post-0.jpg"))
+    photo_index.index_photo(index_db, web)
+    index_db.commit()
+
+    with app.test_request_context():
+        g.db = index_db
+        html = str(picture(web))
+        album = file_parser.render_markdown(f"@@@\n[]({web})\n@@@")
+
+    assert 'width="1200" height="900"' in html
+    assert 'width="400" height="300"' in album
+    # outside a request nothing is looked up
+    assert "width=" not in file_parser.render_markdown(f"@@@\n[]({web})\n@@@")
@@ -0,0 +1,101 @@
+import json
+import os
+import re
+import pytest
+import sqlite3
+from datetime import datetime
+from PIL import Image
+from pysrc.file_management import file_parser
+from pysrc.file_management.file_parser import backfill_photo_variants
+from pysrc.post import PhotoVariant
+from pysrc.rendering import picture
+
+
+def variant(path, width, height, type="image/jpeg"):
+    return PhotoVariant(path=path, width=width, height=height, type=type)
+
+
+VARIANTS = {
+    "data/p-0.jpg": [
+        variant("data/p-0-400w.jpg", 400, 300),
+        variant("data/p-0.jpg", 800, 600),
+        variant("data/p-0-400w.webp", 400, 300, "image/webp"),
+        variant("data/p-0-800w.webp", 800, 600, "image/webp"),
+    ]
+}
+
+
+def test_picture_emits_sources_and_dimensions():
+    html = str(picture("data/p-0.jpg", VARIANTS, class_="u-photo"))
+
+    assert html.startswith('<picture><source type="image/webp"')
+    assert 'srcset="/data/p-0-400w.webp 400w, /data/p-0-800w.webp 800w"' in html
+    assert 'srcset="/data/p-0-400w.jpg 400w, /data/p-0.jpg 800w"' in html
+    assert 'src="/data/p-0.jpg"' in html
+    assert 'width="800" height="600"' in html
+    assert 'class="u-photo"' in html
+
+
+def test_picture_without_variants_is_a_plain_img():
+    html = str(picture("data/old.jpg", None, style="max-height:500px"))
+
+    assert html == '<img style="max-height:500px" src="/data/old.jpg" loading="lazy">'
+
+
+def test_picture_escapes_attributes():
+    html = str(picture('data/"quoted".jpg', None))
+    assert '"quoted"' not in html
+
+
+@pytest.fixture
+def published_photo(make_post, tmp_path, monkeypatch):
+    """A post whose photo predates variants, with its archive copy"""
+    storage = tmp_path / "data"
+    archive = tmp_path / "photos"
+    monkeypatch.setattr(file_parser, "BLOG_STORAGE", str(storage))
+    monkeypatch.setattr(file_parser, "PERMANENT_PHOTOS_DIR", str(archive))
+    monkeypatch.setattr(file_parser, "RESPONSIVE_WIDTHS", [400, 800])
+
+    web = storage / "2024" / "3" / "1" / "post-0.jpg"
+    os.makedirs(web.parent)
+    os.makedirs(archive / "2024" / "3" / "1")
+    Image.new("RGB", (2000, 1000), "blue").save(archive / "2024/3/1/post-0.jpg")
+    Image.new("RGB", (800, 400), "blue").save(web)
+
+    location = make_post(
+        "post", datetime(2024, 3, 1), category=["photos"], photo=[str(web)]
+    )
+    return location, str(web)
+
+
+def test_backfill_records_variants(published_photo, db_path):
+    location, web = published_photo
+    db = sqlite3.connect(db_path)
+
+    assert backfill_photo_variants(db) == 1
+
+    with open(location + ".json") as f:
+        variants = json.load(f)["photo_variants"][web]
+    described = {(os.path.basename(v["path"]), v["width"], v["type"]) for v in variants}
+    assert ("post-0-400w.jpg", 400, "image/jpeg") in described
+    assert ("post-0.jpg", 800, "image/jpeg") in described
+    assert ("post-0-800w.webp", 800, "image/webp") in described
+
+    (summary_json,) = db.execute("SELECT summary_json FROM entries").fetchone()
+    assert web in json.loads(summary_json)["photo_variants"]
+
+
+def test_backfill_skips_done_posts(published_photo, db_path):
+    db = sqlite3.connect(db_path)
+    backfill_photo_variants(db)
+
+    assert backfill_photo_variants(db) == 0
+
+
+def test_list_view_uses_srcset(published_photo, db_path, file_client):
+    backfill_photo_variants(sqlite3.connect(db_path))
+
+    response = file_client.get("/t/photos")
+
+    assert b"<picture>" in response.data
+    assert re.search(rb"post-0-400w\.webp\?v=[0-9a-f-]+ 400w", response.data)
@@ -0,0 +1,57 @@
+import json
+import threading
+from pysrc.file_management.file_parser import file_parser_json
+from pysrc.rendering import get_markdown, render_markdown
+
+ALBUM = """@@@
+[](/images/a.jpg)-[](/images/b.jpg)
+@@@"""
+
+
+def test_instance_is_reused_within_a_thread():
+    assert get_markdown() is get_markdown()
+
+
+def test_threads_get_their_own_instance():
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(get_markdown()))
+    thread.start()
+    thread.join()
+
+    assert seen[0] is not get_markdown()
+
+
+def test_documents_do_not_leak_into_each_other():
+    with_album = render_markdown("An album\n\n" + ALBUM)
+    assert "album-component" in with_album
+
+    plain = render_markdown("Just some *text*")
+    assert plain == "<p>Just some <em>text</em></p>"
+
+
+def test_canonical_extensions():
+    html = render_markdown("A #hashtag\n\n```\ncode\n```")
+
+    assert '<a href="/t/hashtag">#hashtag</a>' in html
+    assert "<pre><code>code\n</code></pre>" in html
+
+
+def test_preview_matches_published(file_client, tmp_path):
+    text = "Some *markdown* with a #tag\n\n```\nx = 1\n```"
+    path = tmp_path / "post.json"
+    path.write_text(
+        json.dumps(
+            {
+                "content": text,
+                "published": "2024-03-01T12:00:00",
+                "slug": "post",
+                "url": "/e/2024/3/1/post",
+                "u_uid": "uuid-post",
+            }
+        )
+    )
+
+    response = file_client.post("/md_to_html", json={"text": text})
+
+    assert response.status_code == 200
+    assert response.get_json()["html"] == file_parser_json(str(path)).content
@@ -0,0 +1,159 @@
+import json
+import os
+import sqlite3
+from datetime import datetime
+import pytest
+from unittest.mock import patch
+from kongaloosh import entries_from_rows
+from pysrc.file_management import file_parser
+from pysrc.file_management.file_parser import file_parser_json, reply_context
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """A blog directory that local in_reply_to urls resolve into"""
+    monkeypatch.setattr(file_parser, "BLOG_STORAGE", str(tmp_path))
+    file_parser.entry_cache.clear()
+    yield tmp_path
+    file_parser.entry_cache.clear()
+
+
+def local_url(slug):
+    return f"https://kongaloosh.com/e/2024/3/1/{slug}"
+
+
+def write_post(storage, slug, in_reply_to=None, **fields):
+    directory = storage / "2024" / "3" / "1"
+    os.makedirs(directory, exist_ok=True)
+    data = {
+        "title": slug.replace("-", " ").title(),
+        "content": f"Content of *{slug}*",
+        "published": "2024-03-01T12:00:00",
+        "slug": slug,
+        "url": f"/e/2024/3/1/{slug}",
+        "u_uid": f"uuid-{slug}",
+        **fields,
+    }
+    if in_reply_to:
+        data["in_reply_to"] = in_reply_to
+    path = directory / f"{slug}.json"
+    path.write_text(json.dumps(data))
+    return str(path)
+
+
+def test_local_reply_is_projected(storage):
+    write_post(storage, "original", photo=["data/2024/3/1/original-0.jpg"])
+    reply = write_post(storage, "reply", in_reply_to=[local_url("original")])
+
+    (context,) = file_parser_json(reply).in_reply_to
+
+    assert str(context.url) == local_url("original")
+    assert context.title == "Original"
+    assert context.content == "<p>Content of <em>original</em></p>"
+    assert context.photo == "data/2024/3/1/original-0.jpg"
+    assert context.in_reply_to is None
+
+
+def test_remote_reply_keeps_only_url(storage):
+    reply = write_post(storage, "reply", in_reply_to=["https://example.com/post"])
+
+    (context,) = file_parser_json(reply).in_reply_to
+    assert str(context.url) == "https://example.com/post"
+    assert context.content is None
+
+
+def test_chain_stops_at_depth(storage):
+    write_post(storage, "post-0")
+    for i in range(1, 6):
+        write_post(storage, f"post-{i}", in_reply_to=[local_url(f"post-{i - 1}")])
+
+    context = reply_context(local_url("post-5"), depth=2)
+
+    assert context.title == "Post 5"
+    (parent,) = context.in_reply_to
+    assert parent.title == "Post 4"
+    (grandparent,) = parent.in_reply_to
+    assert grandparent.title is None
+    assert str(grandparent.url) == local_url("post-3")
+
+
+def test_cycle_terminates(storage):
+    write_post(storage, "ping", in_reply_to=[local_url("pong")])
+    write_post(storage, "pong", in_reply_to=[local_url("ping")])
+
+    context = reply_context(local_url("ping"), depth=10)
+
+    (pong,) = context.in_reply_to
+    (ping_again,) = pong.in_reply_to
+    assert ping_again.title is None
+
+
+def test_missing_target_keeps_url(storage):
+    reply = write_post(storage, "reply", in_reply_to=[local_url("deleted")])
+
+    (context,) = file_parser_json(reply).in_reply_to
+    assert str(context.url) == local_url("deleted")
+    assert context.title is None
+
+
+def test_target_is_parsed_once(storage):
+    write_post(storage, "original")
+    replies = [
+        write_post(storage, f"reply-{i}", in_reply_to=[local_url("original")])
+        for i in range(3)
+    ]
+
+    with patch.object(
+        file_parser, "_parse_json_entry", wraps=file_parser._parse_json_entry
+    ) as parse:
+        for reply in replies:
+            file_parser_json(reply)
+            file_parser_json(reply)
+
+    parsed = [call.args[0] for call in parse.call_args_list]
+    assert sum(path.endswith("original.json") for path in parsed) == 1
+
+
+def test_edited_target_is_reresolved(storage):
+    original = write_post(storage, "original")
+    reply = write_post(storage, "reply", in_reply_to=[local_url("original")])
+    file_parser_json(reply)
+
+    write_post(storage, "original", title="A Retitled Original Post")
+    os.utime(original, ns=(0, 10**18))
+
+    (context,) = file_parser_json(reply).in_reply_to
+    assert context.title == "A Retitled Original Post"
+
+
+def test_summaries_resolve_replies_when_read(storage, db_path):
+    write_post(storage, "original")
+    reply = write_post(storage, "reply", in_reply_to=[local_url("original")])
+    location = reply[: -len(".json")]
+    db = sqlite3.connect(db_path)
+    db.execute(
+        "INSERT INTO entries (slug, published, location) VALUES (?, ?, ?)",
+        ("reply", "2024-03-01T12:00:00", location),
+    )
+    file_parser.store_entry_summary(db, location)
+    (summary_json,) = db.execute("SELECT summary_json FROM entries").fetchone()
+    # only the url is stored, so an edit to the original can't go stale here
+    assert json.loads(summary_json)["in_reply_to"][0]["content"] is None
+
+    write_post(storage, "original", content="Edited")
+    (entry,) = entries_from_rows([(location, summary_json)])
+    assert entry.in_reply_to[0].content == "<p>Edited</p>"
+
+
+def test_replies_without_a_photo_render_no_image(storage, make_post, file_client):
+    make_post(
+        "reply",
+        datetime(2024, 3, 1, 12, 0, 0),
+        directory=str(storage),
+        in_reply_to=["https://example.com/post"],
+    )
+
+    html = file_client.get("/e/2024/3/1/").get_data(as_text=True)
+
+    assert 'href="https://example.com/post"' in html
+    assert 'src="/None"' not in html
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from pysrc.file_management import resizing
+from pysrc.file_management.resizing import DiskLRU
+from pysrc.rendering import render_markdown
+
+
+@pytest.fixture
+def photo(tmp_path, monkeypatch):
+    """A published photo with a larger archive copy, and an empty resize cache"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(
+        resizing, "resize_cache", DiskLRU(resizing.RESIZE_CACHE_DIR, 1 << 20)
+    )
+    relative = os.path.join("2024", "3", "1", "post-0.jpg")
+    web = os.path.join(resizing.BLOG_STORAGE, relative)
+    archive = os.path.join(resizing.PERMANENT_PHOTOS_DIR, relative)
+    for path, size in ((web, (800, 400)), (archive, (2000, 1000))):
+        os.makedirs(os.path.dirname(path))
+        Image.new("RGB", size, "teal").save(path)
+    return web
+
+
+def test_photos_are_resized_from_the_archive_once(file_client, photo):
+    response = file_client.get(f"/img/1200/{photo}")
+
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    with Image.open(resizing.resized(resizing.resize_source(photo), 1200)) as img:
+        assert img.size == (1200, 600)
+
+    with patch.object(resizing, "write_thumbnail") as write:
+        assert file_client.get(f"/img/1200/{photo}").status_code == 200
+        assert not write.called
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/img/333/data/2024/3/1/post-0.jpg",  # not an allowed size
+        "/img/400/data/2024/3/1/missing.jpg",
+        "/img/400/data/../config.ini",
+        "/img/400/elsewhere/post-0.jpg",
+    ],
+)
+def test_only_allowed_sizes_of_photos_are_made(file_client, photo, url):
+    assert file_client.get(url).status_code == 404
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = DiskLRU(str(tmp_path / "cache"), max_bytes=2500)
+
+    def make(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"x" * 1000)
+
+    first = cache.get("first", make)
+    second = cache.get("second", make)
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    cache.get("first", make)  # used again, so second is now the oldest
+
+    cache.get("third", make)
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert cache.usage() == 2000
+
+
+def test_concurrent_requests_make_the_file_once(tmp_path):
+    cache = DiskLRU(str(tmp_path / "cache"), max_bytes=1 << 20)
+    calls = []
+
+    def slow_make(path):
+        calls.append(path)
+        time.sleep(0.05)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"photo")
+
+    threads = [
+        threading.Thread(target=cache.get, args=("key", slow_make)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+
+
+def test_albums_request_their_display_size():
+    html = render_markdown("@@@\n[](data/2024/3/1/post-0.jpg)\n@@@")
+
+    assert 'src="/img/400/data/2024/3/1/post-0.jpg"' in html
+    assert "/img/800/data/2024/3/1/post-0.jpg 2x" in html
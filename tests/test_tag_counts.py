@@ -0,0 +1,68 @@
+import json
+import pytest
+from datetime import datetime
+from kongaloosh import get_most_popular_tags
+from pysrc.database.queries import CategoryQueries, TagCountQueries
+
+
+def counts(db):
+    return dict(db.execute("SELECT category, count FROM tag_counts").fetchall())
+
+
+def add(db, slug, category, published=datetime(2024, 3, 1)):
+    db.execute(CategoryQueries.INSERT_OR_REPLACE, (slug, published, category))
+
+
+def test_inserts_increment_counts(db):
+    add(db, "post1", "python")
+    add(db, "post2", "python")
+    add(db, "post2", "flask")
+
+    assert counts(db) == {"python": 2, "flask": 1}
+
+
+def test_deletes_decrement_and_drop_counts(db):
+    published = datetime(2024, 3, 1)
+    add(db, "post1", "python", published)
+    add(db, "post2", "python", published)
+    add(db, "post2", "flask", published)
+
+    db.execute(CategoryQueries.DELETE, ("post1", "python"))
+    db.execute(CategoryQueries.DELETE_FOR_ENTRY, ("post2", published))
+
+    assert counts(db) == {}
+
+
+def test_rebuild_matches_group_by(db):
+    for slug, category in [("a", "x"), ("b", "x"), ("c", "y")]:
+        add(db, slug, category)
+    db.execute("UPDATE tag_counts SET count = 99")
+
+    db.executescript(TagCountQueries.REBUILD)
+    assert counts(db) == {"x": 2, "y": 1}
+
+
+def test_top_tags_read_index_without_grouping(db):
+    plan = [
+        row[3]
+        for row in db.execute("EXPLAIN QUERY PLAN " + TagCountQueries.SELECT_TOP, (10,))
+    ]
+    assert not any("GROUP BY" in step for step in plan)
+    assert any("tag_counts_count" in step for step in plan)
+
+
+def test_top_tags_are_limited(client, db):
+    for i in range(15):
+        for j in range(i + 1):
+            add(db, f"post-{j}", f"tag-{i}")
+
+    tags = get_most_popular_tags(3)
+    assert tags == ["tag-14", "tag-13", "tag-12"]
+
+
+def test_tag_cloud_route(file_client, make_post):
+    make_post("one", datetime(2024, 1, 1), category=["python", "note"])
+    make_post("two", datetime(2024, 1, 2), category=["python"])
+
+    response = file_client.get("/t/", headers={"Accept": "application/json"})
+    assert json.loads(response.data) == [["python", 2], ["note", 1]]
@@ -0,0 +1,86 @@
+import os
+import pytest
+from unittest.mock import patch
+from PIL import Image, JpegImagePlugin
+import kongaloosh
+from pysrc.file_management import file_parser
+from pysrc.file_management.file_parser import thumbnail_path, upload_thumbnail
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    """Five uploads, each a minute newer than the last"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(kongaloosh.BULK_UPLOAD_DIR)
+    names = []
+    for i in range(5):
+        name = f"upload-{i}.jpg"
+        path = os.path.join(kongaloosh.BULK_UPLOAD_DIR, name)
+        Image.new("RGB", (2400, 1600), "orange").save(path)
+        os.utime(path, (1_700_000_000 + i * 60,) * 2)
+        names.append(name)
+    return names
+
+
+def test_thumbnail_is_small_and_uses_draft_mode(uploads, monkeypatch):
+    upload = os.path.join(kongaloosh.BULK_UPLOAD_DIR, uploads[0])
+    decoded_sizes = []
+    draft = JpegImagePlugin.JpegImageFile.draft
+
+    def recording_draft(self, mode, size):
+        result = draft(self, mode, size)
+        decoded_sizes.append(self.size)
+        return result
+
+    monkeypatch.setattr(JpegImagePlugin.JpegImageFile, "draft", recording_draft)
+    thumbnail = upload_thumbnail(upload)
+
+    # 2400x1600 decodes at 1/4 scale for a 300px thumbnail
+    assert decoded_sizes[0] == (600, 400)
+    assert thumbnail == thumbnail_path(upload)
+    assert max(Image.open(thumbnail).size) == file_parser.THUMBNAIL_SIZE
+
+
+def test_thumbnail_is_cached_until_upload_changes(uploads):
+    upload = os.path.join(kongaloosh.BULK_UPLOAD_DIR, uploads[0])
+    upload_thumbnail(upload)
+
+    with patch.object(file_parser, "write_thumbnail") as write:
+        upload_thumbnail(upload)
+        assert not write.called
+
+        later = os.stat(thumbnail_path(upload)).st_mtime + 60
+        os.utime(upload, (later, later))
+        upload_thumbnail(upload)
+        assert write.called
+
+
+def test_unreadable_upload_has_no_thumbnail(tmp_path):
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not a jpeg")
+
+    assert upload_thumbnail(str(broken)) is None
+
+
+def test_tray_is_newest_first_with_thumbnails(uploads, file_client):
+    html = file_client.get("/recent_uploads").get_data(as_text=True)
+
+    positions = [
+        html.index(f"/upload_thumbnails/{name}.jpg") for name in reversed(uploads)
+    ]
+    assert positions == sorted(positions)
+    assert f"[](/{kongaloosh.TEMP_LOCATION}/upload-4.jpg)" in html
+    assert f'src="/{kongaloosh.TEMP_LOCATION}/' not in html
+
+
+def test_tray_is_paginated(uploads, file_client, monkeypatch):
+    monkeypatch.setattr(kongaloosh, "UPLOADS_PAGE_SIZE", 3)
+
+    first = file_client.get("/recent_uploads").get_data(as_text=True)
+    assert "upload-4.jpg.jpg" in first and "upload-1.jpg.jpg" not in first
+    assert "/recent_uploads?page=1" in first
+
+    second = file_client.get("/recent_uploads?page=1").get_data(as_text=True)
+    assert "upload-1.jpg.jpg" in second and "upload-0.jpg.jpg" in second
+    assert 'id="img_3"' in second
+    assert "More uploads" not in second
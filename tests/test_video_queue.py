@@ -0,0 +1,351 @@
+import json
+import os
+import sqlite3
+import subprocess
+from datetime import datetime
+import pytest
+from unittest.mock import patch
+from pysrc import job_queue, video_converter
+from pysrc.file_management import file_parser
+from pysrc.file_management.file_parser import create_json_entry
+from pysrc.post import BlogPost, VideoStream
+from pysrc.rendering import media_url, video_player
+from pysrc.video_converter import (
+    conversion_method,
+    conversion_progress,
+    conversion_status,
+    convert_video_to_mp4,
+    parse_progress,
+    timeout_for,
+)
+
+PHONE_MP4 = {
+    "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2", "duration": "12.5"},
+    "streams": [
+        {"codec_type": "video", "codec_name": "h264", "pix_fmt": "yuv420p"},
+        {"codec_type": "audio", "codec_name": "aac"},
+        {"codec_type": "data"},  # a timecode track
+    ],
+}
+HEVC = {
+    "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2", "duration": "12.5"},
+    "streams": [
+        {"codec_type": "video", "codec_name": "hevc", "pix_fmt": "yuv420p10le"},
+        {"codec_type": "audio", "codec_name": "aac"},
+    ],
+}
+
+PORTRAIT_PHONE_MP4 = {
+    "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2", "duration": "12.5"},
+    "streams": [
+        {
+            "codec_type": "video",
+            "codec_name": "h264",
+            "pix_fmt": "yuv420p",
+            "width": 1280,
+            "height": 720,
+            "side_data_list": [{"rotation": -90}],
+        },
+        {"codec_type": "audio", "codec_name": "aac"},
+    ],
+}
+
+# what ffmpeg -progress pipe:1 writes, trimmed
+PROGRESS = """frame=150
+fps=60.00
+out_time_us=5000000
+speed=2.5x
+progress=continue
+frame=375
+fps=61.20
+out_time_us=12500000
+speed=2.5x
+progress=end
+"""
+
+
+@pytest.fixture
+def video(tmp_path, db_path, monkeypatch):
+    """An uploaded video and the database its job is queued in"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("images/temp")
+    with open("images/temp/clip.mov", "wb") as f:
+        f.write(b"not really a video")
+    return "images/temp/clip.mov", sqlite3.connect(db_path)
+
+
+class FakeProcess:
+    def __init__(self, stdout, returncode):
+        self.stdout = iter(stdout.splitlines(keepends=True))
+        self.returncode = returncode
+
+    def wait(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class FakeFFmpeg:
+    """Stands in for ffprobe and ffmpeg, which writes its output when it succeeds"""
+
+    def __init__(self, probed=PHONE_MP4, fails=False, remux_fails=False):
+        self.probed, self.fails, self.remux_fails = probed, fails, remux_fails
+        self.commands = []
+
+    def run(self, command, **kwargs):
+        assert command[0] == "ffprobe"
+        return subprocess.CompletedProcess(command, 0, json.dumps(self.probed), "")
+
+    def popen(self, command, **kwargs):
+        self.commands.append(command)
+        self.kwargs = kwargs
+        if self.fails or (self.remux_fails and "copy" in command):
+            kwargs["stderr"].write(b"bad input")
+            return FakeProcess("", 1)
+        with open(command[-1], "wb") as f:
+            f.write(b"mp4")
+        return FakeProcess(PROGRESS, 0)
+
+    def __enter__(self):
+        self.patches = [
+            patch.object(subprocess, "run", side_effect=self.run),
+            patch.object(subprocess, "Popen", side_effect=self.popen),
+        ]
+        for p in self.patches:
+            p.start()
+        return self
+
+    def __exit__(self, *exc):
+        for p in self.patches:
+            p.stop()
+
+
+def test_videos_are_queued_and_transcoded_by_the_worker(video, db_path):
+    source, db = video
+    output = "data/2024/3/1/clip-0.mp4"
+
+    assert convert_video_to_mp4(db, source, output) == output
+    db.commit()
+    assert conversion_status(db, output) == "pending"
+
+    with FakeFFmpeg(probed=HEVC) as ffmpeg:
+        job_queue.run_worker(lambda: sqlite3.connect(db_path), workers=0, once=True)
+
+    (command,) = ffmpeg.commands
+    assert command[command.index("-threads") + 1] == str(video_converter.VIDEO_THREADS)
+    assert command[command.index("-progress") + 1] == "pipe:1"
+    assert ffmpeg.kwargs["preexec_fn"] is not None  # niced
+    assert conversion_status(db, output) == "done"
+    assert conversion_method(db, output) == "encode"
+    assert conversion_progress(db, output) == {
+        "percent": 100.0,
+        "fps": 61.2,
+        "eta": 0,
+        "method": "encode",
+    }
+    assert os.listdir(os.path.dirname(output)) == ["clip-0.mp4"]
+
+
+@pytest.mark.parametrize(
+    "ffmpeg, method, runs",
+    [
+        (FakeFFmpeg(), "remux", 1),
+        (FakeFFmpeg(remux_fails=True), "encode", 2),
+    ],
+)
+def test_web_ready_videos_are_only_remuxed(video, ffmpeg, method, runs):
+    source, db = video
+    output = "data/2024/3/1/clip-0.mp4"
+
+    with ffmpeg:
+        result = video_converter.transcode({"source": source, "output": output})
+
+    assert result == {"output": output, "method": method}
+    assert len(ffmpeg.commands) == runs
+    remux = ffmpeg.commands[0]
+    assert remux[remux.index("-c") + 1] == "copy"
+    assert "+faststart" in remux
+    assert os.path.exists(output)
+
+
+def test_failed_encodes_leave_nothing_behind_and_retry(video, db_path):
+    source, db = video
+    output = "data/2024/3/1/clip-0.mp4"
+    convert_video_to_mp4(db, source, output)
+    db.commit()
+
+    with FakeFFmpeg(probed=HEVC, fails=True):
+        job_queue.run_worker(lambda: sqlite3.connect(db_path), workers=0, once=True)
+
+    (job,) = job_queue.outstanding(db)
+    assert job["status"] == "pending" and "bad input" in job["error"]
+    assert os.listdir(os.path.dirname(output)) == []
+    assert conversion_status(db, output) == "pending"
+
+
+def test_only_the_configured_number_of_encodes_run_at_once(video):
+    _, db = video
+    for n in range(3):
+        convert_video_to_mp4(db, f"images/temp/{n}.mov", f"data/{n}.mp4")
+    job_queue.enqueue(db, "photo", {}, target="data/photo.jpg")
+
+    running = [job_queue.claim(db)]
+    while (job := job_queue.claim(db, job_queue._at_limit(running))) is not None:
+        running.append(job)
+
+    kinds = [job.kind for job in running]
+    assert kinds.count("video") == video_converter.VIDEO_ENCODERS
+    assert "photo" in kinds
+
+
+def test_a_running_stream_job_holds_back_video_encodes(video):
+    _, db = video
+    job_queue.enqueue(db, "streams", {"source": "data/0.mp4", "post": "p.json"})
+    convert_video_to_mp4(db, "images/temp/1.mov", "data/1.mp4")
+    job_queue.enqueue(db, "photo", {}, target="data/photo.jpg")
+
+    streams = job_queue.claim(db)
+    assert streams.kind == "streams"
+    assert {"streams", "video"} <= set(job_queue._at_limit([streams]))
+    assert job_queue.claim(db, job_queue._at_limit([streams])).kind == "photo"
+
+
+def test_publishing_never_transcodes_in_the_request(video, db_path, monkeypatch):
+    upload, db = video
+    monkeypatch.setattr(file_parser, "BACKGROUND_MEDIA", False)
+    assert upload.startswith(file_parser.BULK_UPLOAD_DIR)
+    post = BlogPost(
+        content="",
+        slug="clip",
+        url="/e/2024/3/1/clip",
+        u_uid="uuid-clip",
+        published=datetime(2024, 3, 1, 12, 0, 0),
+        video=[upload],
+    )
+
+    # ffmpeg isn't installed here, and mustn't be needed to publish
+    with patch.object(subprocess, "Popen", side_effect=FileNotFoundError):
+        create_json_entry(post, g=db)
+    db.commit()
+
+    output = os.path.join(file_parser.BLOG_STORAGE, "2024/3/1/", "clip-0.mp4")
+    with open(os.path.join(file_parser.BLOG_STORAGE, "2024/3/1/", "clip.json")) as f:
+        assert json.load(f)["video"] == [output]
+    assert conversion_status(db, output) == "pending"
+
+
+def test_progress_is_parsed_as_ffmpeg_writes_it():
+    first, last = parse_progress(PROGRESS.splitlines(), duration=12.5)
+
+    assert first == {"percent": 40.0, "fps": 60.0, "eta": 3}
+    assert last == {"percent": 100.0, "fps": 61.2, "eta": 0}
+    # without a duration only the speed is known
+    assert next(parse_progress(PROGRESS.splitlines(), None))["percent"] is None
+
+
+def test_timeouts_follow_the_videos_length(monkeypatch):
+    monkeypatch.setattr(video_converter, "VIDEO_TIMEOUT_FACTOR", 20)
+    monkeypatch.setattr(video_converter, "VIDEO_TIMEOUT_MIN", 300)
+    monkeypatch.setattr(video_converter, "VIDEO_TIMEOUT", 7200)
+
+    assert timeout_for(5) == 300
+    assert timeout_for(60) == 1200
+    assert timeout_for(3600) == 7200
+    assert timeout_for(None) == 7200
+
+
+def test_status_endpoint(video, file_client):
+    source, db = video
+    output = "data/2024/3/1/clip-0.mp4"
+    convert_video_to_mp4(db, source, output)
+    db.commit()
+    with file_client.session_transaction() as sess:
+        sess["logged_in"] = True
+
+    response = file_client.get("/video_status/" + output)
+
+    assert response.get_json() == {
+        "path": output,
+        "url": "/" + output,  # not written yet, so there's nothing to fingerprint
+        "status": "pending",
+        "method": None,
+        "progress": None,
+    }
+    assert file_client.get("/video_status/data/missing.mp4").status_code == 404
+
+    with FakeFFmpeg(probed=HEVC):
+        video_converter.transcode({"source": source, "output": output})
+    db.execute("DELETE FROM jobs")
+    db.commit()
+    done = file_client.get("/video_status/" + output).get_json()
+    assert done["status"] == "done"
+    assert done["url"] == media_url(output) and "?v=" in done["url"]
+
+
+def test_published_videos_get_a_poster_and_an_hls_ladder(
+    video, db_path, app, monkeypatch
+):
+    source, db = video
+    monkeypatch.setattr(video_converter, "VIDEO_STREAMING", True)
+    output = "data/2024/3/1/clip-0.mp4"
+    post = "data/2024/3/1/clip.json"
+    os.makedirs(os.path.dirname(post))
+    entry = BlogPost(
+        content="",
+        slug="clip",
+        url="/e/2024/3/1/clip",
+        u_uid="uuid-clip",
+        published=datetime(2024, 3, 1, 12, 0, 0),
+        video=[output],
+    )
+    with open(post, "w") as f:
+        json.dump(entry.model_dump(mode="json"), f)
+    convert_video_to_mp4(db, source, output, post=post)
+    db.commit()
+
+    # media-worker runs its finishers in the app's context
+    with FakeFFmpeg(probed=PORTRAIT_PHONE_MP4) as ffmpeg, app.app_context():
+        job_queue.run_worker(lambda: sqlite3.connect(db_path), workers=0, once=True)
+
+    # the remux, the poster, then one rendition per rung no taller than 720p
+    assert [command[-1] for command in ffmpeg.commands[2:]] == [
+        "data/2024/3/1/.streaming-clip-0-hls/360p.m3u8",
+        "data/2024/3/1/.streaming-clip-0-hls/720p.m3u8",
+    ]
+    with open(post) as f:
+        streams = json.load(f)["video_streams"][output]
+    assert streams == {
+        "playlist": "data/2024/3/1/clip-0-hls/master.m3u8",
+        "poster": "data/2024/3/1/clip-0-poster.jpg",
+        "width": 720,
+        "height": 1280,
+    }
+    with open(streams["playlist"]) as f:
+        master = f.read()
+    assert "RESOLUTION=360x640" in master and "RESOLUTION=720x1280" in master
+    assert "1080p" not in master
+    assert job_queue.outstanding(db) == []
+
+
+def test_players_offer_the_stream_before_the_mp4():
+    video = "data/2024/3/1/clip-0.mp4"
+    streams = {
+        video: VideoStream(
+            playlist="data/2024/3/1/clip-0-hls/master.m3u8",
+            poster="data/2024/3/1/clip-0-poster.jpg",
+            width=720,
+            height=1280,
+        )
+    }
+
+    html = str(video_player(video, streams, class_="rounded"))
+
+    assert 'poster="/data/2024/3/1/clip-0-poster.jpg"' in html
+    assert 'width="720" height="1280"' in html
+    assert html.index("application/vnd.apple.mpegurl") < html.index("video/mp4")
+    plain = str(video_player(video, None))
+    assert plain == (
+        '<video controls ><source src="/data/2024/3/1/clip-0.mp4" '
+        'type="video/mp4"></video>'
+    )